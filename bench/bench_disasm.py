@@ -0,0 +1,60 @@
+# Disassembly of a multi-megabyte ROM dump: reading the .mem text, decoding
+# every word with numpy, and rendering a small range against all of it.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips import assemble_to_images
+from mips.disasm import Disassembly, read_mem
+from mips.formats import write_mem
+
+N = 1 << 20
+REGS = ["$t0", "$t1", "$t2", "$a0", "$a1", "$s0", "$sp", "$ra", "$0"]
+
+def generate(n, seed=0):
+    rnd = random.Random(seed)
+    reg = lambda: rnd.choice(REGS)
+    lines = [".text"]
+
+    for k in range(n):
+        if k % 50 == 0:
+            lines.append(f"L{k}:")
+
+        lines.append(rnd.choice([
+            f"    addu {reg()}, {reg()}, {reg()}",
+            f"    addi {reg()}, {reg()}, {rnd.randint(-300, 300)}",
+            f"    lw {reg()}, {rnd.randint(-64, 64)}({reg()})",
+            f"    beq {reg()}, {reg()}, L{k // 50 * 50}",
+            f"    jal L{rnd.randrange(n) // 50 * 50}",
+            "    nop",
+        ]))
+
+    return "\n".join(lines) + "\n"
+
+_, rom = assemble_to_images(generate(N))
+
+with tempfile.TemporaryDirectory() as tmp:
+    file = os.path.join(tmp, "rom.mem")
+    write_mem(rom, file)
+    print(f"{len(rom) >> 20} MiB of code, {os.path.getsize(file) >> 20} MiB of .mem text")
+
+    start = time.perf_counter()
+    image = read_mem(file)
+    print(f"read:    {time.perf_counter() - start:.3f}s")
+
+start = time.perf_counter()
+disassembly = Disassembly(image)
+print(f"decode:  {time.perf_counter() - start:.3f}s ({len(disassembly.words) / (time.perf_counter() - start):,.0f} words/s)")
+
+start = time.perf_counter()
+lines = list(disassembly.lines(N // 2, N // 2 + 4096))
+print(f"render:  {time.perf_counter() - start:.3f}s for {len(lines)} lines")
+
+start = time.perf_counter()
+lines = list(disassembly.lines())
+elapsed = time.perf_counter() - start
+print(f"all:     {elapsed:.3f}s for {len(lines)} lines ({len(lines) / elapsed:,.0f} lines/s)")
@@ -0,0 +1,66 @@
+# Compares the old construct BitStruct encoding path with mips.encoding.
+# Requires `construct` for the reference path: python3 -m pip install construct
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from construct import BitStruct, BitsInteger
+from mips.encoding import encode_r, encode_i, encode_j
+
+RType = BitStruct(
+    "op" / BitsInteger(6),
+    "rs" / BitsInteger(5),
+    "rt" / BitsInteger(5),
+    "rd" / BitsInteger(5),
+    "shamt" / BitsInteger(5),
+    "funct" / BitsInteger(6)
+)
+
+IType = BitStruct(
+    "op" / BitsInteger(6),
+    "rs" / BitsInteger(5),
+    "rt" / BitsInteger(5),
+    "imm" / BitsInteger(16, signed=True)
+)
+
+JType = BitStruct(
+    "op" / BitsInteger(6),
+    "addr" / BitsInteger(26)
+)
+
+# A mix resembling generated code: few distinct register/immediate combinations
+N = 20000
+workload = [(i % 32, (i * 7) % 32, (i * 13) % 32, (i % 512) - 256) for i in range(N)]
+
+def construct_path():
+    for a, b, c, imm in workload:
+        RType.build(dict(op=0, rs=a, rt=b, rd=c, shamt=0, funct=0x21))
+        IType.build(dict(op=0x9, rs=a, rt=b, imm=imm))
+        JType.build(dict(op=0x2, addr=a << 10))
+
+def packed_path():
+    for a, b, c, imm in workload:
+        encode_r(0, a, b, c, 0, 0x21)
+        encode_i(0x9, a, b, imm)
+        encode_j(0x2, a << 10)
+
+def packed_uncached_path():
+    r, i, j = encode_r.__wrapped__, encode_i.__wrapped__, encode_j.__wrapped__
+    for a, b, c, imm in workload:
+        r(0, a, b, c, 0, 0x21)
+        i(0x9, a, b, imm)
+        j(0x2, a << 10)
+
+for a, b, c, imm in workload[:1000]:
+    assert RType.build(dict(op=0, rs=a, rt=b, rd=c, shamt=0, funct=0x21)) == encode_r(0, a, b, c, 0, 0x21)
+    assert IType.build(dict(op=0x9, rs=a, rt=b, imm=imm)) == encode_i(0x9, a, b, imm)
+    assert JType.build(dict(op=0x2, addr=a << 10)) == encode_j(0x2, a << 10)
+
+base = min(timeit.repeat(construct_path, number=1, repeat=3))
+print(f"construct:        {base:.3f}s ({3 * N / base:,.0f} instr/s)")
+
+for name, fn in (("packed:          ", packed_path), ("packed, no cache:", packed_uncached_path)):
+    t = min(timeit.repeat(fn, number=1, repeat=3))
+    print(f"{name} {t:.3f}s ({3 * N / t:,.0f} instr/s, {base / t:.1f}x)")
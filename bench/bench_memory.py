@@ -0,0 +1,83 @@
+# Memory held by a parsed program: the parsed objects against the compact
+# program table, measured with tracemalloc after parsing generated sources.
+# Both are built once beforehand, so the bounded encoder caches are already
+# full and only what the program itself keeps is counted. The objects took
+# BEFORE bytes/line before they had __slots__, the breakdown shows where
+# the bytes of the table go.
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips.scanner import parse
+from mips.ir import parse_program
+
+# bytes/line of the parsed objects without __slots__
+BEFORE = 216
+
+REGS = ["$t0", "$t1", "$t2", "$a0", "$a1", "$s0", "$sp", "$ra", "$0"]
+
+def generate(n, seed=0):
+    rnd = random.Random(seed)
+    reg = lambda: rnd.choice(REGS)
+    lines = [".data"]
+
+    for k in range(n // 10):
+        lines.append(f"d{k}:")
+        lines.append(f"    .word {rnd.randint(0, 1 << 20)}")
+    lines.append(".text")
+
+    for k in range(n):
+        if k % 50 == 0:
+            lines.append(f"L{k}:")
+
+        lines.append(rnd.choice([
+            f"    addu {reg()}, {reg()}, {reg()}",
+            f"    addi {reg()}, {reg()}, {rnd.randint(-300, 300)}",
+            f"    lw {reg()}, {rnd.randint(-64, 64)}({reg()})",
+            f"    beq {reg()}, {reg()}, L{k // 50 * 50}",
+            f"    li {reg()}, 0x{rnd.randint(0, 0x7fff):x}",
+            f"    la {reg()}, d{rnd.randrange(n // 10)}",
+            "    nop",
+        ]))
+
+    return "\n".join(lines) + "\n"
+
+def retained(build, text):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    result = build(text)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+
+    tracemalloc.stop()
+    del result
+    return size
+
+def breakdown(program, items):
+    # bytes/line of the columns of the table and of the label names
+    columns = [(name, getattr(program, name)) for name in ("kind", "line", "a", "b", "c", "word_kind", "word_sym")]
+    parts = [(name, len(column) * column.itemsize) for name, column in columns]
+    parts.append(("words", len(program.words)))
+    parts.append(("data", len(program.data)))
+
+    names = program.symbols.names
+    parts.append(("labels", sys.getsizeof(names) + sys.getsizeof(program.symbols.ids) + sum(map(sys.getsizeof, names))))
+
+    return ", ".join(f"{name} {size / items:.1f}" for name, size in parts)
+
+for n in (10000, 100000):
+    text = generate(n)
+    items = text.count("\n") - 2
+
+    for name, build in (("objects", parse), ("table", parse_program)):
+        build(text)
+        size = retained(build, text)
+        print(f"{n:>7} instructions, {name:<8} {size / 2**20:7.1f} MiB ({size / items:5.0f} bytes/line, {BEFORE / (size / items):.1f}x less than before)")
+
+print(f"table bytes/line: {breakdown(parse_program(text), items)}")
@@ -0,0 +1,60 @@
+# Parsing throughput in lines/sec of the lark parser and the line scanner
+# on generated sources.
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips.parser import parse as parse_lark, get_parser
+from mips.scanner import parse as parse_scan
+
+REGS = ["$t0", "$t1", "$t2", "$a0", "$a1", "$s0", "$sp", "$ra", "$0"]
+
+def generate(n, seed=0):
+    rnd = random.Random(seed)
+    reg = lambda: rnd.choice(REGS)
+    lines = [".data"]
+
+    for k in range(n // 10):
+        lines.append(f"d{k}:")
+        lines.append(f"    .word {rnd.randint(0, 1 << 20)}")
+    lines.append(".text")
+
+    for k in range(n):
+        if k % 50 == 0:
+            lines.append(f"L{k}:")
+
+        lines.append(rnd.choice([
+            f"    addu {reg()}, {reg()}, {reg()}",
+            f"    addi {reg()}, {reg()}, {rnd.randint(-300, 300)}",
+            f"    lw {reg()}, {rnd.randint(-64, 64)}({reg()})",
+            f"    sw {reg()}, {rnd.randint(-64, 64)}({reg()})  # spill",
+            f"    beq {reg()}, {reg()}, L{k // 50 * 50}",
+            f"    li {reg()}, 0x{rnd.randint(0, 0x7fff):x}",
+            f"    sll {reg()} {reg()} {rnd.randint(0, 31)}",
+            "    nop",
+        ]))
+
+    return "\n".join(lines) + "\n"
+
+def describe(segments):
+    return [(type(line).__name__, str(line)) for segm in segments for line in segm.lines]
+
+get_parser()
+
+for n in (10000, 100000):
+    text = generate(n)
+    lines = text.count("\n")
+
+    results = []
+    for name, parse in (("lark", parse_lark), ("scanner", parse_scan)):
+        start = time.perf_counter()
+        segments = parse(text)
+        elapsed = time.perf_counter() - start
+
+        results.append(describe(segments))
+        print(f"{lines:>7} lines, {name:<8} {elapsed:.2f}s ({lines / elapsed:,.0f} lines/s)")
+
+    assert results[0] == results[1]
@@ -0,0 +1,82 @@
+# Measures the relaxation of mips/relax.py on a large program full of
+# branches close to the end of their range, where every branch that grows
+# pushes others out of range, against checking every unit every round.
+import os
+import sys
+import timeit
+from itertools import accumulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips.assembler import Context, FirstPass
+from mips.image import Image, ImageWriter
+from mips.ir import parse_program
+from mips.relax import Relaxation, relax_program, _fit
+
+N = 200000
+STEP = 0x7FF0
+
+def source():
+    lines = [".text"]
+    for i in range(N):
+        if i % 64 == 0:
+            lines.append(f"L{i}:")
+        if i % 16 == 0:
+            # a branch to the label about STEP words ahead, or behind
+            target = (i + STEP if (i // 16) % 2 else i - STEP) // 64 * 64
+            lines.append(f"    bne $t0, $t1, L{min(max(target, 0), N - 64)}")
+        elif i % 997 == 0:
+            lines.append(f"    la $t2, L{i // 64 * 64}")
+        else:
+            lines.append("    addu $t0, $t0, $t1")
+    return "\n".join(lines) + "\n"
+
+text = source()
+
+def first_pass():
+    program = parse_program(text)
+    ctx = Context(ImageWriter(Image()), ImageWriter(Image(4)))
+    FirstPass(ctx).run(program)
+
+    return program, ctx._labels
+
+def naive(relaxation: Relaxation, labels):
+    # every unit checked every round until nothing grows
+    kinds, pos, run = relaxation.kind, relaxation.pos, relaxation.run
+    growth = [0] * len(kinds)
+    targets = [relaxation.labels.get(name, (labels.get(name), 0, 0)) for name in relaxation.names]
+    rounds = 0
+
+    while True:
+        rounds = rounds + 1
+        prefix = list(accumulate(growth, initial=0))
+        grew = False
+
+        for unit in range(len(kinds)):
+            addr, first, before = targets[unit]
+            pc = pos[unit] + prefix[unit] - prefix[run[unit]]
+            size, _ = _fit(kinds[unit], growth[unit] + 1, pc, addr + prefix[before] - prefix[first])
+
+            if size != growth[unit] + 1:
+                growth[unit] = size - 1
+                grew = True
+
+        if not grew:
+            return growth, rounds
+
+program, labels = first_pass()
+words = len(program.word_kind)
+relaxation = relax_program(program, dict(labels))
+growth, rounds = naive(relaxation, labels)
+
+assert [g + 1 for g in growth] == list(relaxation.sizes)
+print(f"{len(relaxation.kind):,} units, {words:,} words before relaxing, {len(program.word_kind):,} after")
+print(f"rounds: {relaxation.rounds}, naive: {rounds}")
+
+t = min(timeit.repeat(lambda: relaxation.solve(dict(labels)), number=1, repeat=3))
+base = min(timeit.repeat(lambda: naive(relaxation, labels), number=1, repeat=3))
+print(f"solve:  {t:.3f}s, naive: {base:.3f}s ({base / t:.1f}x)")
+
+base = min(timeit.repeat(first_pass, number=1, repeat=3))
+t = min(timeit.repeat(lambda: relax_program(*first_pass()), number=1, repeat=3)) - base
+print(f"relax_program: {t:.3f}s (parse and first pass: {base:.3f}s)")
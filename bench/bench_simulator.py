@@ -0,0 +1,56 @@
+# Simulated instructions per second of mips.simulator on a loop program:
+# a checksum over a table in RAM, rewritten on every pass, with a call in
+# the inner loop. The time includes decoding the blocks.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips import assemble_to_images
+from mips.simulator import Simulator
+
+PASSES = 2000
+WORDS = 256
+
+source = f""".data
+table: .space {4 * WORDS}
+.text
+main:
+    addiu $s0, $0, {PASSES}
+    addu $v0, $0, $0
+outer:
+    la $a0, table
+    addiu $t1, $0, {WORDS}
+inner:
+    lw $t2, 0($a0)
+    jal mix
+    sw $t2, 0($a0)
+    addiu $a0, $a0, 4
+    addiu $t1, $t1, -1
+    bne $t1, $0, inner
+    addiu $s0, $s0, -1
+    bne $s0, $0, outer
+halt:
+    j halt
+mix:
+    addu $t2, $t2, $t1
+    sll $t3, $t2, 3
+    srl $t4, $t2, 5
+    nor $t3, $t3, $t4
+    addu $v0, $v0, $t3
+    slt $t5, $v0, $t2
+    or $v0, $v0, $t5
+    jr $ra
+"""
+
+ram, rom = assemble_to_images(source)
+
+sim = Simulator(ram, rom)
+
+start = time.perf_counter()
+steps = sim.run()
+elapsed = time.perf_counter() - start
+
+assert sim.halted
+print(f"{steps:,} instructions in {elapsed:.3f}s ({steps / elapsed:,.0f} instr/s), {len(sim._blocks)} blocks")
@@ -0,0 +1,41 @@
+# Measures interpreter startup for `import mips` and a trivial assembly,
+# with a cold and a warm parser table cache.
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUNS = 20
+
+def timed(cmd, env, cwd):
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+with tempfile.TemporaryDirectory() as tmp:
+    with open(os.path.join(tmp, "tiny.s"), "w") as f:
+        f.write(".text\n    addu $a0, $0, $0\n")
+
+    env = dict(os.environ, PYTHONPATH=root, MIPSASM_CACHE_DIR=os.path.join(tmp, "cache"))
+    assemble = [sys.executable, os.path.join(root, "mipsasm.py"), "tiny.s"]
+
+    print(f"python -c pass:      {timed([sys.executable, '-c', 'pass'], env, tmp) * 1000:.1f}ms")
+    print(f"import mips:         {timed([sys.executable, '-c', 'import mips'], env, tmp) * 1000:.1f}ms")
+
+    cold = None
+    for _ in range(RUNS):
+        with tempfile.TemporaryDirectory() as cache:
+            start = time.perf_counter()
+            subprocess.run(assemble, env=dict(env, MIPSASM_CACHE_DIR=cache), cwd=tmp, check=True, stdout=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            cold = elapsed if cold is None else min(cold, elapsed)
+
+    print(f"assemble, no cache:  {cold * 1000:.1f}ms")
+    print(f"assemble, cached:    {timed(assemble, env, tmp) * 1000:.1f}ms")
@@ -1 +1,16 @@
-from .assembler import Assembler
+# The modules are imported on first use, so that a client of the daemon
+# (mips.daemon) doesn't load the assembler itself
+_exports = {
+    "Assembler": ".assembler",
+    "assemble_to_images": ".assembler",
+    "assemble_files": ".pool",
+    "IncrementalAssembler": ".incremental",
+    "Simulator": ".simulator",
+}
+
+def __getattr__(name):
+    if name in _exports:
+        import importlib
+        return getattr(importlib.import_module(_exports[name], __name__), name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,48 +1,86 @@
-import io
-from .parser import parse
+import sys
 from .parsetypes import *
-from .instructions import Instruction
+from .instructions import Instruction, _half
+from .ir import Program, LABEL, MEMLABEL, DECL, INSTR
+from .image import Image, ImageWriter, zero_blocks
+from .output import OutputFile
 from typing import Dict
 
 class MemoryFile:
+    BUFFER_SIZE = 1 << 20
+
     def __init__(self, filename, cell_size = 1, align = None):
-        self.file = io.open(filename, "w")
+        # "-" writes to stdout, files are only replaced if they change
+        self._owns_file = filename != "-"
+        self.file = OutputFile(filename, buffering=self.BUFFER_SIZE) if self._owns_file else sys.stdout
         self.addr = 0
         self.cell_size = cell_size
         self.align = align
+        # also records the bytes written, when set
+        self.image = None
+
+    def _format(self, data):
+        # cells are space separated, then every `align`-th separator
+        # is turned into a newline
+        align = self.align or 1
+
+        if align == 1:
+            return data.hex("\n", self.cell_size)
 
-    def _write_cell(self, cell):
-        self.file.write(cell.hex())
+        text = bytearray(data.hex(" ", self.cell_size), "ascii")
+        width = align * (2 * self.cell_size + 1)
+        text[width - 1::width] = b"\n" * len(range(width - 1, len(text), width))
 
-        self.addr = self.addr + 1
+        return text.decode("ascii")
 
     def write_bytes(self, bytes, comment=None):
         if len(bytes) % self.cell_size:
             raise Exception("Bytes not multiple of cell size!")
 
-        align = self.align or 1
-
-        cells = [bytes[i:i+self.cell_size] for i in range(0, len(bytes), self.cell_size)]
-        aligned = [cells[i:i+align] for i in range(0, len(cells), align)]
+        data = memoryview(bytes).cast('B')
+        if self.image is not None and len(data):
+            self.image.write(self.addr * self.cell_size, data)
 
-        for line in aligned[:-1]:
-            for cell in line[:-1]:
-                self._write_cell(cell)
-                self.file.write(" ")
+        # whole lines per chunk, so chunks join with a plain newline
+        step = (self.BUFFER_SIZE // 4) * self.cell_size * (self.align or 1)
 
-            self._write_cell(line[-1])
-            self.file.write("\n")
-        
-        for cell in aligned[-1][:-1]:
-            self._write_cell(cell)
-            self.file.write(" ")
+        for i in range(0, len(data) - step, step):
+            self.file.write(self._format(data[i:i + step]) + "\n")
 
-        self._write_cell(aligned[-1][-1])
+        text = self._format(data[(len(data) - 1) // step * step:])
 
         if comment is not None:
-            self.file.write(f" // {comment}")
-        
-        self.file.write('\n')
+            text = f"{text} // {comment}"
+
+        self.file.write(text + "\n")
+        self.addr = self.addr + len(bytes) // self.cell_size
+
+    def fill(self, size):
+        # the blocks are whole lines, so lines stay aligned
+        for block in zero_blocks(size):
+            self.write_bytes(block)
+
+    def write_image(self, image: Image):
+        # in the writes of the ImageWriter of the image, when it has them
+        layout = image.layout
+
+        for i in range(0, len(layout), 2):
+            start, end = layout[i], layout[i + 1]
+
+            if end < 0:
+                self.set_addr(start)
+            else:
+                found = image.find(start)
+                self.write_bytes(memoryview(found[1])[start - found[0]:end - found[0]])
+
+        if layout:
+            return
+
+        for addr, data in image.extents:
+            if addr != self.addr * self.cell_size:
+                self.set_addr(addr // self.cell_size)
+
+            self.write_bytes(data)
 
     def write_comment(self, comment):
         self.file.write(f"// {comment}\n")
@@ -52,11 +90,16 @@ class MemoryFile:
         self.addr = addr
 
     def close(self):
-        self.file.close()
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
 
 class Context:
     def __init__(self, ram: MemoryFile, rom: MemoryFile, debug=False):
         self._labels: Dict[str, int] = dict()
+        # segment of every label
+        self._segments: Dict[str, str] = dict()
         self.ram = ram
         self.rom = rom
         self.debug = debug
@@ -67,23 +110,59 @@ class Context:
 
         raise Exception(f"Label is not defined: {label}")
 
-    def set_label(self, label, val):
+    def set_label(self, label, val, segm=None):
         if label in self._labels:
             raise Exception(f"Label is already defined: {label}")
 
         self._labels[label] = val
+        self._segments[label] = segm
+
+    def image_labels(self, ram: Image, rom: Image):
+        # the labels of every segment into the image of the segment
+        for label, val in self._labels.items():
+            (rom if self._segments[label] == 'text' else ram).labels[label] = val
+
+    # offset is the word of the jump in its instruction, past rom.addr
 
-    def relative_jmp(self, label):
-        return self.get_label(label) - self.rom.addr
+    def relative_jmp(self, label, offset=0):
+        return self.get_label(label) - (self.rom.addr + offset)
 
-    def absolute_jmp(self, label):
+    def absolute_jmp(self, label, offset=0):
         new_pc = self.get_label(label)
 
-        if self.rom.addr >> 26 == new_pc >> 26:
+        if (self.rom.addr + offset) >> 26 == new_pc >> 26:
             return ~((-1) << 26) & new_pc
         
         raise Exception(f"Jump to label {label} is too far")
 
+    def short_value(self, label):
+        val = self.get_label(label)
+
+        if val > 0xFFFF:
+            raise Exception(f"Label {label} does not fit in 16 bits")
+
+        return _half(val)
+
+    def resolve_row(self, row, offset=0):
+        # offset is the word of the row in its instruction
+        kind = row[0]
+
+        # the halves are given as the signed 16 bit field
+        if kind == "rel":
+            return ("i",) + row[1:-1] + (self.relative_jmp(row[-1], offset),)
+        if kind == "lo":
+            return ("i",) + row[1:-1] + (_half(self.get_label(row[-1])),)
+        if kind == "hi":
+            return ("i",) + row[1:-1] + (_half(self.get_label(row[-1]) >> 16),)
+        if kind == "val":
+            return ("i",) + row[1:-1] + (self.short_value(row[-1]),)
+        if kind == "abs":
+            return ("j", row[1], self.absolute_jmp(row[-1], offset))
+        if kind == "raw":
+            return ("j", row[1], self.get_label(row[-1]))
+
+        return row
+
 class FirstPass:
     def __init__(self, ctx: Context):
         self.ctx = ctx
@@ -106,7 +185,7 @@ class FirstPass:
         self.data_addr = self.data_addr + len(line)
 
     def visit_Label(self, lbl: Label):
-        self.ctx.set_label(lbl.name, self.data_addr)
+        self.ctx.set_label(lbl.name, self.data_addr if self.segm == 'data' else self.text_addr, self.segm)
 
     def visit_MemLabel(self, lbl: MemLabel):
         if self.segm == 'data':
@@ -117,10 +196,40 @@ class FirstPass:
     def visit_Instruction(self, instr: Instruction):
         self.text_addr = self.text_addr + len(instr)
 
+    def run(self, program: Program):
+        # the same as visiting the parsed objects, over the program table
+        ctx = self.ctx
+        names = program.symbols.names
+        item = 0
+
+        try:
+            for item, (kind, a, b, c) in enumerate(zip(program.kind, program.a, program.b, program.c)):
+                if kind == INSTR:
+                    self.text_addr = self.text_addr + b
+                elif kind == DECL:
+                    self.data_addr = self.data_addr + c
+                elif kind == LABEL:
+                    ctx.set_label(names[a], self.data_addr if self.segm == 'data' else self.text_addr, self.segm)
+                elif kind == MEMLABEL:
+                    if self.segm == 'data':
+                        self.data_addr = a
+                    else:
+                        self.text_addr = a
+                elif a == 0:
+                    self.data_addr = ctx.ram.addr
+                    self.segm = 'data'
+                else:
+                    self.text_addr = ctx.rom.addr
+                    self.segm = 'text'
+        except Exception as ex:
+            raise program.error(item, ex)
+
 class SecondPass:
-    def __init__(self, ctx: Context, debug):
+    def __init__(self, ctx: Context, debug, workers=None):
         self.ctx = ctx
         self.debug = debug
+        # for the parallel encoding of large programs, None is one per cpu
+        self.workers = workers
 
     def visit_DataSegment(self, segm: DataSegment):
             if self.debug:
@@ -138,15 +247,20 @@ class SecondPass:
             for line in segm.lines:
                 line.accept(self)
 
-    def visit_Decl(self, line: Decl):
-        b = line.to_bytes()
-        
+    def write_decl(self, b, size, comment=None):
+        # the bytes of a declaration, then zeros up to its size
         if self.debug:
-            self.ctx.ram.write_bytes(b, comment=line)
-            print(b.hex(), line)
-        else:
+            self.ctx.ram.write_bytes(b, comment=comment)
+            print(b.hex(), comment)
+        elif len(b):
             self.ctx.ram.write_bytes(b)
 
+        if size > len(b):
+            self.ctx.ram.fill(size - len(b))
+
+    def visit_Decl(self, line: Decl):
+        self.write_decl(line.to_bytes(), len(line), line)
+
     def visit_Label(self, lbl: Label):
         if self.debug:
             print(lbl)
@@ -174,44 +288,193 @@ class SecondPass:
         else:
             self.ctx.rom.write_bytes(b)
 
+    def run(self, program: Program, runs=None):
+        ctx = self.ctx
+        names = program.symbols.names
+
+        # without debug comments the text segment is encoded in runs of
+        # instructions, see mips/chunks.py
+        if self.debug:
+            runs = dict()
+        elif runs is None:
+            from .chunks import encode_runs
+            runs = encode_runs(program, ctx, self.workers)
+
+        item = 0
+
+        try:
+            while item < len(program):
+                kind, a = program.kind[item], program.a[item]
+
+                if item in runs:
+                    last, b, error = runs[item]
+
+                    if b:
+                        try:
+                            ctx.rom.write_bytes(b)
+                        except Exception as ex:
+                            raise program.error(item, ex)
+                    if error is not None:
+                        raise error
+
+                    item = last
+                    continue
+
+                if kind == INSTR:
+                    b = program.instr_bytes(ctx, item)
+
+                    if self.debug:
+                        print(b.hex(), program.comment(item))
+                        ctx.rom.write_bytes(b, comment=program.comment(item))
+                    else:
+                        ctx.rom.write_bytes(b)
+                elif kind == DECL:
+                    self.write_decl(program.decl_bytes(item), program.c[item], program.comment(item))
+                elif kind == LABEL:
+                    self.visit_Label(Label(names[a]))
+                elif kind == MEMLABEL:
+                    self.visit_MemLabel(MemLabel(a))
+                elif a == 0:
+                    self.visit_DataSegment(DataSegment([]))
+                else:
+                    self.visit_TextSegment(TextSegment([]))
+
+                item = item + 1
+        except Exception as ex:
+            if item in runs:
+                # already carries the line of the instruction
+                raise
+
+            raise program.error(item, ex)
+
 class Assembler:
-    def __init__(self, outram, outrom, debug=False):
+    ROM_CELL_SIZE = 4
+    RAM_ALIGN = 4
+
+    def __init__(self, outram, outrom, debug=False, batch=False, workers=None, schedule=False, delay_slots=False):
         self._debug = debug
-        self._rom = MemoryFile(outrom, cell_size=4)
-        self._ram = MemoryFile(outram, align=4)
+        self._batch = batch
+        self._workers = workers
+        # load-use scheduling and delay slots (mips/schedule.py), how it
+        # went once assembled
+        self._schedule = schedule
+        self._delay_slots = delay_slots
+        self.schedule = None
+        self._rom = MemoryFile(outrom, cell_size=self.ROM_CELL_SIZE)
+        self._ram = MemoryFile(outram, align=self.RAM_ALIGN)
 
     def assemble(self, lines):
+        # the images stay available for other output formats
+        ram, rom = self.images = Image(), Image(self.ROM_CELL_SIZE)
+
+        if self._debug:
+            # the comments of the debug output are written as they come
+            self._ram.image, self._rom.image = ram, rom
+            ctx = Context(self._ram, self._rom, debug=True)
+            self.schedule = _assemble(ctx, lines, True, False, self._workers, self._schedule, self._delay_slots)
+        else:
+            try:
+                ctx = Context(ImageWriter(ram, self._ram.addr, self.RAM_ALIGN), ImageWriter(rom, self._rom.addr))
+                self.schedule = _assemble(ctx, lines, False, self._batch, self._workers, self._schedule, self._delay_slots)
+            finally:
+                # after an error, what was assembled before it
+                self._ram.write_image(ram)
+                self._rom.write_image(rom)
+
+        ctx.image_labels(ram, rom)
+
+    def assemble_stream(self, lines):
+        # lines is any iterable of source lines, e.g. an open file or stdin
+        from .stream import assemble_stream
+
         ctx = Context(self._ram, self._rom, debug=self._debug)
-        segments = parse(lines)
+        assemble_stream(ctx, lines, debug=self._debug)
+
+    def finalize(self):
+        self._rom.close()
+        self._ram.close()
+
+def _assemble(ctx, lines, debug, batch, workers, schedule=False, delay_slots=False):
+    # returns the Schedule of the program, when scheduled or with delay slots
+    # lark is only imported when the scanner needs to fall back to it
+    from .scanner import parse
+    from .parallel_parse import parse_program
 
-        # first pass
-        first_pass = FirstPass(ctx)
+    batch = batch and not debug
 
+    # the batch encoder works on the parsed objects, everything else
+    # on the compact program table
+    if batch:
+        # {item: line} for the errors of the second pass
+        linenos = dict()
+        segments = parse(lines, linenos)
+    else:
+        program = parse_program(lines, debug, workers)
+
+    # every branch and jump gets a delay slot before the addresses are set
+    result = None
+    if delay_slots:
+        from .schedule import fill_program, fill_segments
+
+        result = fill_segments(segments) if batch else fill_program(program)
+
+    # first pass
+    first_pass = FirstPass(ctx)
+
+    if batch:
         for segm in segments:
             segm.accept(first_pass)
+    else:
+        first_pass.run(program)
 
-        if self._debug:
-            print("First pass complete!")
-            print("=" * 20)
-            print("Labels:")
-            print("-" * 20)
-            for lbl, val in ctx._labels.items():
-                print(f"{val.to_bytes(4, 'big').hex()}: {lbl}")
+    # la, branches and jumps grow to the size their labels need
+    from .relax import relax_program, relax_segments
+
+    if batch:
+        relax_segments(segments, ctx._labels, ctx.rom.addr, delay_slots)
+    else:
+        relax_program(program, ctx._labels, ctx.rom.addr, delay_slots)
 
-            print("=" * 20)
-                    
+    if schedule:
+        from .schedule import schedule_program, schedule_segments
+
+        if batch:
+            result = schedule_segments(segments, result, delay_slots)
+        else:
+            result = schedule_program(program, result, delay_slots)
 
-        # second pass
-        second_pass = SecondPass(ctx, self._debug)
+    if debug:
+        print("First pass complete!")
+        print("=" * 20)
+        print("Labels:")
+        print("-" * 20)
+        for lbl, val in ctx._labels.items():
+            print(f"{val.to_bytes(4, 'big').hex()}: {lbl}")
+
+        print("=" * 20)
+
+    # second pass
+    if batch:
+        from .batch import BatchSecondPass
+        second_pass = BatchSecondPass(ctx, linenos)
 
         for segm in segments:
             segm.accept(second_pass)
+    else:
+        SecondPass(ctx, debug, workers).run(program)
 
+    if debug:
+        print("=" * 20)
+        print("Second pass complete!")
 
-        if self._debug:
-            print("=" * 20)
-            print("Second pass complete!")
+    return result
 
-    def finalize(self):
-        self._rom.close()
-        self._ram.close()
\ No newline at end of file
+def assemble_to_images(lines, batch=False, workers=None, schedule=False, delay_slots=False):
+    # (ram, rom) images of a source, nothing is written to files
+    ram, rom = Image(), Image(Assembler.ROM_CELL_SIZE)
+    ctx = Context(ImageWriter(ram, align=Assembler.RAM_ALIGN), ImageWriter(rom))
+
+    _assemble(ctx, lines, False, batch, workers, schedule, delay_slots)
+    ctx.image_labels(ram, rom)
+
+    return ram, rom
@@ -0,0 +1,172 @@
+import numpy as np
+from mips.assembler import SecondPass
+from mips.encoding import RType, IType, JType, _out_of_range
+from mips.parsetypes import *
+from mips.instructions import Instruction
+from mips.relax import Relaxed
+
+_i_kinds = ("i", "rel", "lo", "hi", "val")
+_j_kinds = ("j", "abs", "raw")
+
+def _check(fmt, cols):
+    bad = np.zeros(len(cols[0]), dtype=bool)
+
+    for (name, bits, signed), col in zip(fmt, cols):
+        if signed:
+            bad |= (col < -(1 << (bits - 1))) | (col >= (1 << (bits - 1)))
+        else:
+            bad |= (col < 0) | (col >= (1 << bits))
+
+    if bad.any():
+        idx = int(np.argmax(bad))
+        _out_of_range(fmt, [int(col[idx]) for col in cols])
+
+class TextBatch:
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.label_ids = dict()
+
+        self.r = []
+        self.i = []
+        self.j = []
+        # Format of every encoded word, in output order
+        self.order = []
+
+    def _label_id(self, name):
+        if name not in self.label_ids:
+            self.ctx.get_label(name)
+            self.label_ids[name] = len(self.label_ids)
+
+        return self.label_ids[name]
+
+    def add(self, instr: Instruction, pc):
+        for offset, row in enumerate(instr.rows()):
+            kind = row[0]
+
+            if kind == "r":
+                self.order.append(0)
+                self.r.append(row[1:])
+            elif kind in _i_kinds:
+                self.order.append(1)
+                if kind == "i":
+                    self.i.append(row[1:] + (0, 0, pc + offset))
+                else:
+                    self.i.append(row[1:-1] + (0, self._label_id(row[-1]), _i_kinds.index(kind), pc + offset))
+            else:
+                self.order.append(2)
+                if kind == "j":
+                    self.j.append(row[1:] + (0, 0, pc + offset))
+                else:
+                    self.j.append((row[1], 0, self._label_id(row[-1]), _j_kinds.index(kind), pc + offset))
+
+    def _label_addrs(self):
+        addrs = np.zeros(len(self.label_ids), dtype=np.int64)
+        for name, idx in self.label_ids.items():
+            addrs[idx] = self.ctx.get_label(name)
+
+        return addrs
+
+    def encode(self):
+        labels = self._label_addrs()
+        words = []
+
+        if self.r:
+            op, rs, rt, rd, shamt, funct = np.array(self.r, dtype=np.int64).T
+            _check(RType, (op, rs, rt, rd, shamt, funct))
+            words.append((0, (op << 26) | (rs << 21) | (rt << 16) | (rd << 11) | (shamt << 6) | funct))
+
+        if self.i:
+            op, rs, rt, imm, lbl, kind, pc = np.array(self.i, dtype=np.int64).T
+            target = labels[lbl] if len(labels) else np.zeros_like(imm)
+
+            long = (kind == 4) & (target > 0xFFFF)
+            if long.any():
+                name = next(n for n, i in self.label_ids.items() if i == lbl[np.argmax(long)])
+                raise Exception(f"Label {name} does not fit in 16 bits")
+
+            # the halves are given as the signed 16 bit field
+            imm = np.select(
+                [kind == 1, (kind == 2) | (kind == 4), kind == 3],
+                [target - pc, ((target & 0xFFFF) ^ 0x8000) - 0x8000, (((target >> 16) & 0xFFFF) ^ 0x8000) - 0x8000],
+                imm
+            )
+            _check(IType, (op, rs, rt, imm))
+            words.append((1, (op << 26) | (rs << 21) | (rt << 16) | (imm & 0xFFFF)))
+
+        if self.j:
+            op, addr, lbl, kind, pc = np.array(self.j, dtype=np.int64).T
+            target = labels[lbl] if len(labels) else np.zeros_like(addr)
+
+            far = (kind == 1) & ((pc >> 26) != (target >> 26))
+            if far.any():
+                name = next(n for n, i in self.label_ids.items() if i == lbl[np.argmax(far)])
+                raise Exception(f"Jump to label {name} is too far")
+
+            addr = np.select([kind == 1, kind == 2], [target & ((1 << 26) - 1), target], addr)
+            _check(JType, (op, addr))
+            words.append((2, (op << 26) | addr))
+
+        order = np.array(self.order, dtype=np.int8)
+        out = np.empty(len(order), dtype='>u4')
+        for fmt, group in words:
+            out[order == fmt] = group
+
+        return out
+
+# Encodes the whole text segment at once, output is the same as SecondPass without debug
+class BatchSecondPass(SecondPass):
+    def __init__(self, ctx, linenos=None):
+        super().__init__(ctx, False)
+        # {item: line} from the scanner, errors name the line of the item
+        self.linenos = linenos or dict()
+
+    def error(self, line, ex):
+        if isinstance(line, Relaxed):
+            line = line.instr
+
+        lineno = self.linenos.get(line)
+        return Exception(f"line {lineno}: {ex}") if lineno else ex
+
+    def visit_DataSegment(self, segm: DataSegment):
+        self.segm = 'data'
+
+        for line in segm.lines:
+            try:
+                line.accept(self)
+            except Exception as ex:
+                raise self.error(line, ex)
+
+    def visit_TextSegment(self, segm: TextSegment):
+        self.segm = 'text'
+
+        batch = TextBatch(self.ctx)
+        # (word index, new address) for every @addr line
+        jumps = []
+        # {word index: instruction} of the first instruction of every run,
+        # a run that overlaps is reported at it like in SecondPass.run
+        firsts = dict()
+        pc = self.ctx.rom.addr
+
+        for line in segm.lines:
+            if isinstance(line, MemLabel):
+                jumps.append((len(batch.order), line.addr))
+                pc = line.addr
+            elif isinstance(line, Instruction):
+                firsts.setdefault(len(batch.order), line)
+                batch.add(line, pc)
+                pc = pc + len(line)
+
+        words = batch.encode()
+        start = 0
+
+        for end, addr in jumps + [(len(words), None)]:
+            if end > start:
+                try:
+                    self.ctx.rom.write_bytes(words[start:end].tobytes())
+                except Exception as ex:
+                    raise self.error(firsts[start], ex)
+
+            if addr is not None:
+                self.ctx.rom.set_addr(addr)
+
+            start = end
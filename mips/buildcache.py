@@ -0,0 +1,227 @@
+import hashlib
+import os
+import pickle
+from os import path
+
+# Persistent cache of assembled outputs, keyed by the source, the assembler
+# itself and the output options. Entries are written under a private name
+# and renamed into place, a hit touches the entry and the least recently
+# used entries are removed once the cache grows past its size.
+
+DEFAULT_SIZE = 256 << 20
+
+_version = None
+
+def assembler_version():
+    # a hash of the assembler sources and grammar, any change is a new version
+    global _version
+
+    if _version is None:
+        digest = hashlib.sha256()
+        package = path.dirname(path.abspath(__file__))
+
+        for name in sorted(os.listdir(package)):
+            if name.endswith((".py", ".lark")):
+                with open(path.join(package, name), "rb") as f:
+                    digest.update(name.encode() + b"\0" + f.read() + b"\0")
+
+        _version = digest.hexdigest()
+
+    return _version
+
+def _lock(fd):
+    # where there are no file locks, concurrent counts can get lost
+    try:
+        import fcntl
+    except ImportError:
+        return
+
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+def _read_count(fd):
+    # the count in decimal, 0 for a new counter
+    try:
+        return int(os.read(fd, 64))
+    except ValueError:
+        return 0
+
+class BuildCache:
+    def __init__(self, directory, max_size=DEFAULT_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source: bytes, **options):
+        digest = hashlib.sha256(assembler_version().encode())
+        digest.update(repr(sorted(options.items())).encode())
+        digest.update(source)
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return path.join(self.directory, f"{key}.entry")
+
+    def _count(self, name):
+        # the count in decimal, updated under a lock so that the counts of
+        # concurrent builds don't get lost
+        fd = os.open(path.join(self.directory, name), os.O_RDWR | os.O_CREAT)
+        try:
+            _lock(fd)
+            count = _read_count(fd) + 1
+
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, str(count).encode())
+        finally:
+            # and unlocked
+            os.close(fd)
+
+    def get(self, key):
+        # {output name: bytes}, None when not cached
+        try:
+            with open(self._entry(key), "rb") as f:
+                outputs = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._count("misses")
+            return None
+
+        try:
+            os.utime(self._entry(key))
+        except OSError:
+            pass
+
+        self._count("hits")
+        return outputs
+
+    def put(self, key, outputs):
+        tmp_file = f"{self._entry(key)}.{os.getpid()}.tmp"
+
+        with open(tmp_file, "wb") as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_file, self._entry(key))
+        self.evict()
+
+    def _entries(self):
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if name.endswith(".entry"):
+                try:
+                    st = os.stat(path.join(self.directory, name))
+                except OSError:
+                    # removed by another build
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, name))
+
+        return entries
+
+    def evict(self):
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+
+        for _, entry_size, name in entries:
+            if size <= self.max_size:
+                break
+
+            try:
+                os.remove(path.join(self.directory, name))
+            except OSError:
+                pass
+
+            size = size - entry_size
+
+    def stats(self):
+        counts = []
+        for name in ("hits", "misses"):
+            try:
+                fd = os.open(path.join(self.directory, name), os.O_RDONLY)
+            except OSError:
+                counts.append(0)
+                continue
+
+            try:
+                counts.append(_read_count(fd))
+            finally:
+                os.close(fd)
+
+        entries = self._entries()
+        return {"hits": counts[0], "misses": counts[1], "entries": len(entries), "size": sum(entry[1] for entry in entries)}
+
+def _incbin_digests(text):
+    # the files included by the source are part of the key
+    from .scanner import incbin_paths
+
+    digests = []
+    for file in incbin_paths(text):
+        digest = hashlib.sha256()
+
+        try:
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except OSError:
+            # the assembler reports it
+            digests.append((file, None))
+            continue
+
+        digests.append((file, digest.hexdigest()))
+
+    return digests
+
+def assemble_cached(cache: BuildCache, source: bytes, outputs, assemble, files=None, **options):
+    # outputs is {name: path}, assemble() writes them and returns the other
+    # files it wrote, which are cached along and added to the list files.
+    # Returns True on a hit
+    key = cache.key(source, outputs=sorted(outputs), **options)
+    cached = cache.get(key)
+
+    if cached is not None:
+        from .output import OutputFile
+
+        restored = [(file, cached[name]) for name, file in outputs.items()] + list(cached.get("files", dict()).items())
+        for file, data in restored:
+            with OutputFile(file, binary=True) as f:
+                f.write(data)
+
+        if files is not None:
+            files += cached.get("files", ())
+
+        return True
+
+    written = assemble() or []
+
+    contents = {"files": dict()}
+    for name, file in list(outputs.items()) + [(None, file) for file in written]:
+        with open(file, "rb") as f:
+            if name is None:
+                contents["files"][file] = f.read()
+            else:
+                contents[name] = f.read()
+
+    if files is not None:
+        files += written
+
+    cache.put(key, contents)
+    return False
+
+def assemble_files_cached(cache: BuildCache, text, ram, rom, debug=False, batch=False, workers=None, outputs=(), files=None):
+    # Assembler.assemble through the cache, returns True on a hit. outputs
+    # are the other formats written, as for mips.formats.write_outputs, and
+    # their files are added to files
+    from .assembler import Assembler
+    from .formats import write_outputs, normalize_outputs
+
+    def assemble():
+        asm = Assembler(ram, rom, debug=debug, batch=batch, workers=workers)
+
+        try:
+            asm.assemble(text)
+        finally:
+            asm.finalize()
+
+        return write_outputs(*asm.images, outputs)
+
+    return assemble_cached(cache, text.encode(), {"ram": ram, "rom": rom}, assemble, files,
+        debug=debug, rom_cell_size=Assembler.ROM_CELL_SIZE, ram_align=Assembler.RAM_ALIGN,
+        incbin=_incbin_digests(text), formats=normalize_outputs(outputs))
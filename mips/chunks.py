@@ -0,0 +1,143 @@
+import os
+from .assembler import Context
+from .pool import executor
+from .ir import Program, SEGMENT, MEMLABEL, INSTR
+
+# Second pass encoding of the text segment in chunks. Once the labels are
+# known, the words of an instruction only depend on its address, so runs
+# of contiguous addresses are encoded independently, in parallel for large
+# programs, and written out in order.
+
+# Instructions in a program before the chunks are encoded in parallel
+PARALLEL_THRESHOLD = 1 << 17
+CHUNK_SIZE = 1 << 15
+
+class _Pc:
+    __slots__ = ("addr",)
+
+    def __init__(self, addr):
+        self.addr = addr
+
+def _encode_items(program: Program, ctx, first, last):
+    out = bytearray()
+
+    for item in range(first, last):
+        if program.kind[item] != INSTR:
+            continue
+
+        try:
+            b = program.instr_bytes(ctx, item)
+        except Exception as ex:
+            return bytes(out), program.error(item, ex)
+
+        out += b
+        ctx.rom.addr = ctx.rom.addr + program.b[item]
+
+    return bytes(out), None
+
+def encode_chunk(program: Program, labels, first, last, pc):
+    # returns the bytes of the instructions in [first, last) and the error
+    # that stopped the encoding, if any
+    ctx = Context(None, _Pc(pc))
+    ctx._labels = labels
+
+    if program.objects:
+        # instructions that failed to encode have no words in the table
+        return _encode_items(program, ctx, first, last)
+
+    instrs = [item for item in range(first, last) if program.kind[item] == INSTR]
+    if not instrs:
+        return b"", None
+
+    # the words of the chunk are contiguous, only the ones using labels change
+    base = program.a[instrs[0]]
+    out = program.words[4 * base:4 * (program.a[instrs[-1]] + program.b[instrs[-1]])]
+
+    for item, c in zip(range(first, last), program.c[first:last]):
+        if c and program.kind[item] == INSTR:
+            offset = program.a[item] - base
+            ctx.rom.addr = pc + offset
+
+            try:
+                out[4 * offset:4 * (offset + program.b[item])] = program.instr_bytes(ctx, item)
+            except Exception as ex:
+                return bytes(out[:4 * offset]), program.error(item, ex)
+
+    return bytes(out), None
+
+def text_runs(program: Program, pc):
+    # (first item, last item, address) of every run of instructions at
+    # contiguous addresses, labels in between don't end a run
+    runs = []
+    first = None
+    origin = start = pc
+
+    for item, (kind, a, b) in enumerate(zip(program.kind, program.a, program.b)):
+        if kind == INSTR:
+            if first is None:
+                first, start = item, pc
+
+            pc = pc + b
+        elif kind == MEMLABEL or kind == SEGMENT:
+            if first is not None:
+                runs.append((first, item, start))
+                first = None
+
+            pc = a if kind == MEMLABEL else origin
+
+    if first is not None:
+        runs.append((first, len(program), start))
+
+    return runs
+
+def _split(program: Program, runs):
+    chunks = []
+
+    for run, (first, last, pc) in enumerate(runs):
+        for start in range(first, last, CHUNK_SIZE):
+            chunks.append((run, start, min(start + CHUNK_SIZE, last), pc))
+            pc = pc + sum(program.b[start:min(start + CHUNK_SIZE, last)])
+
+    return chunks
+
+_shared = None
+
+def _init_worker(program, labels):
+    global _shared
+    _shared = (program, labels)
+
+def _encode_shared(first, last, pc):
+    program, labels = _shared
+    return encode_chunk(program, labels, first, last, pc)
+
+def encode_runs(program: Program, ctx: Context, workers=None):
+    # {first item: (last item, bytes, error)} for every run of the text segment
+    runs = text_runs(program, ctx.rom.addr)
+    chunks = _split(program, runs)
+    size = sum(last - first for _, first, last, _ in chunks)
+    workers = workers or os.cpu_count() or 1
+
+    if size < PARALLEL_THRESHOLD or workers == 1 or len(chunks) == 1:
+        results = [encode_chunk(program, ctx._labels, first, last, pc) for _, first, last, pc in chunks]
+    else:
+        with executor(workers, _init_worker, (program, ctx._labels)) as pool:
+            results = list(pool.map(_encode_shared, *zip(*[chunk[1:] for chunk in chunks])))
+
+    run_results = [[] for _ in runs]
+    for chunk, result in zip(chunks, results):
+        run_results[chunk[0]].append(result)
+
+    encoded = dict()
+    for (first, last, _), results in zip(runs, run_results):
+        parts = []
+        error = None
+
+        for b, error in results:
+            parts.append(b)
+
+            if error is not None:
+                break
+
+        encoded[first] = (last, b"".join(parts), error)
+
+    return encoded
@@ -0,0 +1,172 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+from os import path
+
+# Assembler daemon: a Unix socket server that keeps a pool of worker
+# processes with the parser loaded. Each request and response is one line
+# of JSON:
+#   {"source": text} or {"path": file}, with optional "debug", "batch",
+#   "cwd", the directory .incbin and output paths are relative to, and
+#   "outputs", [[image, spec]] of other formats the daemon writes (see
+#   mips.formats.write_outputs)
+#   {"ok": true, "ram": text, "rom": text, "output": debug prints,
+#    "files": the files of the other formats}
+#   {"ok": false, "error": message, "output": debug prints, "ram": text,
+#    "rom": text}, with the images written up to the error
+# Clients may send several requests over one connection.
+
+def socket_path():
+    if "MIPSASM_SOCKET" in os.environ:
+        return os.environ["MIPSASM_SOCKET"]
+
+    # $XDG_RUNTIME_DIR is private to the user, the temporary directory is
+    # shared so the socket goes into a private directory there
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return path.join(runtime, f"py-mipsasm-{os.getuid()}.sock")
+
+    return path.join(tempfile.gettempdir(), f"py-mipsasm-{os.getuid()}", "daemon.sock")
+
+def _private_dir(directory):
+    # created if missing, a directory only its owner, this user, can use
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{directory} is not a private directory")
+
+def _peer_uid(s):
+    # the user of the process at the other end of a unix socket, None
+    # where the system doesn't tell
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+
+    creds = s.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+def _assemble_request(source, file, debug, batch, cwd=None, outputs=()):
+    from .pool import assemble_file
+
+    if cwd is not None:
+        # a worker runs one request at a time
+        os.chdir(cwd)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if source is not None:
+            file = path.join(directory, "input.s")
+            with open(file, "w") as f:
+                f.write(source)
+
+        ram, rom = path.join(directory, "ram.mem"), path.join(directory, "rom.mem")
+        result = assemble_file(file, ram, rom, debug=debug, batch=batch, outputs=[tuple(output) for output in outputs])
+
+        response = {"ok": result.ok, "output": result.output, "files": result.files}
+        if not result.ok:
+            response["error"] = result.error
+
+        for name, file in (("ram", ram), ("rom", rom)):
+            if path.exists(file):
+                with open(file) as f:
+                    response[name] = f.read()
+
+        return response
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # requests write files as this user, only this user may send them
+        if _peer_uid(self.request) not in (None, os.getuid()):
+            return
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                future = self.server.pool.submit(_assemble_request, request.get("source"), request.get("path"),
+                    bool(request.get("debug")), bool(request.get("batch")), request.get("cwd"), request.get("outputs", ()))
+                response = future.result()
+            except Exception as ex:
+                response = {"ok": False, "error": str(ex), "output": ""}
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+class AssemblerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, address, workers=None):
+        from concurrent.futures import ProcessPoolExecutor
+        from .pool import _init_worker
+
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        super().__init__(address, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+def serve(address=None, workers=None):
+    if address is None:
+        address = socket_path()
+
+        if "MIPSASM_SOCKET" not in os.environ:
+            _private_dir(path.dirname(address))
+
+    if path.exists(address):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(address)
+        except ConnectionRefusedError:
+            # left over by a daemon that is gone
+            os.remove(address)
+        else:
+            raise Exception(f"A daemon is already listening on {address}")
+
+    # stopped like with ctrl-c, the socket is removed on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with AssemblerServer(address, workers) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(address)
+
+def assemble_remote(source=None, file=None, debug=False, batch=False, address=None, outputs=()):
+    # raises OSError (FileNotFoundError, ConnectionRefusedError) when no
+    # daemon is running, PermissionError when the one listening isn't run
+    # by this user
+    request = {"debug": debug, "batch": batch, "cwd": os.getcwd(), "outputs": list(outputs)}
+
+    if source is not None:
+        request["source"] = source
+    else:
+        request["path"] = path.abspath(file)
+
+    address = address or socket_path()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(address)
+
+        uid = _peer_uid(s)
+        if uid is None:
+            uid = os.stat(address).st_uid
+        if uid != os.getuid():
+            raise PermissionError(f"The daemon on {address} is run by another user")
+
+        s.sendall(json.dumps(request).encode() + b"\n")
+
+        with s.makefile("rb") as f:
+            line = f.readline()
+
+    if not line:
+        raise ConnectionError("The daemon closed the connection")
+
+    return json.loads(line)
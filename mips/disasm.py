@@ -0,0 +1,272 @@
+import re
+import struct
+import numpy as np
+import mips.regs as regs
+from mips.image import Image
+import mips.isa as isa
+from mips.instructions import _base_classes
+from mips.parsetypes import Constant, OffsetRegister, LabelRef
+
+# Disassembler for ROM images. The decoding table is the ISA table of
+# mips/isa.py, with the opcode, funct and operand fields of every base
+# instruction. A whole image is decoded at once with numpy, only the
+# requested ranges are turned into text, through the instruction classes'
+# own __str__, so the output assembles back to the same words.
+
+class Disassembly:
+    def __init__(self, image: Image, labels=None):
+        # labels is {name: word address}, the labels of the image by default
+        self.image = image
+        entries = isa.table()
+
+        starts, words = [], []
+        for addr, data in image.extents:
+            count = len(data) // 4
+            starts.append(np.arange(addr // 4, addr // 4 + count, dtype=np.int64))
+            words.append(np.frombuffer(data, dtype='>u4', count=count).astype(np.uint32))
+
+        self.pcs = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+        self.words = np.concatenate(words) if words else np.zeros(0, dtype=np.uint32)
+
+        # the entry of every word, -1 for words that aren't an instruction:
+        # the one of its key (opcode and funct, see isa.key) with the
+        # fewest fixed bits, if they match, or one with more that matches
+        w = self.words
+        op = (w >> 26).astype(np.intp)
+        sub = np.zeros(len(w), dtype=np.intp)
+        for opcode, (shift, bits) in isa.SUBFIELDS.items():
+            sub = np.where(op == opcode, ((w >> shift) & ((1 << bits) - 1)).astype(np.intp), sub)
+        key = (op << 6) | sub
+
+        by_key = np.full(64 << 6, -1, dtype=np.int16)
+        masks = np.zeros(len(entries), dtype=np.uint32)
+        values = np.zeros(len(entries), dtype=np.uint32)
+        labels_of = np.zeros(len(entries), dtype=np.int8)
+        index_of = {entry: index for index, entry in enumerate(entries)}
+
+        for index, entry in enumerate(entries):
+            masks[index], values[index] = entry.mask, entry.value
+            labels_of[index] = (None, "rel", "abs", "raw").index(entry.label)
+
+        for specs in isa.by_key().values():
+            by_key[specs[0].key] = index_of[specs[-1]]
+
+        kinds = by_key[key]
+        kinds[(kinds >= 0) & ((w & masks[kinds]) != values[kinds])] = -1
+
+        for specs in isa.by_key().values():
+            for entry in reversed(specs[:-1]):
+                kinds[(w & entry.mask) == entry.value] = index_of[entry]
+
+        self.kinds = kinds
+
+        # the target of every branch and jump, as a word address, -1 for
+        # the other words
+        w64 = w.astype(np.int64)
+        label = np.where(kinds >= 0, labels_of[kinds], 0)
+
+        targets = np.select(
+            [label == 1, label == 2, label == 3],
+            [
+                (self.pcs + (((w64 & 0xFFFF) ^ 0x8000) - 0x8000)) & 0xFFFFFFFF,
+                (self.pcs & ~((1 << 26) - 1)) | (w64 & ((1 << 26) - 1)),
+                w64 & ((1 << 26) - 1),
+            ],
+            -1
+        )
+
+        self.targets = targets
+
+        # the labels given by address, the other targets are named L_ADDR
+        self.symbols = dict()
+        for name, val in sorted((image.labels if labels is None else labels).items(), key=lambda item: item[1]):
+            self.symbols.setdefault(val, []).append(name)
+
+        self.target_addrs = np.unique(targets[targets >= 0])
+
+    def names(self, addr):
+        return self.symbols.get(addr) or [f"L_{addr:X}"]
+
+    def _text(self, i, cache):
+        word = int(self.words[i])
+        kind = int(self.kinds[i])
+
+        if kind < 0:
+            return None
+
+        entry = isa.table()[kind]
+        if entry.label is None and word in cache:
+            return cache[word]
+
+        args = []
+        for operand, field, base in entry.operands:
+            shift, bits = isa.FIELDS[entry.fmt][field]
+            val = (word >> shift) & ((1 << bits) - 1)
+
+            if operand == "reg":
+                args.append(regs.from_id(val))
+            elif operand == "imm":
+                # immediates are encoded as signed, whatever the instruction
+                args.append(Constant(((val ^ 0x8000) - 0x8000) if field == "imm" else val))
+            elif operand == "off":
+                shift, bits = isa.FIELDS[entry.fmt][base]
+                args.append(OffsetRegister(regs.from_id((word >> shift) & ((1 << bits) - 1)), (val ^ 0x8000) - 0x8000))
+            else:
+                args.append(LabelRef(self.names(int(self.targets[i]))[0]))
+
+        text = str(_base_classes[entry](*args))
+        if entry.label is None:
+            cache[word] = text
+
+        return text
+
+    def lines(self, first=None, last=None):
+        # source lines of the words at [first, last), word addresses, with
+        # the labels of the range, also the ones in gaps
+        pcs = self.pcs
+        lo = 0 if first is None else int(np.searchsorted(pcs, first))
+        hi = len(pcs) if last is None else int(np.searchsorted(pcs, last))
+
+        targets = self.target_addrs
+        labels = {addr for addr in self.symbols if (first is None or addr >= first) and (last is None or addr < last)}
+        labels.update(targets[0 if first is None else np.searchsorted(targets, first):
+            len(targets) if last is None else np.searchsorted(targets, last)].tolist())
+        labels = sorted(labels)
+        label = 0
+        cache = dict()
+        pc = None
+
+        for i in range(lo, hi):
+            addr = int(pcs[i])
+
+            while label < len(labels) and labels[label] < addr:
+                # labels in a gap before this word
+                yield f"@0x{labels[label]:X}"
+                yield from (f"{name}:" for name in self.names(labels[label]))
+                pc = None
+                label = label + 1
+
+            if addr != pc:
+                yield f"@0x{addr:X}"
+
+            if label < len(labels) and labels[label] == addr:
+                yield from (f"{name}:" for name in self.names(addr))
+                label = label + 1
+
+            text = self._text(i, cache)
+            if text is None:
+                # not an instruction, the next word is placed explicitly
+                yield f"    # 0x{int(self.words[i]):08x}"
+                pc = None
+            else:
+                yield f"    {text}"
+                pc = addr + 1
+
+        for addr in labels[label:]:
+            yield f"@0x{addr:X}"
+            yield from (f"{name}:" for name in self.names(addr))
+
+def disassemble(image: Image, labels=None, ranges=None):
+    # the source of the image, ranges is [(first, last)] in word addresses
+    disassembly = Disassembly(image, labels)
+    lines = [".text"]
+
+    for first, last in ranges or [(None, None)]:
+        lines.extend(disassembly.lines(first, last))
+
+    return "\n".join(lines) + "\n"
+
+# Readers of the ROM dumps
+
+_comment_re = re.compile(r"//[^\n]*")
+
+def read_mem(file, cell_size=None):
+    # a $readmemh file as an Image, the cell size is the one of the values
+    # unless given
+    with open(file) as f:
+        text = f.read()
+
+    if "//" in text:
+        text = _comment_re.sub("", text)
+
+    image = None
+    for i, chunk in enumerate(text.split("@")):
+        tokens = chunk.split()
+
+        if i == 0:
+            addr = 0
+        elif not tokens:
+            raise Exception(f"{file}: missing address after @")
+        else:
+            addr = int(tokens[0], 16)
+            tokens = tokens[1:]
+
+        if not tokens:
+            continue
+
+        if image is None:
+            image = Image(cell_size or (len(tokens[0]) + 1) // 2)
+
+        size = image.cell_size
+        try:
+            data = bytes.fromhex("".join(tokens))
+        except ValueError:
+            data = b""
+
+        if len(data) != size * len(tokens):
+            # values of other widths, padded one by one
+            data = bytes.fromhex("".join(token.zfill(2 * size) for token in tokens))
+
+        image.write(addr * size, data)
+
+    return image if image is not None else Image(cell_size or 4)
+
+def read_bin(file, base=0, cell_size=4):
+    # a raw binary placed at the byte address base
+    with open(file, "rb") as f:
+        data = f.read()
+
+    image = Image(cell_size)
+    if data:
+        image.write(base, data + bytes(-len(data) % cell_size))
+
+    return image
+
+def _elf_symbols(data):
+    # {name: address in bytes} of the functions of a big endian ELF32
+    shoff, = struct.unpack_from(">I", data, 32)
+    shentsize, shnum = struct.unpack_from(">HH", data, 46)
+    headers = [struct.unpack_from(">IIIIIIIIII", data, shoff + i * shentsize) for i in range(shnum)]
+    symbols = dict()
+
+    for header in headers:
+        if header[1] != 2:
+            continue
+
+        strtab = headers[header[6]]
+        for offset in range(header[4], header[4] + header[5], 16):
+            name, value, _, info, _, shndx = struct.unpack_from(">IIIBBH", data, offset)
+
+            if name and info & 0xF in (0, 2):
+                end = data.index(b"\0", strtab[4] + name)
+                symbols[data[strtab[4] + name:end].decode()] = value
+
+    return symbols
+
+def read_symbols(file):
+    # {name: address in bytes} of the code labels of an ELF file (-elf) or
+    # of a text map with "ADDRESS [TYPE] NAME" lines, like the output of nm
+    with open(file, "rb") as f:
+        data = f.read()
+
+    if data.startswith(b"\x7fELF"):
+        return _elf_symbols(data)
+
+    symbols = dict()
+    for line in data.decode().splitlines():
+        fields = line.split()
+
+        if len(fields) == 2 or (len(fields) == 3 and fields[1] in "Tt"):
+            symbols[fields[-1]] = int(fields[0], 16)
+
+    return symbols
@@ -0,0 +1,64 @@
+from functools import lru_cache
+
+# Field layouts, most significant field first: (name, bits, signed)
+
+RType = (
+    ("op", 6, False),
+    ("rs", 5, False),
+    ("rt", 5, False),
+    ("rd", 5, False),
+    ("shamt", 5, False),
+    ("funct", 6, False),
+)
+
+IType = (
+    ("op", 6, False),
+    ("rs", 5, False),
+    ("rt", 5, False),
+    ("imm", 16, True),
+)
+
+JType = (
+    ("op", 6, False),
+    ("addr", 26, False),
+)
+
+_CACHE_SIZE = 1 << 16
+
+def _out_of_range(fmt, values):
+    for (name, bits, signed), val in zip(fmt, values):
+        low, high = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+
+        if not low <= val <= high:
+            raise Exception(f"{name}: number {val} is out of range (min={low}, max={high})")
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def encode_r(op, rs, rt, rd, shamt, funct):
+    if not (0 <= op < 64 and 0 <= rs < 32 and 0 <= rt < 32 and 0 <= rd < 32
+            and 0 <= shamt < 32 and 0 <= funct < 64):
+        _out_of_range(RType, (op, rs, rt, rd, shamt, funct))
+
+    return ((op << 26) | (rs << 21) | (rt << 16) | (rd << 11) | (shamt << 6) | funct).to_bytes(4, 'big')
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def encode_i(op, rs, rt, imm):
+    if not (0 <= op < 64 and 0 <= rs < 32 and 0 <= rt < 32 and -0x8000 <= imm < 0x8000):
+        _out_of_range(IType, (op, rs, rt, imm))
+
+    return ((op << 26) | (rs << 21) | (rt << 16) | (imm & 0xFFFF)).to_bytes(4, 'big')
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def encode_j(op, addr):
+    if not (0 <= op < 64 and 0 <= addr < (1 << 26)):
+        _out_of_range(JType, (op, addr))
+
+    return ((op << 26) | addr).to_bytes(4, 'big')
+
+_row_encoders = {
+    "r": encode_r,
+    "i": encode_i,
+    "j": encode_j,
+}
+
+def encode_row(row):
+    return _row_encoders[row[0]](*row[1:])
@@ -0,0 +1,533 @@
+import mmap
+import os
+import struct
+from os import path
+from .image import Image
+from .output import OutputFile, replace_if_changed, _temporary, _direct
+
+# Output formats written from the assembled images. Addresses are in bytes,
+# the .mem format is the $readmemh text of MemoryFile, in cells. Every
+# writer returns the files it wrote, which are only replaced when their
+# contents change (see mips/output.py).
+
+# Images from this size on are written to .bin files through a mapping
+MMAP_THRESHOLD = 1 << 24
+# Most zero bytes between the extents of a single .bin file
+MAX_BIN_GAPS = 1 << 24
+# Data bytes per Intel HEX and S-record line
+RECORD_SIZE = 16
+
+def _check32(image: Image, name):
+    extents = image.extents
+
+    if extents and extents[-1][0] + len(extents[-1][1]) > 1 << 32:
+        raise Exception(f"Address 0x{extents[-1][0]:X} doesn't fit in {name}")
+
+def _write_lines(file, lines):
+    # in blocks of lines instead of a string of the whole output
+    block = []
+
+    for line in lines:
+        block.append(line)
+
+        if len(block) == 1 << 14:
+            file.write("\n".join(block) + "\n")
+            block = []
+
+    if block:
+        file.write("\n".join(block) + "\n")
+
+def write_mem(image: Image, file):
+    from .assembler import Assembler, MemoryFile
+
+    if image.cell_size == 1:
+        mem = MemoryFile(file, align=Assembler.RAM_ALIGN)
+    else:
+        mem = MemoryFile(file, cell_size=image.cell_size)
+
+    try:
+        mem.write_image(image)
+    finally:
+        mem.close()
+
+    return [file]
+
+def write_bin(image: Image, file):
+    # the bytes from the lowest address placed to the highest, the gaps
+    # are zeros (holes in the file, where the file system has them). With
+    # {addr} in the name, a file per extent, named by its address in hex
+    extents = image.extents
+
+    if "{addr}" in file:
+        files = []
+        for addr, data in extents:
+            files.append(file.replace("{addr}", f"{addr:08X}"))
+            _write_bin_file([(addr, data)], files[-1])
+
+        return files
+
+    size = extents[-1][0] + len(extents[-1][1]) - extents[0][0] if extents else 0
+    gaps = size - sum(len(data) for _, data in extents)
+
+    if gaps > MAX_BIN_GAPS:
+        raise Exception(f"{file} would be {size} bytes for {size - gaps} bytes placed, "
+            "name it with {addr} for a file per region")
+
+    _write_bin_file(extents, file)
+    return [file]
+
+def _write_bin_file(extents, file):
+    base = extents[0][0] if extents else 0
+    size = extents[-1][0] + len(extents[-1][1]) - base if extents else 0
+
+    if _direct(file):
+        # not a regular file, written in order with the gaps
+        with OutputFile(file, binary=True) as f:
+            pos = base
+            for addr, data in extents:
+                while pos < addr:
+                    pos = pos + f.write(bytes(min(addr - pos, 1 << 20)))
+
+                f.write(data)
+                pos = addr + len(data)
+
+        return
+
+    tmp_file = _temporary(path.abspath(file))
+
+    try:
+        with open(tmp_file, "wb+") as f:
+            f.truncate(size)
+
+            if size >= MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), size) as m:
+                    for addr, data in extents:
+                        m[addr - base:addr - base + len(data)] = data
+            else:
+                for addr, data in extents:
+                    f.seek(addr - base)
+                    f.write(data)
+    except Exception:
+        os.remove(tmp_file)
+        raise
+
+    replace_if_changed(tmp_file, file)
+
+def _ihex_record(addr, kind, data):
+    head = bytes((len(data), addr >> 8, addr & 0xFF, kind))
+    return f":{head.hex().upper()}{bytes(data).hex().upper()}{-(sum(head) + sum(data)) & 0xFF:02X}"
+
+def _ihex_lines(image: Image):
+    upper = None
+
+    for addr, data in image.extents:
+        data = memoryview(data)
+        pos = 0
+
+        while pos < len(data):
+            a = addr + pos
+
+            if a >> 16 != upper:
+                upper = a >> 16
+                yield _ihex_record(0, 4, upper.to_bytes(2, 'big'))
+
+            # records don't cross a 64K boundary
+            n = min(RECORD_SIZE, len(data) - pos, 0x10000 - (a & 0xFFFF))
+            yield _ihex_record(a & 0xFFFF, 0, data[pos:pos + n])
+            pos = pos + n
+
+    yield ":00000001FF"
+
+def write_ihex(image: Image, file):
+    _check32(image, "Intel HEX")
+
+    with OutputFile(file) as f:
+        _write_lines(f, _ihex_lines(image))
+
+    return [file]
+
+def _srec(kind, addr, width, data=b""):
+    body = bytes((width + len(data) + 1,)) + addr.to_bytes(width, 'big') + bytes(data)
+    return f"S{kind}{body.hex().upper()}{~sum(body) & 0xFF:02X}"
+
+def _srec_lines(image: Image):
+    extents = image.extents
+    end = extents[-1][0] + len(extents[-1][1]) if extents else 0
+
+    # S1/S9 for 16 bit addresses, S2/S8 for 24 bits, S3/S7 for 32 bits
+    width = 2 if end <= 1 << 16 else 3 if end <= 1 << 24 else 4
+    records = 0
+
+    yield _srec(0, 0, 2, b"py-mipsasm")
+
+    for addr, data in extents:
+        data = memoryview(data)
+
+        for pos in range(0, len(data), RECORD_SIZE):
+            yield _srec(width - 1, addr + pos, width, data[pos:pos + RECORD_SIZE])
+            records = records + 1
+
+    if records < 1 << 16:
+        yield _srec(5, records, 2)
+    elif records < 1 << 24:
+        yield _srec(6, records, 3)
+
+    yield _srec(11 - width, extents[0][0] if extents else 0, width)
+
+def write_srec(image: Image, file):
+    _check32(image, "S-records")
+
+    with OutputFile(file) as f:
+        _write_lines(f, _srec_lines(image))
+
+    return [file]
+
+# ELF constants
+_ET_EXEC, _EM_MIPS = 2, 8
+_PT_LOAD, _PF_X, _PF_W, _PF_R = 1, 1, 2, 4
+_SHT_PROGBITS, _SHT_SYMTAB, _SHT_STRTAB = 1, 2, 3
+_SHF_WRITE, _SHF_ALLOC, _SHF_EXECINSTR = 1, 2, 4
+_STB_GLOBAL, _STT_OBJECT, _STT_FUNC = 1, 1, 2
+_SHN_ABS = 0xFFF1
+
+class _Strings:
+    def __init__(self):
+        self.data = bytearray(b"\0")
+
+    def add(self, name):
+        offset = len(self.data)
+        self.data += name.encode() + b"\0"
+        return offset
+
+def write_elf(ram: Image, rom: Image, file):
+    # big endian MIPS executable with a .text section for every region of
+    # the ROM, a .data section for every region of the RAM, one segment per
+    # section and the labels in a symbol table. ROM and RAM are separate
+    # memories, their addresses can be the same.
+    _check32(ram, "ELF")
+    _check32(rom, "ELF")
+
+    shstrtab, strtab = _Strings(), _Strings()
+
+    # (name, flags, address, bytes) of every section with contents
+    sections = []
+    for image, name, flags in ((rom, ".text", _SHF_ALLOC | _SHF_EXECINSTR), (ram, ".data", _SHF_ALLOC | _SHF_WRITE)):
+        for i, (addr, data) in enumerate(image.extents):
+            sections.append((shstrtab.add(name if i == 0 else f"{name}.{i}"), flags, addr, data))
+
+    symbols = [struct.pack(">IIIBBH", 0, 0, 0, 0, 0, 0)]
+    for image, kind, first in ((rom, _STT_FUNC, 0), (ram, _STT_OBJECT, len(rom.extents))):
+        for label, val in image.labels.items():
+            addr = val * image.cell_size
+            shndx = _SHN_ABS
+
+            if not 0 <= addr < 1 << 32:
+                raise Exception(f"Address of label {label} doesn't fit in ELF")
+
+            for i, (start, data) in enumerate(image.extents):
+                if start <= addr < start + len(data):
+                    shndx = first + i + 1
+
+            symbols.append(struct.pack(">IIIBBH", strtab.add(label), addr, 0, (_STB_GLOBAL << 4) | kind, 0, shndx))
+
+    symtab_name, strtab_name, shstrtab_name = shstrtab.add(".symtab"), shstrtab.add(".strtab"), shstrtab.add(".shstrtab")
+
+    # layout: header, program headers, section contents, tables, section headers
+    offset = 52 + 32 * len(sections)
+    offsets = []
+    for _, _, _, data in sections:
+        offset = (offset + 3) & ~3
+        offsets.append(offset)
+        offset = offset + len(data)
+
+    symtab_offset = (offset + 3) & ~3
+    strtab_offset = symtab_offset + 16 * len(symbols)
+    shstrtab_offset = strtab_offset + len(strtab.data)
+    shoff = (shstrtab_offset + len(shstrtab.data) + 3) & ~3
+    shnum = len(sections) + 4
+
+    rom_extents = rom.extents
+    entry = rom_extents[0][0] if rom_extents else 0
+
+    with OutputFile(file, binary=True) as f:
+        f.write(struct.pack(">16sHHIIIIIHHHHHH", b"\x7fELF\x01\x02\x01", _ET_EXEC, _EM_MIPS, 1, entry, 52, shoff, 0,
+            52, 32, len(sections), 40, shnum, shnum - 1))
+
+        for (_, flags, addr, data), offset in zip(sections, offsets):
+            p_flags = _PF_R | (_PF_X if flags & _SHF_EXECINSTR else _PF_W)
+            f.write(struct.pack(">IIIIIIII", _PT_LOAD, offset, addr, addr, len(data), len(data), p_flags, 1))
+
+        pos = 52 + 32 * len(sections)
+        for (_, _, _, data), offset in zip(sections, offsets):
+            f.write(bytes(offset - pos))
+            f.write(data)
+            pos = offset + len(data)
+
+        f.write(bytes(symtab_offset - pos))
+        f.write(b"".join(symbols))
+        f.write(strtab.data)
+        f.write(shstrtab.data)
+        f.write(bytes(shoff - shstrtab_offset - len(shstrtab.data)))
+
+        headers = [(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+        for (name, flags, addr, data), offset in zip(sections, offsets):
+            headers.append((name, _SHT_PROGBITS, flags, addr, offset, len(data), 0, 0, 4 if addr % 4 == 0 else 1, 0))
+
+        symtab = len(sections) + 1
+        headers.append((symtab_name, _SHT_SYMTAB, 0, 0, symtab_offset, 16 * len(symbols), symtab + 1, 1, 4, 16))
+        headers.append((strtab_name, _SHT_STRTAB, 0, 0, strtab_offset, len(strtab.data), 0, 0, 1, 0))
+        headers.append((shstrtab_name, _SHT_STRTAB, 0, 0, shstrtab_offset, len(shstrtab.data), 0, 0, 1, 0))
+
+        for header in headers:
+            f.write(struct.pack(">IIIIIIIIII", *header))
+
+    return [file]
+
+# Word formats for FPGA memories. The image is cut in words of `width`
+# bits, each word in `lanes` lanes (lane 0 holds the lowest address) and
+# the words in banks of `depth` words. Every bank and lane is its own file,
+# named from a template with {bank} and {lane}, all from one pass over the
+# image.
+
+# Values per block of text written
+WORD_BLOCK = 1 << 16
+
+_lane_types = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+_hex_bits = str.maketrans({f"{i:x}": f"{i:04b}" for i in range(16)})
+
+def _word_runs(image: Image, size):
+    # (first word, bytes) of every run of words with bytes placed in them
+    runs = []
+
+    for addr, data in image.extents:
+        first, last = addr // size, -(-(addr + len(data)) // size)
+
+        if runs and first <= runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], last)
+        else:
+            runs.append([first, last])
+
+    return [(first, image.read(first * size, (last - first) * size)) for first, last in runs]
+
+def _check_words(file, width=32, lanes=1, depth=None, pad=False):
+    # the options that are wrong whatever the image
+    if width % 8 or (width // 8) % lanes or (width // 8) // lanes not in _lane_types:
+        raise Exception(f"Can't split {width} bit words in {lanes} lanes")
+    if depth is not None and depth <= 0:
+        raise Exception(f"Bank depth must be positive: {depth}")
+    if lanes > 1 and "{lane}" not in file:
+        raise Exception(f"{file} must contain {{lane}} to write {lanes} lanes")
+
+def _check_banks(image: Image, file, width=32, depth=None, **options):
+    extents = image.extents
+
+    if depth and extents and "{bank}" not in file:
+        end = extents[-1][0] + len(extents[-1][1])
+
+        if -(-end // (width // 8)) > depth:
+            raise Exception(f"{file} must contain {{bank}}, the image doesn't fit in one bank of {depth} words")
+
+def _split_words(image: Image, width, lanes, depth):
+    # {(bank, lane): [(first word in the bank, bytes of the lane)]}
+    size = width // 8
+    split = dict()
+
+    for first, data in _word_runs(image, size):
+        words = memoryview(data).cast(_lane_types[size // lanes])
+        count = len(data) // size
+        k = 0
+
+        while k < count:
+            bank, offset = divmod(first + k, depth) if depth else (0, first + k)
+            n = min(count - k, depth - offset) if depth else count - k
+
+            for lane in range(lanes):
+                split.setdefault((bank, lane), []).append((offset, words[k * lanes + lane:(k + n) * lanes:lanes].tobytes()))
+
+            k = k + n
+
+    return split
+
+def _zeros(first, last, size):
+    for pos in range(first, last, WORD_BLOCK):
+        yield pos, bytes((min(last, pos + WORD_BLOCK) - pos) * size)
+
+def _dense(runs, size, count):
+    # the values of [0, count) with zeros in the gaps
+    pos = 0
+
+    for offset, data in runs:
+        yield from _zeros(pos, offset, size)
+        yield offset, data
+        pos = offset + len(data) // size
+
+    yield from _zeros(pos, count, size)
+
+def _blocks(runs, size):
+    for offset, data in runs:
+        for pos in range(0, len(data), WORD_BLOCK * size):
+            yield offset + pos // size, data[pos:pos + WORD_BLOCK * size]
+
+def _values(data, size, kind):
+    # the values of data, one per line
+    text = data.hex("\n", size)
+    return text.translate(_hex_bits) if kind == "memb" else text
+
+def _write_words_file(f, kind, runs, size, count):
+    if kind == "coe":
+        f.write("memory_initialization_radix=16;\nmemory_initialization_vector=")
+        separator = "\n"
+
+        for _, data in _blocks(runs, size):
+            f.write(separator + _values(data, size, kind).replace("\n", ",\n"))
+            separator = ",\n"
+
+        f.write(";\n")
+    elif kind == "mif":
+        f.write(f"WIDTH={8 * size};\nDEPTH={count};\n\nADDRESS_RADIX=HEX;\nDATA_RADIX=HEX;\n\nCONTENT BEGIN\n")
+        pos = 0
+
+        for offset, data in _blocks(runs, size):
+            if offset > pos:
+                f.write(f"\t[{pos:X}..{offset - 1:X}] : 0;\n")
+
+            values = _values(data, size, kind).split("\n")
+            f.write("".join(f"\t{offset + i:X} : {value};\n" for i, value in enumerate(values)))
+            pos = offset + len(values)
+
+        if count > pos:
+            f.write(f"\t[{pos:X}..{count - 1:X}] : 0;\n")
+
+        f.write("END;\n")
+    else:
+        pos = 0
+
+        for offset, data in _blocks(runs, size):
+            if offset != pos:
+                f.write(f"@{offset:X}\n")
+
+            f.write(_values(data, size, kind) + "\n")
+            pos = offset + len(data) // size
+
+def write_words(image: Image, file, kind, width=32, lanes=1, depth=None, pad=False):
+    # kind is "memh" ($readmemh), "memb" ($readmemb), "coe" (Xilinx) or
+    # "mif" (Intel). With pad, every bank has `depth` words
+    _check_words(file, width, lanes, depth)
+    _check_banks(image, file, width, depth)
+
+    split = _split_words(image, width, lanes, depth)
+    size = width // 8 // lanes
+    banks = max((bank for bank, _ in split), default=0) + 1
+    files = []
+
+    for bank in range(banks):
+        for lane in range(lanes):
+            runs = split.get((bank, lane), [])
+            if not runs and not pad:
+                continue
+
+            if pad and depth:
+                count = depth
+            else:
+                count = runs[-1][0] + len(runs[-1][1]) // size if runs else 0
+
+            if pad or kind == "coe":
+                runs = _dense(runs, size, count)
+
+            name = file.replace("{bank}", str(bank)).replace("{lane}", str(lane))
+            with OutputFile(name) as f:
+                _write_words_file(f, kind, runs, size, max(count, depth or 0) if kind == "mif" else count)
+
+            files.append(name)
+
+    return files
+
+def _word_writer(kind):
+    def write(image: Image, file, **options):
+        return write_words(image, file, kind, **options)
+
+    return write
+
+# image writers by file extension
+FORMATS = {
+    ".mem": write_mem,
+    ".memb": _word_writer("memb"),
+    ".coe": _word_writer("coe"),
+    ".mif": _word_writer("mif"),
+    ".bin": write_bin,
+    ".hex": write_ihex,
+    ".ihex": write_ihex,
+    ".srec": write_srec,
+    ".s19": write_srec,
+    ".s28": write_srec,
+    ".s37": write_srec,
+}
+
+# options of the word formats, after the file name:
+# ram{lane}.mem,width=32,lanes=4,depth=1024,pad
+_options = {"width": int, "lanes": int, "depth": int, "pad": bool}
+
+def parse_output(spec):
+    # (file, options) of an output given as FILE[,option=value...]
+    file, *rest = spec.split(",")
+    options = dict()
+
+    for option in rest:
+        name, _, value = option.partition("=")
+
+        if name not in _options:
+            raise Exception(f"Unknown output option: {name}")
+
+        options[name] = True if _options[name] is bool else int(value, 0)
+
+    if options and FORMATS.get(path.splitext(file)[1].lower()) in (write_bin, write_ihex, write_srec):
+        raise Exception(f"{file}: options are only for .mem, .memb, .coe and .mif")
+
+    _check_words(file, **options)
+    return file, options
+
+def format_of(spec):
+    return FORMATS.get(path.splitext(spec.split(",")[0])[1].lower())
+
+def write_image(image: Image, spec):
+    # the files written
+    file, options = parse_output(spec)
+    write = format_of(file)
+
+    if write is None:
+        raise Exception(f"Unknown output format: {file}")
+
+    if write is write_mem and options:
+        # the word formats, as $readmemh
+        return write_words(image, file, "memh", **options)
+
+    return write(image, file, **options)
+
+def write_outputs(ram: Image, rom: Image, outputs):
+    # outputs is a list of (image, spec), the image "ram", "rom" or "elf"
+    # for write_elf with spec as the file. Returns the files written, none
+    # when an output can't be written
+    for image, spec in outputs:
+        if image != "elf":
+            file, options = parse_output(spec)
+            _check_banks(ram if image == "ram" else rom, file, **options)
+
+    files = []
+
+    for image, spec in outputs:
+        if image == "elf":
+            files += write_elf(ram, rom, spec)
+        else:
+            files += write_image(ram if image == "ram" else rom, spec)
+
+    return files
+
+def normalize_outputs(outputs):
+    # (image, file, sorted options) of the outputs, for cache keys
+    normalized = []
+
+    for image, spec in outputs:
+        file, options = (spec, dict()) if image == "elf" else parse_output(spec)
+        normalized.append((image, file, sorted(options.items())))
+
+    return normalized
@@ -0,0 +1,139 @@
+import bisect
+from array import array
+
+# Assembled memory contents, kept in memory instead of formatted as text.
+# An image is sparse: a sorted list of extents that don't overlap, each a
+# start address in bytes and the bytes placed there, so code placed at
+# @0x20 and at @0x80000000 takes the memory of the code only. Writes next
+# to an extent extend it, writes over one are an error. ImageWriter takes
+# the place of a MemoryFile in the passes, with its addresses in cells, and
+# keeps the layout of its writes so that MemoryFile.write_image gives the
+# same $readmemh text as writing the file directly.
+
+_ZEROS = memoryview(bytes(1 << 16))
+
+def zero_blocks(size):
+    # size zero bytes in blocks of a fixed buffer, for .space
+    for start in range(0, size, len(_ZEROS)):
+        yield _ZEROS[:min(size - start, len(_ZEROS))]
+
+class Image:
+    def __init__(self, cell_size=1):
+        self.cell_size = cell_size
+        # labels defined in the segment of the image, in cells like the
+        # addresses the code uses
+        self.labels = dict()
+        self._starts = []
+        self._data = []
+        # extent of the last write, the next one usually follows it
+        self._last = -1
+        # the writes of an ImageWriter in order, as pairs of start and end
+        # address in bytes, or of a cell address and -1 for set_addr
+        self.layout = array('q')
+
+    def __len__(self):
+        return sum(len(data) for data in self._data)
+
+    @property
+    def extents(self):
+        # [(address, bytearray)] in address order
+        return list(zip(self._starts, self._data))
+
+    def views(self):
+        # [(address, memoryview)], without copying the bytes
+        return [(addr, memoryview(data)) for addr, data in zip(self._starts, self._data)]
+
+    def _overlap(self, addr):
+        return Exception(f"Overlapping placement at @{addr // self.cell_size:X}")
+
+    def write(self, addr, data):
+        starts = self._starts
+        end = addr + len(data)
+
+        i = self._last
+        if not (0 <= i < len(starts) and starts[i] <= addr and (i + 1 == len(starts) or starts[i + 1] > addr)):
+            i = bisect.bisect_right(starts, addr) - 1
+
+        if i >= 0 and starts[i] + len(self._data[i]) > addr:
+            raise self._overlap(addr)
+
+        if i + 1 < len(starts) and starts[i + 1] < end:
+            raise self._overlap(starts[i + 1])
+
+        if i >= 0 and starts[i] + len(self._data[i]) == addr:
+            self._data[i] += data
+        else:
+            i = i + 1
+            starts.insert(i, addr)
+            self._data.insert(i, bytearray(data))
+
+        # coalesce with the extent that starts where this one now ends
+        if i + 1 < len(starts) and starts[i + 1] == end:
+            self._data[i] += self._data[i + 1]
+            del starts[i + 1], self._data[i + 1]
+
+        self._last = i
+
+    def find(self, addr):
+        # (start, bytearray) of the extent holding addr, None in a gap
+        i = bisect.bisect_right(self._starts, addr) - 1
+
+        if i >= 0 and addr < self._starts[i] + len(self._data[i]):
+            return self._starts[i], self._data[i]
+
+        return None
+
+    def read(self, addr, size):
+        # size bytes from addr, the gaps read as zeros
+        out = bytearray(size)
+        i = max(bisect.bisect_right(self._starts, addr) - 1, 0)
+
+        while i < len(self._starts) and self._starts[i] < addr + size:
+            start, data = self._starts[i], self._data[i]
+            first, last = max(start, addr), min(start + len(data), addr + size)
+
+            if first < last:
+                out[first - addr:last - addr] = data[first - start:last - start]
+
+            i = i + 1
+
+        return bytes(out)
+
+class ImageWriter:
+    def __init__(self, image: Image, addr=0, align=None):
+        # align as for the MemoryFile the image is written to
+        self.image = image
+        self.cell_size = image.cell_size
+        self.addr = addr
+        self._line = image.cell_size * (align or 1)
+
+    def write_bytes(self, bytes, comment=None):
+        if len(bytes) % self.cell_size:
+            raise Exception("Bytes not multiple of cell size!")
+
+        data = memoryview(bytes).cast('B')
+        if not len(data):
+            return
+
+        start = self.addr * self.cell_size
+        self.image.write(start, data)
+        self.addr = self.addr + len(data) // self.cell_size
+
+        # a write right after whole lines of the last one continues it,
+        # its text is the same
+        layout = self.image.layout
+        if layout and layout[-1] == start and (start - layout[-2]) % self._line == 0:
+            layout[-1] = start + len(data)
+        else:
+            layout.extend((start, start + len(data)))
+
+    def fill(self, size):
+        for block in zero_blocks(size):
+            self.write_bytes(block)
+
+    def write_comment(self, comment):
+        pass
+
+    def set_addr(self, addr):
+        self.addr = addr
+        self.image.layout.extend((addr, -1))
@@ -0,0 +1,304 @@
+import bisect
+import os
+import re
+from array import array
+from .assembler import Assembler, Context, MemoryFile, SecondPass
+from .chunks import encode_runs, text_runs, _Pc
+from .image import Image, ImageWriter
+from .ir import Program, ProgramBuilder, SEGMENT, LABEL, MEMLABEL, DECL, INSTR
+from .parallel_parse import parse_program
+from .relax import relax_program
+from .scanner import split_lines, _scan_line_or_fallback
+
+# Re-assembly of an edited source, for watch/edit loops. The program table,
+# the address of every item, the labels and the encoded text segment of the
+# previous build are kept. Only the lines between the first and the last
+# changed line are parsed again, addresses are recomputed from there on
+# (and only up to the end of the region when it kept its size) and only
+# the words whose label or own address moved are encoded again. Anything
+# unusual, errors included, goes through a clean build instead, so the
+# output and the errors are always the ones of a clean build.
+
+_directive_re = re.compile(r"[ \t]*\.(?:data|text)")
+
+class _Build:
+    def __init__(self, lines, program, addrs, labels, end, resolved):
+        self.lines = lines
+        self.program = program
+        # the address of every item in its segment, before the item
+        self.addrs = addrs
+        self.labels = labels
+        # data and text address at the end of the program
+        self.data_end, self.text_end = end[1], end[2]
+        # the words of the text segment with the labels filled in, None
+        # when the build can't be reused
+        self.resolved = resolved
+        # some instruction grew in the relaxation (mips/relax.py)
+        self.relaxed = False
+        self.text_item = max(program.kind.tobytes().rfind(bytes([SEGMENT])), 0)
+
+    def state(self, item, segm):
+        # (segment, data address, text address) before item
+        if segm == 'data':
+            return 'data', (self.addrs[item] if item < self.text_item else self.data_end), 0
+
+        return 'text', self.data_end, (self.addrs[item] if item < len(self.addrs) else self.text_end)
+
+def _walk(program, first, last, state, labels, addrs):
+    # FirstPass over the items [first, last) that also keeps their addresses
+    segm, data_addr, text_addr = state
+    names = program.symbols.names
+    item = first
+
+    try:
+        for item in range(first, last):
+            kind, a = program.kind[item], program.a[item]
+            addrs.append(data_addr if segm == 'data' else text_addr)
+
+            if kind == INSTR:
+                text_addr = text_addr + program.b[item]
+            elif kind == DECL:
+                data_addr = data_addr + program.c[item]
+            elif kind == LABEL:
+                if names[a] in labels:
+                    raise Exception(f"Label is already defined: {names[a]}")
+
+                labels[names[a]] = data_addr if segm == 'data' else text_addr
+            elif kind == MEMLABEL:
+                if segm == 'data':
+                    data_addr = a
+                else:
+                    text_addr = a
+            elif a == 0:
+                segm, data_addr = 'data', 0
+            else:
+                segm, text_addr = 'text', 0
+    except Exception as ex:
+        raise program.error(item, ex)
+
+    return segm, data_addr, text_addr
+
+def _label_names(program, first, last):
+    names = program.symbols.names
+    return [names[program.a[item]] for item in range(first, last) if program.kind[item] == LABEL]
+
+def _uses(program, item, names):
+    a, b = program.a[item], program.b[item]
+    symbols = program.symbols.names
+
+    return any(kind and symbols[sym] in names for kind, sym in zip(program.word_kind[a:a + b], program.word_sym[a:a + b]))
+
+class IncrementalAssembler:
+    def __init__(self, outram, outrom, debug=False, workers=None):
+        self._outram = outram
+        self._outrom = outrom
+        self._debug = debug
+        self._workers = workers
+        self._build = None
+
+        # how the last call went: "clean" or "incremental", with the number
+        # of lines parsed and of instructions encoded
+        self.last_mode = None
+        self.last_parsed = 0
+        self.last_encoded = 0
+
+    def assemble(self, text):
+        if self._debug:
+            # the debug output is the one of a clean build anyway
+            asm = Assembler(self._outram, self._outrom, debug=True, workers=self._workers)
+            asm.assemble(text)
+            asm.finalize()
+            self.last_mode = "clean"
+            return
+
+        lines = split_lines(text)
+        build, self._build = self._build, None
+
+        try:
+            build = self._incremental(build, lines) if build is not None else None
+        except Exception:
+            build = None
+
+        if build is None:
+            try:
+                build = self._clean(text, lines)
+            except Exception:
+                # the outputs are left empty, like the ones of Assembler
+                MemoryFile(self._outram).close()
+                MemoryFile(self._outrom).close()
+                raise
+
+            self.last_mode = "clean"
+        else:
+            self.last_mode = "incremental"
+
+        self._write(build)
+        self._build = build
+
+    def _clean(self, text, lines):
+        program = parse_program(text, False, self._workers)
+        addrs = array('q')
+        labels = dict()
+        end = _walk(program, 0, len(program), ('data', 0, 0), labels, addrs)
+
+        relaxed = relax_program(program, labels).grew
+        if relaxed:
+            # the addresses after the grown instructions
+            addrs, labels = array('q'), dict()
+            end = _walk(program, 0, len(program), ('data', 0, 0), labels, addrs)
+
+        self.last_parsed = len(lines)
+        self.last_encoded = program.kind.count(INSTR)
+
+        if (len(program) and program.line[0] == 0) or program.objects:
+            # parsed by lark without line numbers, or some item failed to
+            # encode: the second pass writes (or raises) as usual
+            return _Build(lines, program, addrs, labels, end, None)
+
+        ctx = Context(_Pc(0), _Pc(0))
+        ctx._labels = labels
+        runs = encode_runs(program, ctx, self._workers)
+
+        if any(error is not None for _, _, error in runs.values()):
+            return _Build(lines, program, addrs, labels, end, None)
+
+        build = _Build(lines, program, addrs, labels, end, bytearray(b"".join(b for _, b, _ in runs.values())))
+        build.relaxed = relaxed
+
+        return build
+
+    def _incremental(self, build, lines):
+        old, old_lines = build.program, build.lines
+
+        # an edit can let a grown instruction shrink again, which moves
+        # everything after it
+        if build.resolved is None or build.relaxed:
+            return None
+
+        # an included file that changed size moves what comes after it
+        if any(os.stat(blob.val).st_size != blob.size for blob in old.blobs.values()):
+            return None
+
+        # the changed region: lines [start, old_end) of the old source are
+        # now lines [start, new_end)
+        limit = min(len(old_lines), len(lines))
+
+        start = 0
+        while start < limit and old_lines[start] == lines[start]:
+            start = start + 1
+
+        suffix = 0
+        while suffix < limit - start and old_lines[-1 - suffix] == lines[-1 - suffix]:
+            suffix = suffix + 1
+
+        old_end, new_end = len(old_lines) - suffix, len(lines) - suffix
+
+        if start == old_end == new_end:
+            self.last_parsed = self.last_encoded = 0
+            return build
+
+        # segment directives change the structure
+        if any(_directive_re.match(line) for line in old_lines[start:old_end] + lines[start:new_end]):
+            return None
+
+        segm = 'data' if start < old.line[build.text_item] - 1 else 'text'
+
+        builder = ProgramBuilder(Program())
+        builder.program.symbols = old.symbols
+
+        for index in range(start, new_end):
+            builder.lineno = index + 1
+
+            for item in _scan_line_or_fallback(lines[index], index + 1, segm):
+                item.accept(builder)
+
+        middle = builder.program
+        if middle.objects:
+            return None
+
+        # splice the region into the table
+        first = bisect.bisect_left(old.line, start + 1)
+        last = bisect.bisect_left(old.line, old_end + 1)
+        region_end = first + len(middle)
+
+        program = Program()
+        program.symbols = old.symbols
+        program.extend(old, 0, first)
+        program.extend(middle)
+        program.extend(old, last, len(old), line_delta=new_end - old_end)
+
+        # addresses from the region on, after it only if they moved
+        labels = dict(build.labels)
+        for name in _label_names(old, first, last):
+            del labels[name]
+
+        addrs = build.addrs[:first]
+        state = _walk(program, first, region_end, build.state(first, segm), labels, addrs)
+        moved = state != build.state(last, segm)
+
+        if moved:
+            for name in _label_names(old, last, len(old)):
+                del labels[name]
+
+            end = _walk(program, region_end, len(program), state, labels, addrs)
+        else:
+            addrs += build.addrs[last:]
+            end = ('text', build.data_end, build.text_end)
+
+        changed = {name for name in labels.keys() | build.labels.keys() if labels.get(name) != build.labels.get(name)}
+
+        # encode the region, whatever moved and whatever uses a moved label
+        resolved = build.resolved[:4 * old.word_offset(first)] + middle.words + build.resolved[4 * old.word_offset(last):]
+        ctx = Context(_Pc(0), _Pc(0))
+        ctx._labels = labels
+
+        encode = range(first, len(program) if moved else region_end)
+        check = list(range(first)) + (list(range(region_end, len(program))) if not moved else []) if changed else []
+        encoded = 0
+
+        for item in (*encode, *check):
+            if program.kind[item] != INSTR or not program.c[item]:
+                continue
+
+            if item in encode or _uses(program, item, changed):
+                ctx.rom.addr = addrs[item]
+                a = program.a[item]
+                resolved[4 * a:4 * (a + program.b[item])] = program.instr_bytes(ctx, item)
+                encoded = encoded + 1
+
+        self.last_parsed = new_end - start
+        self.last_encoded = encoded
+
+        return _Build(lines, program, addrs, labels, end, resolved)
+
+    def _write(self, build):
+        ram, rom = Image(), Image(Assembler.ROM_CELL_SIZE)
+
+        try:
+            ctx = Context(ImageWriter(ram, align=Assembler.RAM_ALIGN), ImageWriter(rom))
+            ctx._labels = build.labels
+            second_pass = SecondPass(ctx, False, self._workers)
+
+            if build.resolved is None:
+                second_pass.run(build.program)
+            else:
+                second_pass.run(build.program, self._runs(build))
+        finally:
+            for image, file in ((ram, MemoryFile(self._outram, align=Assembler.RAM_ALIGN)),
+                    (rom, MemoryFile(self._outrom, cell_size=Assembler.ROM_CELL_SIZE))):
+                file.write_image(image)
+                file.close()
+
+    def _runs(self, build):
+        # the runs of mips/chunks.py, taken from the encoded words
+        program = build.program
+        runs = dict()
+
+        for first, last, _ in text_runs(program, 0):
+            end = last - 1
+            while program.kind[end] != INSTR:
+                end = end - 1
+
+            runs[first] = (last, bytes(build.resolved[4 * program.a[first]:4 * (program.a[end] + program.b[end])]), None)
+
+        return runs
@@ -0,0 +1,288 @@
+from array import array
+from mips.encoding import encode_row, encode_i, encode_j
+from mips.parsetypes import *
+from mips.instructions import Instruction
+
+# Compact program representation: one table row per source item and one
+# per machine word, each column an array, instead of an object per line.
+# Words that don't refer to a label are encoded while the table is built.
+
+SEGMENT, LABEL, MEMLABEL, DECL, INSTR = range(5)
+
+# word kinds, 0 is an already encoded word
+_word_kinds = (None, "rel", "lo", "hi", "abs", "raw", "val")
+_i_kinds = ("rel", "lo", "hi", "val")
+
+class SymbolTable:
+    __slots__ = ("ids", "names")
+
+    def __init__(self):
+        self.ids = dict()
+        self.names = []
+
+    def intern(self, name):
+        sym = self.ids.get(name)
+
+        if sym is None:
+            sym = self.ids[name] = len(self.names)
+            self.names.append(str(name))
+
+        return sym
+
+class Program:
+    def __init__(self, debug=False):
+        self.symbols = SymbolTable()
+
+        # Items, fields by kind:
+        #   SEGMENT   a = 0 for .data, 1 for .text
+        #   LABEL     a = symbol id
+        #   MEMLABEL  a = address
+        #   DECL      a = offset in data, b = byte count, c = size in RAM,
+        #             zero filled past the bytes
+        #   INSTR     a = first word, b = word count, c = words using a label
+        self.kind = array('B')
+        self.line = array('I')
+        self.a = array('q')
+        self.b = array('I')
+        self.c = array('I')
+
+        # Words, 4 bytes each, big endian. Label words hold op, rs and rt
+        # and the id of the label in word_sym
+        self.words = bytearray()
+        self.word_kind = array('B')
+        self.word_sym = array('i')
+
+        self.data = bytearray()
+        # .incbin items, whose bytes are mapped from their file when
+        # written instead of copied into data
+        self.blobs = dict()
+        # Items that failed to encode, kept as parsed objects so that the
+        # second pass reports the error, as it does for parsed objects
+        self.objects = dict()
+        # Source text of every item, only kept for the debug output
+        self.comments = [] if debug else None
+
+    def __len__(self):
+        return len(self.kind)
+
+    def add(self, kind, lineno, a=0, b=0, c=0, comment=None):
+        self.kind.append(kind)
+        self.line.append(lineno)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+
+        if self.comments is not None:
+            self.comments.append(comment)
+
+    def _offset(self, item, kind, default):
+        # the first word (INSTR) or data offset (DECL) at or after item
+        for other in range(item, len(self)):
+            if self.kind[other] == kind:
+                return self.a[other]
+
+        return default
+
+    def word_offset(self, item):
+        return self._offset(item, INSTR, len(self.word_kind))
+
+    def data_offset(self, item):
+        return self._offset(item, DECL, len(self.data))
+
+    def extend(self, other, first=0, last=None, line_delta=0):
+        # appends the items [first, last) of another program, moving its
+        # symbol ids, its offsets in words and data and its line numbers to
+        # the ones of this program
+        last = len(other) if last is None else last
+        if first >= last:
+            return
+
+        items = len(self)
+        words, other_words = len(self.word_kind), other.word_offset(first)
+        data, other_data = len(self.data), other.data_offset(first)
+        end_words, end_data = other.word_offset(last), other.data_offset(last)
+
+        if other.symbols is self.symbols:
+            symbols = None
+        else:
+            symbols = [self.symbols.intern(name) for name in other.symbols.names]
+
+        for kind, a in zip(other.kind[first:last], other.a[first:last]):
+            if kind == LABEL and symbols is not None:
+                a = symbols[a]
+            elif kind == INSTR:
+                a = a - other_words + words
+            elif kind == DECL:
+                a = a - other_data + data
+
+            self.a.append(a)
+
+        self.kind += other.kind[first:last]
+        self.b += other.b[first:last]
+        self.c += other.c[first:last]
+
+        if line_delta:
+            self.line += array('I', (line + line_delta for line in other.line[first:last]))
+        else:
+            self.line += other.line[first:last]
+
+        self.words += other.words[4 * other_words:4 * end_words]
+        self.word_kind += other.word_kind[other_words:end_words]
+
+        if symbols is None:
+            self.word_sym += other.word_sym[other_words:end_words]
+        else:
+            self.word_sym += array('i', (symbols[sym] if kind else 0 for kind, sym in
+                zip(other.word_kind[other_words:end_words], other.word_sym[other_words:end_words])))
+
+        self.data += other.data[other_data:end_data]
+        for objects, other_objects in ((self.objects, other.objects), (self.blobs, other.blobs)):
+            for item, obj in other_objects.items():
+                if first <= item < last:
+                    objects[item - first + items] = obj
+
+        if self.comments is not None:
+            self.comments += other.comments[first:last]
+
+    def error(self, item, ex):
+        lineno = self.line[item]
+        return Exception(f"line {lineno}: {ex}") if lineno else ex
+
+    def word_row(self, index):
+        # the encoding row of a word that refers to a label
+        kind = _word_kinds[self.word_kind[index]]
+        name = self.symbols.names[self.word_sym[index]]
+        word = int.from_bytes(self.words[4 * index:4 * index + 4], 'big')
+
+        if kind in _i_kinds:
+            return (kind, word >> 26, (word >> 21) & 0x1F, (word >> 16) & 0x1F, name)
+
+        return (kind, word >> 26, name)
+
+    def add_rows(self, rows):
+        # appends the words of encoding rows, returns how many use a label
+        labels = 0
+
+        for row in rows:
+            kind = row[0]
+
+            if kind in _word_kinds:
+                labels = labels + 1
+                self.word_kind.append(_word_kinds.index(kind))
+                self.word_sym.append(self.symbols.intern(row[-1]))
+
+                if kind in _i_kinds:
+                    self.words += encode_i(row[1], row[2], row[3], 0)
+                else:
+                    self.words += encode_j(row[1], 0)
+            else:
+                self.words += encode_row(row)
+                self.word_kind.append(0)
+                self.word_sym.append(0)
+
+        return labels
+
+    def instr_bytes(self, ctx, item):
+        if self.objects and item in self.objects:
+            return self.objects[item].to_bytes(ctx)
+
+        first, count = self.a[item], self.b[item]
+        b = self.words[4 * first:4 * (first + count)]
+
+        if self.c[item]:
+            for i in range(count):
+                if self.word_kind[first + i]:
+                    b[4 * i:4 * i + 4] = encode_row(ctx.resolve_row(self.word_row(first + i), i))
+
+        return b
+
+    def decl_bytes(self, item):
+        if self.objects and item in self.objects:
+            return self.objects[item].to_bytes()
+        if self.blobs and item in self.blobs:
+            return self.blobs[item].to_bytes()
+
+        a = self.a[item]
+        return self.data[a:a + self.b[item]]
+
+    def comment(self, item):
+        return self.comments[item] if self.comments is not None else None
+
+class ProgramBuilder:
+    def __init__(self, program: Program):
+        self.program = program
+        self.lineno = 0
+
+    def _comment(self, line):
+        return str(line) if self.program.comments is not None else None
+
+    def visit_DataSegment(self, segm: DataSegment):
+        self.program.add(SEGMENT, self.lineno, 0)
+
+        for line in segm.lines:
+            line.accept(self)
+
+    def visit_TextSegment(self, segm: TextSegment):
+        self.program.add(SEGMENT, self.lineno, 1)
+
+        for line in segm.lines:
+            line.accept(self)
+
+    def visit_Decl(self, line: Decl):
+        program = self.program
+
+        if isinstance(line, IncbinDecl):
+            program.blobs[len(program)] = line
+            program.add(DECL, self.lineno, len(program.data), 0, len(line), self._comment(line))
+            return
+
+        try:
+            b = line.to_bytes()
+        except Exception:
+            program.objects[len(program)] = line
+            b = b""
+
+        program.add(DECL, self.lineno, len(program.data), len(b), len(line), self._comment(line))
+        program.data += b
+
+    def visit_Label(self, lbl: Label):
+        self.program.add(LABEL, self.lineno, self.program.symbols.intern(lbl.name), comment=self._comment(lbl))
+
+    def visit_MemLabel(self, lbl: MemLabel):
+        self.program.add(MEMLABEL, self.lineno, lbl.addr, comment=self._comment(lbl))
+
+    def visit_Instruction(self, instr: Instruction):
+        program = self.program
+        first = len(program.word_kind)
+
+        try:
+            labels = program.add_rows(instr.rows())
+        except Exception:
+            del program.words[4 * first:]
+            del program.word_kind[first:]
+            del program.word_sym[first:]
+
+            program.objects[len(program)] = instr
+            program.add(INSTR, self.lineno, first, len(instr), 0, self._comment(instr))
+            return
+
+        program.add(INSTR, self.lineno, first, len(program.word_kind) - first, labels, self._comment(instr))
+
+def parse_program(text, debug=False):
+    from mips.scanner import scan_iter, split_lines, _Fallback
+
+    builder = ProgramBuilder(Program(debug))
+
+    try:
+        for lineno, item in scan_iter(split_lines(text)):
+            builder.lineno = lineno
+            item.accept(builder)
+    except _Fallback:
+        # lark parses the whole text (or reports the error), without line numbers
+        from mips.parser import parse as parse_lark
+
+        builder = ProgramBuilder(Program(debug))
+        for segm in parse_lark(text):
+            segm.accept(builder)
+
+    return builder.program
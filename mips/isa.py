@@ -0,0 +1,209 @@
+from functools import lru_cache
+from mips.encoding import RType, IType, JType
+
+# The base instruction set. The instruction classes (mips/instructions.py),
+# the disassembler and the simulator are all generated from this table, a
+# new instruction is a new row. A row is
+# (mnemonic, format, opcode, funct, operands[, fixed fields]):
+#   - operands are the fields the source operands go to, in source order:
+#     rd, rs, rt, shamt and imm for registers and constants, off(rs) for an
+#     offset in imm with its base register in rs, and rel, abs or raw for a
+#     label encoded relative to the instruction, as the low 26 bits of its
+#     address or as is (see Context.resolve_row)
+#   - the other fields are zero, or the value given in the fixed fields
+#   - a mnemonic can have several rows with different operands
+ISA = (
+    ("add",   "r", 0x00, 0x20, "rd, rs, rt"),
+    ("addi",  "i", 0x08, None, "rt, rs, imm"),
+    ("addiu", "i", 0x09, None, "rt, rs, imm"),
+    ("addu",  "r", 0x00, 0x21, "rd, rs, rt"),
+    ("and",   "r", 0x00, 0x24, "rd, rs, rt"),
+    ("andi",  "i", 0x0c, None, "rt, rs, imm"),
+    ("beq",   "i", 0x04, None, "rs, rt, rel"),
+    ("bgez",  "i", 0x01, None, "rs, rel", {"rt": 1}),
+    ("bltz",  "i", 0x01, None, "rs, rel", {"rt": 0}),
+    ("bne",   "i", 0x05, None, "rs, rt, rel"),
+    ("div",   "r", 0x00, 0x1a, "rs, rt"),
+    ("divu",  "r", 0x00, 0x1b, "rs, rt"),
+    ("j",     "j", 0x02, None, "abs"),
+    ("jal",   "j", 0x03, None, "raw"),
+    ("jalr",  "r", 0x00, 0x09, "rs", {"rd": 31}),
+    ("jalr",  "r", 0x00, 0x09, "rd, rs"),
+    ("jr",    "r", 0x00, 0x08, "rs"),
+    ("lb",    "i", 0x20, None, "rt, off(rs)"),
+    ("lbu",   "i", 0x24, None, "rt, off(rs)"),
+    ("lh",    "i", 0x21, None, "rt, off(rs)"),
+    ("lhu",   "i", 0x25, None, "rt, off(rs)"),
+    ("ll",    "i", 0x30, None, "rt, off(rs)"),
+    ("lui",   "i", 0x0f, None, "rt, imm"),
+    ("lw",    "i", 0x23, None, "rt, off(rs)"),
+    ("mfhi",  "r", 0x00, 0x10, "rd"),
+    ("mflo",  "r", 0x00, 0x12, "rd"),
+    ("mult",  "r", 0x00, 0x18, "rs, rt"),
+    ("multu", "r", 0x00, 0x19, "rs, rt"),
+    ("nor",   "r", 0x00, 0x27, "rd, rs, rt"),
+    ("or",    "r", 0x00, 0x25, "rd, rs, rt"),
+    ("ori",   "i", 0x0d, None, "rt, rs, imm"),
+    ("slt",   "r", 0x00, 0x2a, "rd, rs, rt"),
+    ("slti",  "i", 0x0a, None, "rt, rs, imm"),
+    ("sltiu", "i", 0x0b, None, "rt, rs, imm"),
+    ("sltu",  "r", 0x00, 0x2b, "rd, rs, rt"),
+    ("sll",   "r", 0x00, 0x00, "rd, rt, shamt"),
+    ("sra",   "r", 0x00, 0x03, "rd, rt, shamt"),
+    ("srl",   "r", 0x00, 0x02, "rd, rt, shamt"),
+    ("sb",    "i", 0x28, None, "rt, off(rs)"),
+    ("sc",    "i", 0x38, None, "rt, off(rs)"),
+    ("sh",    "i", 0x29, None, "rt, off(rs)"),
+    ("sw",    "i", 0x2b, None, "rt, off(rs)"),
+    ("sub",   "r", 0x00, 0x22, "rd, rs, rt"),
+    ("subu",  "r", 0x00, 0x23, "rd, rs, rt"),
+
+    # the all zero word, also sll $zero, $zero, 0
+    ("nop",   "r", 0x00, 0x00, ""),
+)
+
+def _shifts(layout):
+    # {field: (shift, bits)} of a field layout, in encoding row order
+    shifts = dict()
+    shift = 32
+
+    for name, bits, _ in layout:
+        shift = shift - bits
+        shifts[name] = (shift, bits)
+
+    return shifts
+
+FIELDS = {
+    "r": _shifts(RType),
+    "i": _shifts(IType),
+    "j": _shifts(JType),
+}
+
+# Opcodes whose instructions are told apart by another field, (shift, bits)
+SUBFIELDS = {
+    0x00: FIELDS["r"]["funct"],
+    0x01: FIELDS["i"]["rt"],
+}
+
+_LABELS = ("rel", "abs", "raw")
+
+class Spec:
+    __slots__ = ("mnemonic", "fmt", "operands", "kinds", "names", "label", "fixed", "mask", "value")
+
+    def __init__(self, mnemonic, fmt, op, funct, operands, fixed=None):
+        self.mnemonic = mnemonic
+        self.fmt = fmt
+        # (kind, field, base field) of every operand, kind being "reg",
+        # "imm", "off" or "lbl"
+        self.operands = []
+        # the names of the operands in the instruction classes
+        self.names = []
+        # "rel", "abs" or "raw" for an instruction with a label operand
+        self.label = None
+
+        for token in operands.split(",") if operands else ():
+            token = token.strip()
+
+            if token.startswith("off(") and token.endswith(")"):
+                self.operands.append(("off", "imm", token[4:-1]))
+                self.names.append("off")
+            elif token in _LABELS:
+                self.operands.append(("lbl", "imm" if fmt == "i" else "addr", None))
+                self.names.append("lbl")
+                self.label = token
+            elif token in FIELDS[fmt]:
+                self.operands.append(("imm" if token in ("imm", "shamt") else "reg", token, None))
+                self.names.append(token)
+            else:
+                raise Exception(f"{mnemonic}: unknown operand {token}")
+
+        self.operands = tuple(self.operands)
+        self.names = tuple(self.names)
+        self.kinds = tuple(kind for kind, _, _ in self.operands)
+
+        # every field no operand is in has a fixed value
+        used = {field for _, field, _ in self.operands} | {base for _, _, base in self.operands if base}
+        self.fixed = dict.fromkeys((name for name in FIELDS[fmt] if name not in used), 0)
+        self.fixed["op"] = op
+        if funct is not None:
+            self.fixed["funct"] = funct
+        self.fixed.update(fixed or ())
+
+        self.mask = self.value = 0
+        for name, val in self.fixed.items():
+            shift, bits = FIELDS[fmt][name]
+            self.mask = self.mask | (((1 << bits) - 1) << shift)
+            self.value = self.value | (val << shift)
+
+    def __repr__(self):
+        return f"Spec({' '.join((self.mnemonic, ', '.join(self.kinds))).strip()})"
+
+    @property
+    def key(self):
+        return key(self.value)
+
+    def source(self):
+        # the methods of the class of this instruction, as Python source:
+        # __init__, rows with the encoding row and __str__ with the text
+        names = self.names
+        exprs = dict()
+
+        for (kind, field, base), name in zip(self.operands, names):
+            if kind == "reg":
+                exprs[field] = f"self.{name}.reg_id"
+            elif kind == "imm":
+                exprs[field] = f"self.{name}.val"
+            elif kind == "off":
+                exprs[field] = f"self.{name}.offset"
+                exprs[base] = f"self.{name}.reg.reg_id"
+            else:
+                exprs[field] = f"self.{name}.name"
+
+        row = [repr(self.label or self.fmt)]
+        row += [exprs.get(name, str(self.fixed.get(name))) for name in FIELDS[self.fmt]]
+        text = self.mnemonic + (" " + ", ".join(f"{{self.{name}}}" for name in names) if names else "")
+
+        return (
+            f"def __init__(self{''.join(', ' + name for name in names)}):\n"
+            + "".join(f"    self.{name} = {name}\n" for name in names)
+            + ("" if names else "    pass\n")
+            + "\n"
+            + "def rows(self):\n"
+            + f"    return (({', '.join(row)}),)\n"
+            + "\n"
+            + "def __str__(self):\n"
+            + f"    return f{text!r}\n"
+        )
+
+def key(word):
+    # the opcode of a word, with the field that tells apart the
+    # instructions of its opcode, as in SUBFIELDS
+    op = word >> 26
+    sub = SUBFIELDS.get(op)
+
+    if sub is None:
+        return op << 6
+
+    return (op << 6) | ((word >> sub[0]) & ((1 << sub[1]) - 1))
+
+@lru_cache(maxsize=None)
+def table():
+    return tuple(Spec(*row) for row in ISA)
+
+@lru_cache(maxsize=None)
+def by_key():
+    # {key: specs}, the more fixed bits the earlier
+    specs = dict()
+
+    for spec in sorted(table(), key=lambda spec: -bin(spec.mask).count("1")):
+        specs.setdefault(spec.key, []).append(spec)
+
+    return {k: tuple(v) for k, v in specs.items()}
+
+def decode(word):
+    # the Spec of a word, None if it isn't an instruction
+    for spec in by_key().get(key(word), ()):
+        if word & spec.mask == spec.value:
+            return spec
+
+    return None
@@ -0,0 +1,177 @@
+import hashlib
+import io
+import os
+import stat
+from os import path
+
+# Output files that are only replaced when their contents change, so that
+# their modification time (and the builds that depend on it) is left alone
+# when the image is the same. The new contents are written under a
+# temporary name next to the file, hashed on the way, and renamed over the
+# file only if they differ. The hash of large outputs is kept in a hidden
+# sidecar file, which saves reading the old file again when they differ.
+# Targets that aren't regular files (/dev/null, pipes, ttys), or whose
+# directory doesn't take the temporary file, are written directly.
+
+# Outputs from this size on get a sidecar hash
+SIDECAR_SIZE = 1 << 20
+
+def _sidecar(file):
+    directory, name = path.split(file)
+    return path.join(directory, f".{name}.sha256")
+
+def _temporary(file):
+    directory, name = path.split(file)
+    return path.join(directory, f".{name}.{os.getpid()}.tmp")
+
+def _direct(file):
+    # whether file exists and isn't a regular file
+    try:
+        return not stat.S_ISREG(os.stat(file).st_mode)
+    except OSError:
+        return False
+
+def _hash_file(file):
+    digest = hashlib.sha256()
+
+    with open(file, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def _same(file, size, digest):
+    # whether file has these contents
+    try:
+        st = os.stat(file)
+    except OSError:
+        return False
+
+    if st.st_size != size:
+        return False
+
+    try:
+        with open(_sidecar(file)) as f:
+            old, sidecar_size, mtime = f.read().split()
+
+        # the sidecar of the file as it is tells a change without reading
+        # the file, but it can be stale, so a match is checked on the file
+        if int(sidecar_size) == st.st_size and int(mtime) == st.st_mtime_ns and old != digest:
+            return False
+    except (OSError, ValueError):
+        pass
+
+    return _hash_file(file) == digest
+
+def replace_if_changed(tmp_file, file, digest=None):
+    # moves tmp_file over file if the contents differ, returns True when
+    # file was replaced
+    size = os.path.getsize(tmp_file)
+    digest = digest or _hash_file(tmp_file)
+
+    if _same(file, size, digest):
+        os.remove(tmp_file)
+        changed = False
+    else:
+        os.replace(tmp_file, file)
+        changed = True
+
+    sidecar = _sidecar(file)
+    if size >= SIDECAR_SIZE:
+        st = os.stat(file)
+        with open(_temporary(sidecar), "w") as f:
+            f.write(f"{digest} {st.st_size} {st.st_mtime_ns}\n")
+
+        os.replace(_temporary(sidecar), sidecar)
+    elif path.exists(sidecar):
+        os.remove(sidecar)
+
+    return changed
+
+class _Hashing(io.RawIOBase):
+    def __init__(self, file):
+        self._file = file
+        self.digest = hashlib.sha256()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        n = self._file.write(b)
+        self.digest.update(memoryview(b)[:n])
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+class OutputFile:
+    # a file opened for writing, in order, that replaces `file` on close
+    def __init__(self, file, binary=False, buffering=io.DEFAULT_BUFFER_SIZE):
+        self.file = file
+        self.changed = None
+        self._tmp = None
+
+        if not _direct(file):
+            try:
+                self._raw = _Hashing(io.FileIO(_temporary(path.abspath(file)), "w"))
+                self._tmp = self._raw._file.name
+            except PermissionError:
+                if not path.exists(file):
+                    raise
+
+        if self._tmp is None:
+            # written in place, it always counts as changed
+            self._raw = _Hashing(io.FileIO(file, "w"))
+
+        self._f = io.BufferedWriter(self._raw, buffering)
+        if not binary:
+            self._f = io.TextIOWrapper(self._f)
+
+    def write(self, data):
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        if self.changed is None:
+            self._f.close()
+
+            if self._tmp is None:
+                self.changed = True
+            else:
+                self.changed = replace_if_changed(self._tmp, self.file, self._raw.digest.hexdigest())
+
+    def discard(self):
+        self._f.close()
+        if self._tmp is not None:
+            os.remove(self._tmp)
+        self.changed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.discard()
+
+def write_depfile(file, targets, inputs):
+    # a make rule of the outputs on the inputs, for make and ninja
+    def escape(name):
+        return name.replace("\\", "\\\\").replace(" ", "\\ ").replace("#", "\\#").replace("$", "$$")
+
+    with OutputFile(file) as f:
+        f.write(f"{' '.join(map(escape, targets))}: {' '.join(map(escape, inputs))}\n")
+
+def touch(file):
+    with open(file, "a"):
+        pass
+
+    os.utime(file)
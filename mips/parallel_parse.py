@@ -0,0 +1,88 @@
+import os
+import re
+from .ir import Program, ProgramBuilder, parse_program as parse_serial
+from .parsetypes import DataSegment, TextSegment
+from .pool import executor
+from .scanner import split_lines, _segment_re, _scan_line_or_fallback
+
+# Parsing of large sources in a pool of workers. Inside a segment every
+# line is read on its own, so the lines between the .data and .text
+# directives are cut into chunks, every chunk is parsed into a program
+# table of its own and the tables are appended in order.
+
+# Source lines before the parsing is split over workers
+PARALLEL_THRESHOLD = 1 << 17
+CHUNK_LINES = 1 << 14
+
+_directive_re = re.compile(r"^[ \t]*\.(?:data|text)", re.MULTILINE)
+
+def _segments(text, lines):
+    # [(segment, index of the directive line)] for the sources laid out the
+    # way the scanner accepts them, None for anything else
+    segments = []
+    pos = lineno = 0
+
+    for m in _directive_re.finditer(text):
+        lineno = lineno + text.count("\n", pos, m.start())
+        pos = m.start()
+
+        seg = _segment_re.match(lines[lineno].rstrip("\r"))
+        if seg.group(2) is None:
+            return None
+
+        segments.append((seg.group(1), lineno))
+
+    if [segm for segm, _ in segments] not in (["data", "text"], ["text"]) or segments[0][1] != 0:
+        return None
+
+    return segments
+
+_lines = None
+
+def _init_worker(lines):
+    global _lines
+    _lines = lines
+
+def _parse_chunk(segm, first, last, debug):
+    builder = ProgramBuilder(Program(debug))
+
+    for index in range(first, last):
+        builder.lineno = index + 1
+
+        for item in _scan_line_or_fallback(_lines[index], index + 1, segm):
+            item.accept(builder)
+
+    return builder.program
+
+def parse_program(text, debug=False, workers=None):
+    workers = workers or os.cpu_count() or 1
+    lines = split_lines(text)
+
+    segments = _segments(text, lines) if workers > 1 and len(lines) >= PARALLEL_THRESHOLD else None
+    if segments is None:
+        return parse_serial(text, debug)
+
+    # (segment, first line, last line) of every chunk, segments start with None
+    chunks = []
+    for i, (segm, directive) in enumerate(segments):
+        end = segments[i + 1][1] if i + 1 < len(segments) else len(lines)
+        chunks.append((segm, directive, None))
+
+        for first in range(directive + 1, end, CHUNK_LINES):
+            chunks.append((segm, first, min(first + CHUNK_LINES, end)))
+
+    parts = [chunk for chunk in chunks if chunk[2] is not None]
+
+    with executor(workers, _init_worker, (lines,)) as pool:
+        programs = pool.map(_parse_chunk, *zip(*parts), [debug] * len(parts))
+
+        builder = ProgramBuilder(Program(debug))
+        for segm, first, last in chunks:
+            if last is None:
+                builder.lineno = first + 1
+                (DataSegment([]) if segm == "data" else TextSegment([])).accept(builder)
+            else:
+                # results come in order, the first error is the one of the serial parse
+                builder.program.extend(next(programs))
+
+    return builder.program
@@ -1,11 +1,19 @@
 from lark import Transformer, Lark, v_args
+from lark.exceptions import UnexpectedToken
 import mips.regs as regs
 from mips.parsetypes import *
 from mips.instructions import resolve_instruction
 from os import path
+import hashlib
+import os
+import sys
+
+# Called by the LALR parser as each rule is reduced, so the parse
+# produces the segments directly without building a tree first
+@v_args(inline=True)
+class AsmTransformer(Transformer):
+    # Constants
 
-@v_args(inline = True)
-class ConstTransformer(Transformer):
     def integer_const(self, val):
         return Constant(int(val))
 
@@ -15,8 +23,8 @@ class ConstTransformer(Transformer):
     def string_const(self, val):
         return StringConstant(val[1:-1])
 
-@v_args(inline=True)
-class RegisterTransformer(Transformer):
+    # Registers
+
     def offset_reg(self, offset, reg):
         return OffsetRegister(reg, int(offset))
 
@@ -32,8 +40,8 @@ class RegisterTransformer(Transformer):
         except Exception as ex:
             raise Exception(f"line {name.line}: {ex}")
 
-@v_args(inline=True)
-class LabelTransformer(Transformer):
+    # Labels
+
     def create_label_ref(self, name):
         return LabelRef(name)
 
@@ -43,46 +51,104 @@ class LabelTransformer(Transformer):
     def create_mem_label(self, addr):
         return MemLabel(int(addr[2:], base=16))
 
-@v_args(inline=True)
-class InstrTransformer(Transformer):
+    # Instructions
+
+    def args(self, *args):
+        return args
+
     def create_instr(self, mnemonic, args):
         try:
-            return resolve_instruction(mnemonic, args.children)
+            return resolve_instruction(mnemonic, args)
         except Exception as ex:
             raise Exception(f"line {mnemonic.line}: {ex}")
 
-_decl_types = {
-    "word": lambda val: WordDecl(val.numeric_val()),
-    "half": lambda val: HalfDecl(val.numeric_val()),
-    "word": lambda val: WordDecl(val.numeric_val()),
-    "byte": lambda val: ByteDecl(val.numeric_val()),
-    "asciiz": lambda val: AsciizDecl(val.val)
-}
+    # Declarations
 
-@v_args(inline=True)
-class DeclTransformer(Transformer):
-    def create_decl(self, decl_type, val):
-        if decl_type not in _decl_types:
-            raise Exception(f"line {decl_type.line}: No such declaration type: .{decl_type}")
+    def create_decl(self, decl_type, *vals):
+        try:
+            return create_decl(decl_type, *vals)
+        except Exception as ex:
+            raise Exception(f"line {decl_type.line}: {ex}")
+
+    # Segments
 
-        return _decl_types[decl_type](val)
+    def text_segm(self, *lines):
+        return TextSegment(list(lines))
 
-class SegmentTransformer(Transformer):
-    def text_segm(self, lst):
-        return TextSegment(lst)
+    def data_segm(self, *lines):
+        return DataSegment(list(lines))
 
-    def data_segm(self, lst):
-        return DataSegment(lst)
+    def start(self, *segments):
+        return list(segments)
 
-transformer = RegisterTransformer() * ConstTransformer() * DeclTransformer() * LabelTransformer() * InstrTransformer() * SegmentTransformer()
 grammar_path = path.dirname(path.abspath(__file__))
-parser = Lark.open(f"{grammar_path}/mipsasm.lark", parser='lalr')
+grammar_file = path.join(grammar_path, "mipsasm.lark")
+
+def _cache_dir():
+    if "MIPSASM_CACHE_DIR" in os.environ:
+        return os.environ["MIPSASM_CACHE_DIR"]
+
+    return path.join(os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache"), "py-mipsasm")
+
+def _cache_file(grammar):
+    import lark
+
+    key = hashlib.sha256(f"{grammar}\0{lark.__version__}\0{sys.version_info[:2]}".encode()).hexdigest()
+    return path.join(_cache_dir(), f"parser-{key[:16]}.lark")
+
+def _open_parser():
+    with open(grammar_file) as f:
+        grammar = f.read()
+
+    cache_file = _cache_file(grammar)
+    if path.exists(cache_file):
+        return Lark(grammar, parser='lalr', transformer=AsmTransformer(), cache=cache_file)
+
+    try:
+        os.makedirs(path.dirname(cache_file), exist_ok=True)
+    except OSError:
+        return Lark(grammar, parser='lalr', transformer=AsmTransformer())
+
+    # build under a private name and rename, so concurrent builds never read a partial cache
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        parser = Lark(grammar, parser='lalr', transformer=AsmTransformer(), cache=tmp_file)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        parser = Lark(grammar, parser='lalr', transformer=AsmTransformer())
+
+    return parser
+
+_parser = None
+
+def get_parser():
+    global _parser
+
+    if _parser is None:
+        _parser = _open_parser()
+
+    return _parser
 
 def parse(text):
     if text[-1] != '\n':
         text = text + '\n'
     
-    tree = parser.parse(text)
-    tree = transformer.transform(tree)
-
-    return tree.children
+    try:
+        return get_parser().parse(text)
+    except UnexpectedToken as ex:
+        # listing the accepted tokens would replay the parser state through
+        # AsmTransformer, which raises on the incomplete instruction
+        ex.interactive_parser = None
+        raise
+
+def parse_line(line, lineno, segm):
+    # parse a single line of a segment, padded with newlines so errors
+    # carry the line number of the original source
+    padding = "\n" * (lineno - 1)
+
+    if segm == 'data':
+        segments = parse(f".data{padding}{line}\n.text\n")
+    else:
+        segments = parse(f".text{padding}{line}\n")
+
+    return segments[0].lines
@@ -1,6 +1,11 @@
+import mmap
+import os
 import re
+import struct
 
 class Constant:
+    __slots__ = ("val",)
+
     def __init__(self, val):
         self.val = val
 
@@ -14,6 +19,8 @@ class Constant:
         return self.val
 
 class StringConstant(Constant):
+    __slots__ = ()
+
     def numeric_val(self):
         try:
             return ord(self.val.encode().decode('unicode_escape').encode())
@@ -21,6 +28,8 @@ class StringConstant(Constant):
             raise Exception("Cannot take numeric value of string")
 
 class OffsetRegister:
+    __slots__ = ("reg", "offset")
+
     def __init__(self, reg, offset):
         self.reg = reg
         self.offset = offset
@@ -32,6 +41,8 @@ class OffsetRegister:
         return f"OffsetRegister({self.reg}, {self.offset})"
 
 class Label:
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
     
@@ -45,6 +56,8 @@ class Label:
         visitor.visit_Label(self)
 
 class LabelRef:
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
     
@@ -55,6 +68,8 @@ class LabelRef:
         return f"LabelRef({self.name})"
 
 class MemLabel:
+    __slots__ = ("addr",)
+
     def __init__(self, addr):
         self.addr = addr
     
@@ -64,7 +79,11 @@ class MemLabel:
     def accept(self, visitor):
         visitor.visit_MemLabel(self)
 
+# A declaration takes len(decl) bytes of RAM: the bytes of to_bytes(),
+# then zeros up to its size, which the writers fill in blocks
 class Decl:
+    __slots__ = ("val",)
+
     def __init__(self, val):
         self.val = val
 
@@ -77,37 +96,43 @@ class Decl:
     def to_bytes(self):
         raise Exception("Invalid call")
 
-class WordDecl(Decl):
-    def __str__(self):
-        return f".word {self.val}"
-
-    def to_bytes(self):
-        return self.val.to_bytes(4, 'big')
-
-    def __len__(self):
-        return 4
+class ValuesDecl(Decl):
+    # val is a tuple of integers, packed big endian in one call
+    __slots__ = ()
+    name = None
+    format = None
 
-class HalfDecl(Decl):
     def __str__(self):
-        return f".half {self.val}"
+        return f".{self.name} {', '.join(str(val) for val in self.val)}"
 
     def to_bytes(self):
-        return self.val.to_bytes(2, 'big')
+        try:
+            return struct.pack(f">{len(self.val)}{self.format}", *self.val)
+        except struct.error:
+            bad = next(val for val in self.val if not 0 <= val < 1 << (8 * struct.calcsize(f">{self.format}")))
+            raise Exception(f"Value {bad} does not fit in .{self.name}")
 
     def __len__(self):
-        return 2
+        return struct.calcsize(f">{self.format}") * len(self.val)
 
-class ByteDecl(Decl):
-    def __str__(self):
-        return f".byte {self.val}"
+class WordDecl(ValuesDecl):
+    __slots__ = ()
+    name = "word"
+    format = "L"
 
-    def to_bytes(self):
-        return self.val.to_bytes(1, 'big')
+class HalfDecl(ValuesDecl):
+    __slots__ = ()
+    name = "half"
+    format = "H"
 
-    def __len__(self):
-        return 1
+class ByteDecl(ValuesDecl):
+    __slots__ = ()
+    name = "byte"
+    format = "B"
 
 class AsciizDecl(Decl):
+    __slots__ = ()
+
     def __str__(self):
         return f".asciiz \"{self.val}\""
 
@@ -115,19 +140,95 @@ class AsciizDecl(Decl):
         return self.val.encode().decode('unicode_escape').encode() + b'\0'
 
     def __len__(self):
-        return len(self.val) + 1
+        return len(self.to_bytes())
 
 class SpaceDecl(Decl):
+    __slots__ = ()
+
     def __str__(self):
         return f".space {self.val}"
 
     def to_bytes(self):
-        return b'\0' * self.val
+        return b''
 
     def __len__(self):
         return self.val
 
+class IncbinDecl(Decl):
+    # val is the path of the file, mapped instead of read when written
+    __slots__ = ("size",)
+
+    def __init__(self, val):
+        super().__init__(val)
+        self.size = os.stat(val).st_size
+
+    def __str__(self):
+        return f".incbin \"{self.val}\""
+
+    def to_bytes(self):
+        if not self.size:
+            return b''
+
+        with open(self.val, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # the view keeps the mapping open, a file that shrank is zero filled
+        return memoryview(data)[:self.size]
+
+    def __len__(self):
+        return self.size
+
+def _single(decl_type, vals):
+    if len(vals) != 1:
+        raise Exception(f".{decl_type} takes a single value")
+
+    return vals[0]
+
+def _space(vals):
+    size = _single("space", vals).numeric_val()
+
+    if size < 0:
+        raise Exception(f"Negative size: .space {size}")
+
+    return SpaceDecl(size)
+
+def _asciiz(vals):
+    val = _single("asciiz", vals)
+
+    if not isinstance(val, StringConstant):
+        raise Exception(".asciiz takes a string")
+
+    return AsciizDecl(val.val)
+
+def _incbin(vals):
+    val = _single("incbin", vals)
+
+    if not isinstance(val, StringConstant):
+        raise Exception(".incbin takes a file name")
+
+    try:
+        return IncbinDecl(val.val)
+    except OSError as ex:
+        raise Exception(f"Cannot include {val.val}: {ex.strerror}")
+
+_decl_types = {
+    "word": lambda vals: WordDecl(tuple(val.numeric_val() for val in vals)),
+    "half": lambda vals: HalfDecl(tuple(val.numeric_val() for val in vals)),
+    "byte": lambda vals: ByteDecl(tuple(val.numeric_val() for val in vals)),
+    "asciiz": _asciiz,
+    "space": _space,
+    "incbin": _incbin,
+}
+
+def create_decl(decl_type, *vals):
+    if decl_type not in _decl_types:
+        raise Exception(f"No such declaration type: .{decl_type}")
+
+    return _decl_types[decl_type](vals)
+
 class DataSegment:
+    __slots__ = ("lines",)
+
     def __init__(self, lines):
         self.lines = lines
 
@@ -138,6 +239,8 @@ class DataSegment:
         visitor.visit_DataSegment(self)
 
 class TextSegment:
+    __slots__ = ("lines",)
+
     def __init__(self, lines):
         self.lines = lines
 
@@ -0,0 +1,93 @@
+import contextlib
+import io
+import sys
+import time
+from .assembler import Assembler
+
+# Assembles many independent files over a pool of worker processes. Every
+# worker loads the parser once and keeps it for all the files it gets.
+
+class FileResult:
+    __slots__ = ("input", "ram", "rom", "ok", "error", "seconds", "output", "cached", "files")
+
+    def __init__(self, input, ram, rom, ok, error, seconds, output, cached=False, files=()):
+        self.input = input
+        self.ram = ram
+        self.rom = rom
+        self.ok = ok
+        self.error = error
+        self.seconds = seconds
+        # everything the assembler printed (the debug output)
+        self.output = output
+        # restored from the build cache
+        self.cached = cached
+        # the files of the other output formats
+        self.files = list(files)
+
+    def __str__(self):
+        status = ("cached" if self.cached else "ok") if self.ok else f"FAILED: {self.error}"
+        return f"{self.input}: {status} ({self.seconds:.3f}s)"
+
+def executor(workers, initializer=None, initargs=()):
+    # threads are enough without the GIL, otherwise forked processes, which
+    # inherit the initializer arguments without pickling them
+    if not getattr(sys, "_is_gil_enabled", lambda: True)():
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer, initargs=initargs)
+
+def _init_worker():
+    from .parser import get_parser
+    get_parser()
+
+def assemble_file(input, ram, rom, debug=False, batch=False, cache=None, outputs=()):
+    # cache is the directory of a BuildCache, or None. outputs are other
+    # formats to write, as for mips.formats.write_outputs
+    start = time.perf_counter()
+    output = io.StringIO()
+    error = None
+    cached = False
+    files = []
+
+    try:
+        with contextlib.redirect_stdout(output):
+            with io.open(input, "r") as f:
+                text = f.read()
+
+            # the files are already spread over the pool, no nested pools
+            if cache is not None:
+                from .buildcache import BuildCache, assemble_files_cached
+                cached = assemble_files_cached(BuildCache(cache), text, ram, rom, debug=debug, batch=batch, workers=1,
+                    outputs=outputs, files=files)
+            else:
+                asm = Assembler(ram, rom, debug=debug, batch=batch, workers=1)
+
+                try:
+                    asm.assemble(text)
+                finally:
+                    asm.finalize()
+
+                if outputs:
+                    from .formats import write_outputs
+                    files = write_outputs(*asm.images, outputs)
+    except Exception as ex:
+        error = str(ex)
+
+    return FileResult(input, ram, rom, error is None, error, time.perf_counter() - start, output.getvalue(), cached, files)
+
+def assemble_files(files, workers=None, debug=False, batch=False, cache=None):
+    # files is a list of (input, ram, rom) paths, the results are in the same order
+    from concurrent.futures import ProcessPoolExecutor
+
+    files = list(files)
+    if not files:
+        return []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = [executor.submit(assemble_file, input, ram, rom, debug, batch, cache) for input, ram, rom in files]
+        return [future.result() for future in futures]
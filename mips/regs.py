@@ -1,4 +1,6 @@
 class Register:
+    __slots__ = ("reg_id", "name")
+
     def __init__(self, reg_id, name):
         self.reg_id = reg_id
         self.name = name
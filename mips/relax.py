@@ -0,0 +1,391 @@
+from array import array
+from itertools import accumulate
+import mips.isa as isa
+import mips.regs as regs
+from mips.parsetypes import Label, MemLabel, LabelRef, TextSegment
+from mips.instructions import Instruction, J, Jr, Jalr, Nop
+from mips.ir import Program, SEGMENT, LABEL, MEMLABEL, INSTR, _word_kinds
+
+# Relaxation of the instructions whose size depends on where their label
+# ends up. They are parsed in their shortest form and only grow, between
+# the first and the second pass, until every one of them fits:
+#   - la is an ori of the label while it fits in 16 bits, lui + ori after
+#   - a branch out of the 16 bit range is the opposite branch over a j, or
+#     over la $at + jr $at when the j doesn't reach either
+#   - j and jal to another 2^26 word region are la $at + jr $at / jalr $at
+# With delay slots (see mips/schedule.py) the opposite branch has a nop in
+# its slot and goes to the one of the j or jr, the instruction after the
+# unit, which then runs on both ways.
+# The growable rows of the text segment (units) are collected in a walk at
+# their shortest sizes. Every round then shifts the units and the labels by
+# the growth before them in their run, with prefix sums, and grows the
+# units that don't fit. A unit is only checked again once the total growth
+# since its last check could use up its slack, and leaves the worklist at
+# its largest size, so rounds are linear and only a few are needed.
+
+# largest size of every kind of unit, a word more for rel with delay slots
+_SIZES = {"rel": 4, "abs": 3, "raw": 3, "val": 2}
+_KINDS = tuple(_SIZES)
+REL, ABS, RAW, VAL = range(4)
+
+REGION = 1 << 26
+_INF = float("inf")
+
+_opposite = {"beq": "bne", "bne": "beq", "bltz": "bgez", "bgez": "bltz"}
+
+def _left(addr):
+    # how far addr can move forward and stay in its region
+    return REGION - 1 - (addr & (REGION - 1))
+
+def _fit(kind, size, pc, target, delay=0):
+    # the smallest size from size on that fits, and its slack: how far pc
+    # and target can still move forward with the unit fitting. delay is 1
+    # with delay slots
+    if kind == REL:
+        offset = target - pc
+
+        if size == 1:
+            if -0x8000 <= offset < 0x8000:
+                return 1, min(0x7FFF - offset, offset + 0x8000)
+            size = 2 + delay
+        if size == 2 + delay and (pc + 1 + delay) >> 26 == target >> 26:
+            return size, min(_left(pc + 1 + delay), _left(target))
+
+        return 4 + delay, _INF
+
+    if kind == ABS:
+        if size == 1 and pc >> 26 == target >> 26:
+            return 1, min(_left(pc), _left(target))
+        return 3, _INF
+
+    if kind == RAW:
+        if size == 1 and 0 <= target < REGION:
+            return 1, REGION - 1 - target
+        return 3, _INF
+
+    if size == 1 and 0 <= target <= 0xFFFF:
+        return 1, 0xFFFF - target
+    return 2, _INF
+
+def _opposite_row(row, skip):
+    # the branch of row with the opposite condition, skip words ahead
+    _, op, rs, rt, _ = row
+    word = (op << 26) | (rs << 21) | (rt << 16)
+    spec = isa.decode(word)
+
+    if spec is None or spec.mnemonic not in _opposite:
+        raise Exception(f"Cannot relax the branch {word:08x}")
+
+    other = next(other for other in isa.table() if other.mnemonic == _opposite[spec.mnemonic])
+    word = (word & ~spec.mask) | other.value
+
+    return ("i", word >> 26, (word >> 21) & 0x1F, (word >> 16) & 0x1F, skip)
+
+def _far(name, reg):
+    # the label in reg, for any address
+    return (("hi", 0xf, 0x0, reg, name), ("lo", 0xd, reg, reg, name))
+
+def expand(row, size, delay=0):
+    # the rows of a unit at a size
+    if size == 1:
+        return (row,)
+
+    kind, name = row[0], row[-1]
+
+    if kind == "val":
+        return _far(name, row[3])
+    if kind == "abs":
+        return _far(name, regs.at.reg_id) + Jr(regs.at).rows()
+    if kind == "raw":
+        return _far(name, regs.at.reg_id) + Jalr(regs.at).rows()
+    # the opposite branch goes past the unit
+    if size == 2 + delay:
+        return (_opposite_row(row, size),) + Nop().rows() * delay + J(LabelRef(name)).rows()
+
+    return (_opposite_row(row, size),) + Nop().rows() * delay + _far(name, regs.at.reg_id) + Jr(regs.at).rows()
+
+class Relaxed(Instruction):
+    # a parsed instruction with its relaxed rows
+    __slots__ = ("instr", "relaxed")
+
+    def __init__(self, instr, relaxed):
+        self.instr = instr
+        self.relaxed = relaxed
+
+    def rows(self):
+        return self.relaxed
+
+    def __str__(self):
+        return str(self.instr)
+
+    def __len__(self):
+        return len(self.relaxed)
+
+class Relaxation:
+    def __init__(self, delay_slots=False):
+        self.delay = int(delay_slots)
+        # the units in text order: kind, address at the shortest sizes,
+        # first unit of their run and label
+        self.kind = array('B')
+        self.pos = array('q')
+        self.run = array('i')
+        self.names = []
+        # {name: (address, first unit of its run, units before)} of the
+        # text labels
+        self.labels = dict()
+        self._run = 0
+        # the size of every unit and whether any grew, once solved
+        self.sizes = None
+        self.grew = False
+        self.rounds = 0
+
+    def new_run(self):
+        # the text address is set, the growth before doesn't move what follows
+        self._run = len(self.kind)
+
+    def label(self, name, addr):
+        self.labels[name] = (addr, self._run, len(self.kind))
+
+    def add_rows(self, rows, addr):
+        # the units of the rows of an instruction at addr
+        for i, row in enumerate(rows):
+            if row[0] in _SIZES:
+                self.kind.append(_KINDS.index(row[0]))
+                self.pos.append(addr + i)
+                self.run.append(self._run)
+                self.names.append(row[-1])
+
+    def solve(self, labels):
+        # finds the size of every unit, labels ({name: address} at the
+        # shortest sizes) get the final addresses. True if any unit grew
+        count = len(self.kind)
+        kinds, pos, run = self.kind, self.pos, self.run
+
+        # the target of every unit as (address, first unit of its run,
+        # units before), labels outside the text segment don't move
+        targets = []
+        for name in self.names:
+            if name in self.labels:
+                targets.append(self.labels[name])
+            elif name in labels:
+                targets.append((labels[name], 0, 0))
+            else:
+                # not defined, the second pass reports it
+                targets.append(None)
+
+        growth = [0] * count
+        self.rounds = 0
+        checked = [None] * count
+        slack = [0] * count
+        work = [unit for unit in range(count) if targets[unit] is not None]
+        prefix = [0] * (count + 1)
+
+        while work:
+            self.rounds = self.rounds + 1
+            prefix = list(accumulate(growth, initial=0))
+            total = prefix[-1]
+            grew = False
+            left = []
+
+            for unit in work:
+                if checked[unit] is not None and total - checked[unit] <= slack[unit]:
+                    left.append(unit)
+                    continue
+
+                addr, first, before = targets[unit]
+                pc = pos[unit] + prefix[unit] - prefix[run[unit]]
+                size, slack[unit] = _fit(kinds[unit], growth[unit] + 1, pc, addr + prefix[before] - prefix[first], self.delay)
+                checked[unit] = total
+
+                if size != growth[unit] + 1:
+                    growth[unit] = size - 1
+                    grew = True
+
+                if slack[unit] != _INF:
+                    left.append(unit)
+
+            work = left
+            if not grew:
+                break
+
+        prefix = list(accumulate(growth, initial=0))
+        for name, (addr, first, before) in self.labels.items():
+            labels[name] = addr + prefix[before] - prefix[first]
+
+        self.sizes = array('B', (g + 1 for g in growth))
+        self.grew = prefix[-1] > 0
+
+        return self.grew
+
+    def expand(self, rows, unit):
+        # the rows of an instruction with its units at their sizes, from
+        # the unit index of its first one, and the index after its last
+        out = []
+
+        for row in rows:
+            if row[0] in _SIZES:
+                out.extend(expand(row, self.sizes[unit], self.delay))
+                unit = unit + 1
+            else:
+                out.append(row)
+
+        return tuple(out), unit
+
+def _unit_rows(program: Program, item):
+    # the rows of the units in the words of an instruction item
+    names = program.symbols.names
+    a, b = program.a[item], program.b[item]
+
+    for index in range(a, a + b):
+        kind = program.word_kind[index]
+
+        if kind and _word_kinds[kind] in _SIZES:
+            yield index - a, (_word_kinds[kind], names[program.word_sym[index]])
+
+def relax_program(program: Program, labels, text_addr=0, delay_slots=False):
+    # relaxes the program table in place, labels ({name: address}) are the
+    # ones of the first pass and get the final addresses. text_addr is the
+    # address of the text segment. Returns the Relaxation
+    relaxation = Relaxation(delay_slots)
+    names = program.symbols.names
+    objects = program.objects
+    origin = text_addr
+    segm = 'data'
+    items = []
+
+    for item, (kind, a, b, c) in enumerate(zip(program.kind, program.a, program.b, program.c)):
+        if kind == INSTR:
+            if c and item not in objects:
+                items.append(item)
+
+                for offset, (unit_kind, name) in _unit_rows(program, item):
+                    relaxation.kind.append(_KINDS.index(unit_kind))
+                    relaxation.pos.append(text_addr + offset)
+                    relaxation.run.append(relaxation._run)
+                    relaxation.names.append(name)
+
+            text_addr = text_addr + b
+        elif kind == LABEL:
+            if segm == 'text':
+                relaxation.label(names[a], text_addr)
+        elif kind == MEMLABEL:
+            if segm == 'text':
+                relaxation.new_run()
+                text_addr = a
+        elif kind == SEGMENT:
+            segm = 'text' if a else 'data'
+
+            if a:
+                relaxation.new_run()
+                text_addr = origin
+
+    if relaxation.solve(labels):
+        _rewrite(program, relaxation, items)
+
+    return relaxation
+
+def _rewrite(program: Program, relaxation, items):
+    # the words of the items with grown units, the other words are copied
+    # and the word offsets of the items after moved
+    sizes = relaxation.sizes
+    out = Program()
+    out.symbols = program.symbols
+    grown = dict()
+    unit = 0
+    copied = 0
+
+    for item in items:
+        a, b = program.a[item], program.b[item]
+        count = sum(1 for _ in _unit_rows(program, item))
+
+        if max(sizes[unit:unit + count]) == 1:
+            unit = unit + count
+            continue
+
+        out.words += program.words[4 * copied:4 * a]
+        out.word_kind += program.word_kind[copied:a]
+        out.word_sym += program.word_sym[copied:a]
+
+        rows = [program.word_row(index) if program.word_kind[index] else
+            ("w", program.words[4 * index:4 * index + 4]) for index in range(a, a + b)]
+        labels = 0
+
+        for row in rows:
+            if row[0] == "w":
+                out.words += row[1]
+                out.word_kind.append(0)
+                out.word_sym.append(0)
+                continue
+
+            if row[0] in _SIZES:
+                relaxed = expand(row, sizes[unit], relaxation.delay)
+                unit = unit + 1
+            else:
+                relaxed = (row,)
+
+            labels = labels + out.add_rows(relaxed)
+
+        grown[item] = (len(out.word_kind), labels)
+        copied = a + b
+
+    out.words += program.words[4 * copied:]
+    out.word_kind += program.word_kind[copied:]
+    out.word_sym += program.word_sym[copied:]
+
+    shift = 0
+    for item, kind in enumerate(program.kind):
+        if kind != INSTR:
+            continue
+
+        a, b = program.a[item], program.b[item]
+        program.a[item] = a + shift
+
+        if item in grown:
+            end, labels = grown[item]
+            program.b[item] = end - (a + shift)
+            program.c[item] = labels
+            shift = shift + program.b[item] - b
+
+    program.words, program.word_kind, program.word_sym = out.words, out.word_kind, out.word_sym
+
+def relax_segments(segments, labels, text_addr=0, delay_slots=False):
+    # relaxes parsed segments, the instructions that grow are replaced by
+    # Relaxed ones. Same arguments as relax_program
+    relaxation = Relaxation(delay_slots)
+    origin = text_addr
+    found = []
+
+    for segm in segments:
+        text = isinstance(segm, TextSegment)
+
+        if text:
+            relaxation.new_run()
+            text_addr = origin
+
+        for index, line in enumerate(segm.lines):
+            if isinstance(line, Instruction):
+                first = len(relaxation.kind)
+                rows = line.rows()
+                relaxation.add_rows(rows, text_addr)
+
+                if len(relaxation.kind) > first:
+                    found.append((segm, index, rows, first))
+
+                text_addr = text_addr + len(line)
+            elif text and isinstance(line, Label):
+                relaxation.label(line.name, text_addr)
+            elif text and isinstance(line, MemLabel):
+                relaxation.new_run()
+                text_addr = line.addr
+
+    if relaxation.solve(labels):
+        for segm, index, rows, first in found:
+            relaxed, _ = relaxation.expand(rows, first)
+
+            if len(relaxed) != len(rows):
+                if not isinstance(segm.lines, list):
+                    segm.lines = list(segm.lines)
+
+                segm.lines[index] = Relaxed(segm.lines[index], relaxed)
+
+    return relaxation
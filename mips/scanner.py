@@ -0,0 +1,229 @@
+import re
+import mips.regs as regs
+from mips.parsetypes import *
+from mips.instructions import resolve_instruction
+
+# Single pass line scanner for the common, well formed lines. It only
+# accepts lines it can read exactly like mipsasm.lark would and hands
+# everything else to the lark parser, which also produces the errors.
+
+_NAME = r"[A-Za-z_][A-Za-z0-9_]*"
+_END = r"(?![A-Za-z0-9_])"
+
+_segment_re = re.compile(r"[ \t]*\.(data|text)([ \t]*(?:[#;].*)?$)?")
+_prefix_re = re.compile(rf"[ \t]*(?:@[ \t]*0x([0-9a-fA-F]+){_END}[ \t]*)?(?:({_NAME})[ \t]*:[ \t]*)?")
+_instr_re = re.compile(rf"({_NAME})(?:[ \t]+|$)")
+_value_re = re.compile(rf"0x([0-9a-fA-F]+){_END}|([+-]?[0-9]+){_END}|(\"(?:[^\"\\\\]|\\\\.)*\")")
+_decl_re = re.compile(rf"\.[ \t]*({_NAME}){_END}[ \t]*((?:{_value_re.pattern})(?:[ \t]*,[ \t]*(?:{_value_re.pattern}))*)[ \t]*(?:[#;].*)?$")
+_arg_re = re.compile(rf"""
+    (?:
+        ([+-]?[0-9]+)[ \t]*\([ \t]*\$(\w+)[ \t]*\)     # offset register
+        | \$(\w+)                                   # register
+        | 0x([0-9a-fA-F]+){_END}                    # hex constant
+        | ([+-]?[0-9]+){_END}                       # integer constant
+        | ({_NAME})                                 # label reference
+    )
+    ([ \t]*)(,[ \t]*)?                             # separator
+""", re.VERBOSE)
+_comment_re = re.compile(r"[#;]")
+_incbin_re = re.compile(rf"^{_prefix_re.pattern}\.[ \t]*incbin{_END}[ \t]*\"((?:[^\"\\\\]|\\\\.)*)\"", re.MULTILINE)
+
+class _Fallback(Exception):
+    pass
+
+def _strip_comment(line):
+    if '"' in line:
+        return line
+
+    m = _comment_re.search(line)
+    return line if m is None else line[:m.start()]
+
+def _register(name, lineno):
+    # same lexing as the grammar: $0-$9 are numeric, longer names are named registers
+    if len(name) == 1:
+        try:
+            return regs.from_id(int(name))
+        except Exception as ex:
+            raise Exception(f"line {lineno}: {ex}")
+
+    try:
+        return regs.from_name(name)
+    except Exception as ex:
+        raise Exception(f"line {lineno}: {ex}")
+
+def _args(text, lineno):
+    # the whole line is matched before any value is converted, lark
+    # reports syntax errors before errors about the operands
+    matches = []
+    pos = 0
+
+    while pos < len(text):
+        m = _arg_re.match(text, pos)
+        if m is None:
+            raise _Fallback()
+
+        pos = m.end()
+        offset, offset_reg, reg, hex_val, int_val, name, space, comma = m.groups()
+
+        if pos < len(text) and not space and comma is None:
+            # arguments must be separated by a comma or whitespace
+            raise _Fallback()
+        if pos == len(text) and comma is not None:
+            raise _Fallback()
+
+        reg = offset_reg or reg
+        if reg is not None and len(reg) == 1 and not '0' <= reg <= '9':
+            # $a is not a register token at all
+            raise _Fallback()
+
+        matches.append(m.groups())
+
+    args = []
+    for offset, offset_reg, reg, hex_val, int_val, name, _, _ in matches:
+        if offset is not None:
+            args.append(OffsetRegister(_register(offset_reg, lineno), int(offset)))
+        elif reg is not None:
+            args.append(_register(reg, lineno))
+        elif hex_val is not None:
+            args.append(Constant(int(hex_val, base=16)))
+        elif int_val is not None:
+            args.append(Constant(int(int_val)))
+        else:
+            args.append(LabelRef(name))
+
+    return args
+
+def _decl(text, lineno):
+    m = _decl_re.match(text)
+    if m is None:
+        raise _Fallback()
+
+    vals = []
+    for hex_val, int_val, string in _value_re.findall(m.group(2)):
+        if hex_val:
+            vals.append(Constant(int(hex_val, base=16)))
+        elif int_val:
+            vals.append(Constant(int(int_val)))
+        else:
+            vals.append(StringConstant(string[1:-1]))
+
+    try:
+        return create_decl(m.group(1), *vals)
+    except Exception as ex:
+        raise Exception(f"line {lineno}: {ex}")
+
+def _instr(text, lineno):
+    if '"' in text:
+        raise _Fallback()
+
+    m = _instr_re.match(text)
+    if m is None:
+        raise _Fallback()
+
+    args = _args(text[m.end():], lineno)
+    try:
+        return resolve_instruction(m.group(1), args)
+    except Exception as ex:
+        raise Exception(f"line {lineno}: {ex}")
+
+def scan_line(line, lineno, segm):
+    if line.endswith('\r'):
+        line = line[:-1]
+
+    line = _strip_comment(line)
+
+    prefix = _prefix_re.match(line)
+    addr, label = prefix.groups()
+    rest = line[prefix.end():].rstrip(" \t")
+
+    out = []
+    if addr is not None:
+        out.append(MemLabel(int(addr, base=16)))
+    if label is not None:
+        out.append(Label(label))
+
+    if rest:
+        if segm == 'data':
+            out.append(_decl(rest, lineno))
+        else:
+            out.append(_instr(rest, lineno))
+
+    return out
+
+def _scan_line_or_fallback(line, lineno, segm):
+    try:
+        return scan_line(line, lineno, segm)
+    except _Fallback:
+        from mips.parser import parse_line
+        return parse_line(line, lineno, segm)
+
+def scan_iter(lines):
+    # yields (line number, object) for a new, empty DataSegment/TextSegment
+    # at each segment directive and for the parsed objects of every other line
+    segm = None
+
+    for lineno, line in enumerate(lines, 1):
+        if line.endswith('\n'):
+            line = line[:-1]
+
+        m = _segment_re.match(line.rstrip('\r'))
+
+        if m is not None:
+            # anything else on the line, or .textual, is lexed differently by lark
+            if m.group(2) is None:
+                raise _Fallback(f"line {lineno}: .data and .text must be on a line of their own")
+
+            # only .data followed by .text, or a single .text
+            if segm == 'text' or (segm == 'data' and m.group(1) == 'data'):
+                raise _Fallback(f"line {lineno}: Unexpected .{m.group(1)}")
+
+            segm = m.group(1)
+            yield lineno, DataSegment([]) if segm == 'data' else TextSegment([])
+        elif segm is None:
+            raise _Fallback(f"line {lineno}: Expected .data or .text")
+        else:
+            for item in _scan_line_or_fallback(line, lineno, segm):
+                yield lineno, item
+
+    if segm != 'text':
+        raise _Fallback("Missing .text segment")
+
+def split_lines(text):
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+
+    return lines
+
+def scan(text, linenos=None):
+    # linenos, when given, gets the line of every item
+    segments = []
+    for lineno, item in scan_iter(split_lines(text)):
+        if linenos is not None:
+            linenos[item] = lineno
+
+        if isinstance(item, (DataSegment, TextSegment)):
+            segments.append(item)
+        else:
+            segments[-1].lines.append(item)
+
+    return segments
+
+def parse(text, linenos=None):
+    if text[-1] != '\n':
+        text = text + '\n'
+
+    try:
+        return scan(text, linenos)
+    except _Fallback:
+        # not something the scanner understands as a whole, let lark
+        # parse it (or report the error), without lines
+        if linenos is not None:
+            linenos.clear()
+
+        from mips.parser import parse as parse_lark
+        return parse_lark(text)
+
+def incbin_paths(text):
+    # the files a source includes with .incbin, without parsing it
+    return [m.group(3) for m in _incbin_re.finditer(text)]
@@ -0,0 +1,542 @@
+import heapq
+import struct
+from array import array
+import mips.isa as isa
+from mips.parsetypes import TextSegment
+from mips.instructions import Instruction, Nop
+from mips.ir import Program, INSTR
+
+# Load-use scheduling, opt-in (-schedule). On the 5 stage pipeline a load
+# followed by an instruction that reads the loaded register stalls for a
+# cycle, even with forwarding. The text segment is split in basic blocks:
+# runs of instructions without labels or @addr lines in between, ending
+# after a branch or a jump. Every block gets a dependency graph of its
+# instructions (a line, pseudoinstructions as a whole) from the registers
+# their words read and write, as given by the ISA table, and the memory
+# accesses stay in order. A list scheduling in source order then picks an
+# independent instruction instead of one that would stall, within WINDOW
+# ready ones, and the block keeps its new order only if it stalls less.
+# The branch or jump that ends a block stays last, and a block keeps its
+# size, so no label moves.
+#
+# Branches here have no delay slot (see the simulator) unless the CPU is
+# built with them (-delay-slots): the word after a branch or jump then
+# always runs, before the target. The source is still written without
+# them, and before the first pass every branch and jump gets its slot: the
+# last single word instruction of its block, within WINDOW, that the ones
+# after it don't depend on is moved there, or a nop is added. The moved
+# instruction neither uses a label, whose size could still change, nor $at,
+# which the relaxation of the branch can set. A block with a slot ends
+# after it, and the load-use scheduling keeps the slot there.
+
+WINDOW = 8
+
+# hi and lo, as in mips/simulator.py
+HI, LO = 32, 33
+AT = 1
+
+# an added delay slot in the new order of the items, see _fill
+NOP = -1
+
+_LOADS = {"lb", "lbu", "lh", "lhu", "ll", "lw"}
+_STORES = {"sb", "sh", "sw", "sc"}
+_JUMPS = {"jr", "jalr"}
+
+# registers read or written besides the operands
+_READS = {"sc": ("rt",)}
+_WRITES = {"sc": ("rt",)}
+_READS_HILO = {"mfhi": (HI,), "mflo": (LO,)}
+_WRITES_HILO = {"mult": (HI, LO), "multu": (HI, LO), "div": (HI, LO), "divu": (HI, LO)}
+
+class _Word:
+    __slots__ = ("reads", "writes", "mem", "control", "load")
+
+# {word: _Word}, programs repeat their words a lot
+_cache = dict()
+
+def _word(word):
+    # what a word reads, writes and accesses, None if it isn't an
+    # instruction. Label fields are zero in the program table, they don't
+    # matter here
+    if word in _cache:
+        return _cache[word]
+
+    spec = isa.decode(word)
+    if spec is None:
+        _cache[word] = None
+        return None
+
+    fields = isa.FIELDS[spec.fmt]
+    field = lambda name: (word >> fields[name][0]) & ((1 << fields[name][1]) - 1)
+    mnemonic = spec.mnemonic
+
+    # the field an instruction writes, rd, or rt for the immediates
+    if spec.fmt == "r":
+        written = ("rd",) if "rd" in spec.names or spec.fixed.get("rd") else ()
+    elif spec.fmt == "i" and "rt" in spec.names and spec.label is None and mnemonic not in _STORES:
+        written = ("rt",)
+    else:
+        written = ()
+
+    read = [f for kind, f, _ in spec.operands if kind == "reg" and f not in written]
+    read += [base for kind, _, base in spec.operands if kind == "off"]
+
+    effects = _Word()
+    effects.reads = {field(f) for f in read + list(_READS.get(mnemonic, ()))} | set(_READS_HILO.get(mnemonic, ()))
+    effects.writes = {field(f) for f in written + _WRITES.get(mnemonic, ())} | set(_WRITES_HILO.get(mnemonic, ()))
+
+    if mnemonic == "jal":
+        effects.writes.add(31)
+
+    # $zero is never written, and reading it depends on nothing
+    effects.reads.discard(0)
+    effects.writes.discard(0)
+
+    effects.mem = mnemonic in _LOADS or mnemonic in _STORES
+    effects.control = spec.label is not None or mnemonic in _JUMPS
+    effects.load = field("rt") if mnemonic in _LOADS and field("rt") else None
+
+    _cache[word] = effects
+    return effects
+
+# {word: whether it is a branch or jump, None if it isn't an instruction},
+# what splits the blocks, cheaper than all of _word
+_controls = dict()
+
+def _control(word):
+    if word not in _controls:
+        spec = isa.decode(word)
+        _controls[word] = None if spec is None else spec.label is not None or spec.mnemonic in _JUMPS
+
+    return _controls[word]
+
+def _ends_block(words):
+    return any(_control(word) is not False for word in words)
+
+def _has_slot(words):
+    # the words end in a branch or jump
+    return _control(words[-1]) is True
+
+def _independent(item, others):
+    # item can run after the others instead of before them
+    for other in others:
+        if item.writes & (other.reads | other.writes) or item.reads & other.writes or (item.mem and other.mem):
+            return False
+
+    return True
+
+# {words: _Item}, like _cache
+_items = dict()
+
+def _item(words):
+    item = _items.get(words)
+
+    if item is None:
+        item = _items[words] = _Item(words)
+
+    return item
+
+class _Item:
+    # an instruction of a block: the union of its words, what its first
+    # word reads and the register its last word loads
+    __slots__ = ("reads", "writes", "mem", "control", "first", "load", "stalls")
+
+    def __init__(self, words):
+        effects = [_word(word) for word in words]
+
+        self.reads, self.writes = set(), set()
+        self.mem = self.control = False
+        self.stalls = 0
+
+        for i, word in enumerate(effects):
+            if word is None:
+                # not an instruction, nothing moves past it
+                self.control = True
+                continue
+
+            self.reads |= word.reads
+            self.writes |= word.writes
+            self.mem = self.mem or word.mem
+            self.control = self.control or word.control
+
+            if i and effects[i - 1] is not None and effects[i - 1].load in word.reads:
+                self.stalls = self.stalls + 1
+
+        self.first = effects[0].reads if effects and effects[0] is not None else set()
+        self.load = effects[-1].load if effects and effects[-1] is not None else None
+
+def _stalls(items, order):
+    stalls = sum(items[i].stalls for i in order)
+
+    for prev, i in zip(order, order[1:]):
+        if items[prev].load is not None and items[prev].load in items[i].first:
+            stalls = stalls + 1
+
+    return stalls
+
+class Schedule:
+    def __init__(self):
+        # how it went, over all blocks
+        self.blocks = 0
+        self.moved = 0
+        self.stalls = 0
+        self.removed = 0
+        # delay slots, None when they aren't filled
+        self.slots = None
+        self.filled = 0
+
+    def __str__(self):
+        parts = []
+        if self.slots is not None:
+            parts.append(f"{self.filled} of {self.slots} delay slots filled")
+        if self.blocks or self.slots is None:
+            parts.append(f"{self.removed} of {self.stalls} load-use stalls removed, "
+                f"{self.moved} instructions moved in {self.blocks} blocks")
+
+        return ", ".join(parts)
+
+    def fill(self, block):
+        # the index of the instruction to move into the delay slot of the
+        # branch or jump that ends a block, None for a nop. block is the
+        # words of its instructions and whether they use a label
+        self.slots = self.slots + 1
+        after = [_item(tuple(block[-1][0]))]
+
+        for i in range(len(block) - 2, max(len(block) - 2 - WINDOW, -1), -1):
+            words, labels = block[i]
+            item = _item(tuple(words))
+
+            if len(words) == 1 and not labels and not item.control and AT not in item.reads | item.writes and _independent(item, after):
+                self.filled = self.filled + 1
+                return i
+
+            after.append(item)
+
+        return None
+
+    def order(self, words, fixed=0):
+        # the new order of a block, given the words of its instructions,
+        # None when it stays as it is. The last fixed ones stay last
+        items = [_item(tuple(item)) for item in words]
+        count = len(items)
+        stalls = _stalls(items, range(count))
+
+        self.blocks = self.blocks + 1
+        self.stalls = self.stalls + stalls
+
+        if not stalls:
+            return None
+
+        # the dependency graph: register reads after writes, writes after
+        # reads and writes, memory accesses in order, the end of the block
+        # after everything
+        succs = [[] for _ in range(count)]
+        preds = [0] * count
+        writer, readers = dict(), dict()
+        memory = None
+
+        def edge(a, b):
+            succs[a].append(b)
+            preds[b] = preds[b] + 1
+
+        for i, item in enumerate(items):
+            if item.control or i >= count - fixed:
+                for other in range(i):
+                    edge(other, i)
+                continue
+
+            for reg in item.reads:
+                if reg in writer:
+                    edge(writer[reg], i)
+            for reg in item.writes:
+                if reg in writer:
+                    edge(writer[reg], i)
+                for reader in readers.get(reg, ()):
+                    edge(reader, i)
+
+            for reg in item.reads:
+                readers.setdefault(reg, []).append(i)
+            for reg in item.writes:
+                writer[reg] = i
+                readers[reg] = []
+
+            if item.mem:
+                if memory is not None:
+                    edge(memory, i)
+                memory = i
+
+        # list scheduling in source order, skipping the ready instructions
+        # that would stall after the last one placed
+        ready = [i for i in range(count) if not preds[i]]
+        heapq.heapify(ready)
+        order = []
+        load = None
+
+        while ready:
+            skipped = []
+            pick = heapq.heappop(ready)
+
+            while load in items[pick].first and ready and len(skipped) < WINDOW:
+                skipped.append(pick)
+                pick = heapq.heappop(ready)
+
+            if load in items[pick].first and skipped:
+                # nothing better, the first one in source order
+                skipped.append(pick)
+                pick = min(skipped)
+                skipped.remove(pick)
+
+            for i in skipped:
+                heapq.heappush(ready, i)
+
+            order.append(pick)
+            load = items[pick].load
+
+            for succ in succs[pick]:
+                preds[succ] = preds[succ] - 1
+                if not preds[succ]:
+                    heapq.heappush(ready, succ)
+
+        after = _stalls(items, order)
+        if after >= stalls:
+            return None
+
+        self.removed = self.removed + stalls - after
+        self.moved = self.moved + sum(i != k for k, i in enumerate(order))
+
+        return order
+
+def _words(data):
+    return struct.unpack(f">{len(data) // 4}I", data)
+
+def _fill(schedule, entries):
+    # the new order of the items of a program, with NOP for the added
+    # delay slots. entries has the words of every item and whether they use
+    # a label, None for the items that aren't instructions
+    order, block = [], []
+    schedule.slots = schedule.slots or 0
+
+    for index, entry in enumerate(entries):
+        order.append(index)
+
+        if entry is None:
+            block = []
+            continue
+
+        block.append(index)
+        if not _ends_block(entry[0]):
+            continue
+
+        if _has_slot(entry[0]):
+            slot = schedule.fill([entries[i] for i in block])
+
+            if slot is None:
+                order.append(NOP)
+            else:
+                # the block is at the end of the order
+                del order[len(order) - 1 - (index - block[slot])]
+                order.append(block[slot])
+
+        block = []
+
+    return order
+
+def fill_program(program: Program, schedule=None):
+    # gives every branch and jump of the program table a delay slot,
+    # before the first pass. Returns the Schedule
+    schedule = schedule or Schedule()
+
+    if program.objects:
+        # some instruction failed to encode, the second pass raises anyway
+        return schedule
+
+    words = _words(program.words)
+    entries = [(words[a:a + b], c) if kind == INSTR else None
+        for kind, a, b, c in zip(program.kind, program.a, program.b, program.c)]
+    order = _fill(schedule, entries)
+
+    if len(order) == len(entries) and not schedule.filled:
+        return schedule
+
+    # the columns in the new order, the words of the items follow them
+    kind, line, a, b, c = array('B'), array('I'), array('q'), array('I'), array('I')
+    out = Program()
+    nop = Program()
+    nop.add_rows(Nop().rows())
+    comments = [] if program.comments is not None else None
+
+    for item in order:
+        if item == NOP:
+            kind.append(INSTR)
+            line.append(line[-1])
+            a.append(len(out.word_kind))
+            b.append(1)
+            c.append(0)
+            out.words += nop.words
+            out.word_kind += nop.word_kind
+            out.word_sym += nop.word_sym
+
+            if comments is not None:
+                comments.append(str(Nop()))
+            continue
+
+        kind.append(program.kind[item])
+        line.append(program.line[item])
+        b.append(program.b[item])
+        c.append(program.c[item])
+
+        if program.kind[item] == INSTR:
+            first, count = program.a[item], program.b[item]
+            a.append(len(out.word_kind))
+            out.words += program.words[4 * first:4 * (first + count)]
+            out.word_kind += program.word_kind[first:first + count]
+            out.word_sym += program.word_sym[first:first + count]
+        else:
+            a.append(program.a[item])
+
+        if comments is not None:
+            comments.append(program.comments[item])
+
+    # .incbin blobs are kept by item
+    moved = {item: index for index, item in enumerate(order) if item != NOP and item in program.blobs}
+    program.blobs = {moved[item]: blob for item, blob in program.blobs.items()}
+
+    program.kind, program.line, program.a, program.b, program.c = kind, line, a, b, c
+    program.words, program.word_kind, program.word_sym = out.words, out.word_kind, out.word_sym
+    program.comments = comments
+
+    return schedule
+
+def fill_segments(segments, schedule=None):
+    # gives every branch and jump of parsed segments a delay slot, returns
+    # the Schedule
+    schedule = schedule or Schedule()
+    schedule.slots = schedule.slots or 0
+
+    for segm in segments:
+        if not isinstance(segm, TextSegment):
+            continue
+
+        lines = list(segm.lines)
+        entries = []
+
+        for line in lines:
+            if isinstance(line, Instruction):
+                encoded = Program()
+                labels = encoded.add_rows(line.rows())
+                entries.append((_words(encoded.words), labels))
+            else:
+                entries.append(None)
+
+        segm.lines = [lines[index] if index != NOP else Nop() for index in _fill(schedule, entries)]
+
+    return schedule
+
+def schedule_program(program: Program, schedule=None, delay_slots=False):
+    # reorders the instructions of the program table, returns the Schedule.
+    # With delay_slots the instruction after a branch or jump is its slot
+    schedule = schedule or Schedule()
+
+    if program.objects:
+        # some instruction failed to encode, the second pass raises anyway
+        return schedule
+
+    words = _words(program.words)
+    first, block, slot = 0, [], False
+
+    for item, kind in enumerate(program.kind):
+        if kind != INSTR:
+            if block:
+                _reorder(program, first, block, schedule)
+                block, slot = [], False
+            continue
+
+        if not block:
+            first = item
+
+        a, b = program.a[item], program.b[item]
+        block.append(words[a:a + b])
+
+        if slot:
+            # the branch and its slot stay last
+            _reorder(program, first, block, schedule, 2)
+            block, slot = [], False
+        elif _ends_block(block[-1]):
+            if delay_slots and _has_slot(block[-1]):
+                slot = True
+                continue
+
+            _reorder(program, first, block, schedule)
+            block = []
+
+    if block:
+        _reorder(program, first, block, schedule)
+
+    return schedule
+
+def _reorder(program: Program, first, words, schedule, fixed=0):
+    # the block of instructions from item first on, with their words
+    order = schedule.order(words, fixed)
+
+    if order is None:
+        return
+
+    # the block is contiguous, in items and in words
+    start = program.a[first]
+    items = [first + i for i in order]
+    end = program.a[first + len(order) - 1] + program.b[first + len(order) - 1]
+
+    program.words[4 * start:4 * end] = b"".join(program.words[4 * program.a[i]:4 * (program.a[i] + program.b[i])] for i in items)
+    program.word_kind[start:end] = array('B', (k for i in items for k in program.word_kind[program.a[i]:program.a[i] + program.b[i]]))
+    program.word_sym[start:end] = array('i', (s for i in items for s in program.word_sym[program.a[i]:program.a[i] + program.b[i]]))
+
+    line, b, c = [program.line[i] for i in items], [program.b[i] for i in items], [program.c[i] for i in items]
+    comments = [program.comments[i] for i in items] if program.comments is not None else None
+    offset = start
+
+    for k in range(len(items)):
+        item = first + k
+        program.line[item], program.b[item], program.c[item] = line[k], b[k], c[k]
+        program.a[item] = offset
+        offset = offset + b[k]
+
+        if comments is not None:
+            program.comments[item] = comments[k]
+
+def schedule_segments(segments, schedule=None, delay_slots=False):
+    # reorders the instructions of parsed segments, returns the Schedule.
+    # delay_slots as for schedule_program
+    schedule = schedule or Schedule()
+
+    for segm in segments:
+        if not isinstance(segm, TextSegment):
+            continue
+
+        lines = list(segm.lines)
+        block, words, slot = [], [], False
+
+        for index, line in enumerate(lines + [None]):
+            if isinstance(line, Instruction):
+                encoded = Program()
+                encoded.add_rows(line.rows())
+                block.append(index)
+                words.append(_words(encoded.words))
+
+                if not slot and not _ends_block(words[-1]):
+                    continue
+
+                if not slot and delay_slots and _has_slot(words[-1]):
+                    slot = True
+                    continue
+
+            if block:
+                order = schedule.order(words, 2 if slot and isinstance(line, Instruction) else 0)
+
+                if order is not None:
+                    lines[block[0]:block[-1] + 1] = [lines[block[i]] for i in order]
+
+            block, words, slot = [], [], False
+
+        segm.lines = lines
+
+    return schedule
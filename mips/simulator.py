@@ -0,0 +1,480 @@
+from .image import Image
+from . import isa
+
+# Instruction-set simulator for the assembled images. The ISA is the one
+# of mips/isa.py, with the conventions the assembler encodes:
+#   - the pc and the text labels are word addresses, the data addresses
+#     are byte addresses, big endian
+#   - branches are relative to the branch itself, there are no delay slots
+#     unless delay_slots is set (see mips/schedule.py): the word after a
+#     branch or jump then runs before its target, and links and branches
+#     not taken go past it
+#   - jal jumps to its target as is, j keeps the upper bits of the pc
+#   - lui sets the upper half of the register and clears the lower one
+# Code is decoded once into basic blocks, each compiled to a Python
+# function that runs its instructions and returns the next pc. The blocks
+# are kept until the words they were decoded from are written.
+
+M = 0xFFFFFFFF
+SIGN = 0x80000000
+
+# Instructions in a block at most, and ROM words per page of the index of
+# blocks by address
+MAX_BLOCK = 64
+PAGE_WORDS = 1 << 10
+
+class Memory:
+    # Data memory in pages created on first write, unwritten memory reads
+    # as zeros
+    PAGE_BITS = 12
+    PAGE_SIZE = 1 << PAGE_BITS
+
+    def __init__(self):
+        self.pages = dict()
+
+    def _page(self, addr):
+        page = self.pages.get(addr >> self.PAGE_BITS)
+
+        if page is None:
+            page = self.pages[addr >> self.PAGE_BITS] = bytearray(self.PAGE_SIZE)
+
+        return page
+
+    def load(self, addr, size):
+        page = self.pages.get(addr >> self.PAGE_BITS)
+        if page is None:
+            return 0
+
+        offset = addr & (self.PAGE_SIZE - 1)
+        return int.from_bytes(page[offset:offset + size], 'big')
+
+    def store(self, addr, size, val):
+        offset = addr & (self.PAGE_SIZE - 1)
+        self._page(addr)[offset:offset + size] = (val & ((1 << (8 * size)) - 1)).to_bytes(size, 'big')
+
+    def write(self, addr, data):
+        data = memoryview(data).cast('B')
+        pos = 0
+
+        while pos < len(data):
+            offset = (addr + pos) & (self.PAGE_SIZE - 1)
+            size = min(self.PAGE_SIZE - offset, len(data) - pos)
+            self._page(addr + pos)[offset:offset + size] = data[pos:pos + size]
+            pos = pos + size
+
+    def read(self, addr, size):
+        out = bytearray(size)
+        pos = 0
+
+        while pos < size:
+            offset = (addr + pos) & (self.PAGE_SIZE - 1)
+            count = min(self.PAGE_SIZE - offset, size - pos)
+            page = self.pages.get((addr + pos) >> self.PAGE_BITS)
+
+            if page is not None:
+                out[pos:pos + count] = page[offset:offset + count]
+
+            pos = pos + count
+
+        return bytes(out)
+
+class _Resume(Exception):
+    # raised by a store into the code of the running block, which stops
+    # there and goes on from the next instruction, decoded again
+    def __init__(self, pc):
+        self.pc = pc
+
+class Block:
+    __slots__ = ("start", "end", "run", "halt")
+
+    def __init__(self, start, end, run, halt):
+        # words [start, end) of ROM
+        self.start = start
+        self.end = end
+        self.run = run
+        # the block is a jump to itself: the program is done
+        self.halt = halt
+
+def _simm(word):
+    imm = word & 0xFFFF
+    return imm - 0x10000 if imm & 0x8000 else imm
+
+def _set(rd, expr):
+    # writes to $zero are dropped
+    return [f"r[{rd}] = {expr}"] if rd else []
+
+def _overflow_check(a, b, v, pc, sub=False):
+    # signed overflow of a + b (a - b), with v the 32 bit result
+    test = f"({a} ^ {b}) & ({a} ^ {v})" if sub else f"({a} ^ {v}) & ({b} ^ {v})"
+    return f"if {test} & {SIGN}: overflow({pc})"
+
+def _signed(expr, bits=32):
+    return f"((({expr}) ^ {1 << (bits - 1)}) - {1 << (bits - 1)})"
+
+def _divide(a, b):
+    # (remainder, quotient) of the signed division, truncated like C
+    q = abs(a) // abs(b)
+    q = -q if (a < 0) != (b < 0) else q
+    return (a - q * b) & M, q & M
+
+def _divideu(a, b):
+    return (a % b), (a // b)
+
+# The registers after the 32 general purpose ones
+HI = 32
+LO = 33
+
+class _Fields:
+    # the fields of an instruction word, the ones named in mips/isa.py
+    __slots__ = ("rs", "rt", "rd", "shamt", "imm", "simm", "addr", "next")
+
+    def __init__(self, word, next):
+        self.rs, self.rt, self.rd = (word >> 21) & 0x1F, (word >> 16) & 0x1F, (word >> 11) & 0x1F
+        self.shamt = (word >> 6) & 0x1F
+        self.imm, self.simm = word & 0xFFFF, _simm(word)
+        self.addr = word & ((1 << 26) - 1)
+        # where the code goes on after the instruction, past its delay slot
+        self.next = next
+
+def _alu(expr):
+    # rd = expr of a = r[rs], b = r[rt] and the fields
+    return lambda f, pc: (_set(f.rd, expr.format(a=f"r[{f.rs}]", b=f"r[{f.rt}]", f=f)), None)
+
+def _alu_imm(expr):
+    # rt = expr of a = r[rs] and the fields
+    return lambda f, pc: (_set(f.rt, expr.format(a=f"r[{f.rs}]", f=f)), None)
+
+def _add(sub=False):
+    def add(f, pc):
+        a, b = f"r[{f.rs}]", f"r[{f.rt}]"
+        return [f"v = ({a} {'-' if sub else '+'} {b}) & {M}", _overflow_check(a, b, "v", pc, sub)] + _set(f.rd, "v"), None
+
+    return add
+
+def _addi(f, pc):
+    a = f"r[{f.rs}]"
+    return [f"v = ({a} + {f.simm & M}) & {M}", _overflow_check(a, f.simm & M, "v", pc)] + _set(f.rt, "v"), None
+
+def _load(size, signed=False):
+    def load(f, pc):
+        expr = f"load((r[{f.rs}] + {f.simm & M}) & {M}, {size}, {pc})"
+        if signed:
+            expr = f"{_signed(expr, 8 * size)} & {M}"
+
+        return (_set(f.rt, expr) if f.rt else [expr]), None
+
+    return load
+
+def _store(size, conditional=False):
+    def store(f, pc):
+        addr = f"(r[{f.rs}] + {f.simm & M}) & {M}"
+
+        if conditional:
+            # sc always succeeds, there is a single processor. rt is set
+            # before the store, which can end the block when it writes code
+            return [f"v = r[{f.rt}]", f"a = {addr}"] + _set(f.rt, "1") + [f"store(a, {size}, v, {pc})"], None
+
+        return [f"store({addr}, {size}, r[{f.rt}], {pc})"], None
+
+    return store
+
+def _branch(test):
+    # test of a = r[rs] and b = r[rt], None if the branch is always taken
+    def branch(f, pc):
+        target = (pc + f.simm) & M
+        cond = test(f"r[{f.rs}]", f"r[{f.rt}]", f)
+
+        if cond is True or cond is False:
+            return [], str(target if cond else f.next)
+
+        return [], f"{target} if {cond} else {f.next}"
+
+    return branch
+
+def _jalr(f, pc):
+    # the target is read before the link, rd can be rs
+    return [f"v = r[{f.rs}]"] + _set(f.rd, str(f.next)), "v"
+
+# {mnemonic: semantics}, semantics(fields, pc) gives (lines of Python, next
+# pc expression or None) like decode
+_semantics = {
+    "add": _add(),
+    "addi": _addi,
+    "addiu": _alu_imm(f"({{a}} + {{f.simm}}) & {M}"),
+    "addu": _alu(f"({{a}} + {{b}}) & {M}"),
+    "and": _alu("{a} & {b}"),
+    "andi": _alu_imm("{a} & {f.imm}"),
+    "beq": _branch(lambda a, b, f: True if f.rs == f.rt else f"{a} == {b}"),
+    "bgez": _branch(lambda a, b, f: f"not {a} & {SIGN}"),
+    "bltz": _branch(lambda a, b, f: f"{a} & {SIGN}"),
+    "bne": _branch(lambda a, b, f: False if f.rs == f.rt else f"{a} != {b}"),
+    "div": lambda f, pc: ([f"if r[{f.rt}]: r[{HI}], r[{LO}] = divide({_signed(f'r[{f.rs}]')}, {_signed(f'r[{f.rt}]')})"], None),
+    "divu": lambda f, pc: ([f"if r[{f.rt}]: r[{HI}], r[{LO}] = divideu(r[{f.rs}], r[{f.rt}])"], None),
+    "j": lambda f, pc: ([], str((pc & ~((1 << 26) - 1)) | f.addr)),
+    "jal": lambda f, pc: ([f"r[31] = {f.next}"], str(f.addr)),
+    "jalr": _jalr,
+    "jr": lambda f, pc: ([], f"r[{f.rs}]"),
+    "lb": _load(1, signed=True),
+    "lbu": _load(1),
+    "lh": _load(2, signed=True),
+    "lhu": _load(2),
+    "ll": _load(4),
+    "lui": lambda f, pc: (_set(f.rt, str(f.imm << 16)), None),
+    "lw": _load(4),
+    "mfhi": _alu(f"r[{HI}]"),
+    "mflo": _alu(f"r[{LO}]"),
+    "mult": lambda f, pc: ([f"v = {_signed(f'r[{f.rs}]')} * {_signed(f'r[{f.rt}]')}", f"r[{HI}], r[{LO}] = (v >> 32) & {M}, v & {M}"], None),
+    "multu": lambda f, pc: ([f"v = r[{f.rs}] * r[{f.rt}]", f"r[{HI}], r[{LO}] = v >> 32, v & {M}"], None),
+    "nor": _alu(f"~({{a}} | {{b}}) & {M}"),
+    "or": _alu("{a} | {b}"),
+    "ori": _alu_imm("{a} | {f.imm}"),
+    "slt": _alu(f"int(({{a}} ^ {SIGN}) < ({{b}} ^ {SIGN}))"),
+    "slti": _alu_imm(f"int(({{a}} ^ {SIGN}) < {{f.simm}} + {SIGN})"),
+    "sltiu": _alu_imm(f"int({{a}} < ({{f.simm}} & {M}))"),
+    "sltu": _alu("int({a} < {b})"),
+    "sll": _alu(f"({{b}} << {{f.shamt}}) & {M}"),
+    "sra": _alu(f"({_signed('{b}')} >> {{f.shamt}}) & {M}"),
+    "srl": _alu("{b} >> {f.shamt}"),
+    "sb": _store(1),
+    "sc": _store(4, conditional=True),
+    "sh": _store(2),
+    "sw": _store(4),
+    "sub": _add(sub=True),
+    "subu": _alu(f"({{a}} - {{b}}) & {M}"),
+    "nop": lambda f, pc: ([], None),
+}
+
+def decode(word, pc, delay_slots=False):
+    # (lines of Python, next pc expression or None): the lines run the
+    # instruction at pc, the expression ends the block with the next pc.
+    # None for a word that isn't an instruction
+    spec = isa.decode(word)
+    if spec is None:
+        return None
+
+    return _semantics[spec.mnemonic](_Fields(word, pc + 2 if delay_slots else pc + 1), pc)
+
+class Simulator:
+    def __init__(self, ram: Image, rom: Image, entry=0, rom_base=None, delay_slots=False):
+        # rom_base is the byte address the ROM is also mapped at in the data
+        # space, so loads can read the code and stores change it. With
+        # delay_slots the code is the one of -delay-slots
+        # the registers, HI and LO after the general purpose ones
+        self.regs = [0] * 34
+        self.pc = entry
+        self.steps = 0
+        self.halted = False
+
+        self.ram = Memory()
+        for addr, data in ram.views():
+            self.ram.write(addr, data)
+
+        self.rom = Image(rom.cell_size)
+        for addr, data in rom.views():
+            self.rom.write(addr, data)
+
+        self.rom_base = rom_base
+        if rom_base is None:
+            self._rom_lo = self._rom_hi = 0
+        else:
+            self._rom_lo, self._rom_hi = rom_base, rom_base + (1 << 28)
+
+        self.delay_slots = delay_slots
+        # the delay slots decoded, a store there doesn't end its block
+        self._slots = set()
+
+        self._blocks = dict()
+        # start of the blocks with words in every page of ROM
+        self._pages = dict()
+        self._helpers = {
+            "load": self._load,
+            "store": self._store,
+            "overflow": self._overflow,
+            "divide": _divide,
+            "divideu": _divideu,
+        }
+
+    def _overflow(self, pc):
+        raise Exception(f"Integer overflow at @{pc:X}")
+
+    def _load(self, addr, size, pc):
+        if addr & (size - 1):
+            raise Exception(f"Unaligned load of {size} bytes from 0x{addr:X} at @{pc:X}")
+
+        if self._rom_lo <= addr < self._rom_hi:
+            return int.from_bytes(self.rom.read(addr - self._rom_lo, size), 'big')
+
+        return self.ram.load(addr, size)
+
+    def _store(self, addr, size, val, pc):
+        if addr & (size - 1):
+            raise Exception(f"Unaligned store of {size} bytes to 0x{addr:X} at @{pc:X}")
+
+        if self._rom_lo <= addr < self._rom_hi:
+            if self.write_rom(addr - self._rom_lo, (val & ((1 << (8 * size)) - 1)).to_bytes(size, 'big'), pc) and pc not in self._slots:
+                # after a delay slot the block only returns the target
+                raise _Resume(pc + 1)
+        else:
+            self.ram.store(addr, size, val)
+
+    def write_rom(self, addr, data, pc=None):
+        # writes data at the byte address addr of ROM and drops the blocks
+        # decoded from it, True if the block of pc (the current one by
+        # default) was one of them
+        for start in range(addr & ~3, addr + len(data), 4):
+            first, last = max(start, addr), min(start + 4, addr + len(data))
+            found = self.rom.find(start)
+
+            if found is not None:
+                found[1][first - found[0]:last - found[0]] = data[first - addr:last - addr]
+            else:
+                # the extents of ROM are whole words, this one is in a gap
+                word = bytearray(4)
+                word[first - start:last - start] = data[first - addr:last - addr]
+                self.rom.write(start, word)
+
+        return self.invalidate(addr // 4, (addr + len(data) + 3) // 4, pc)
+
+    def invalidate(self, first, last, pc=None):
+        # drops the blocks with words in [first, last), True if the block
+        # of pc was one of them. Inside a run self.pc is where the run
+        # started, stores pass their own pc
+        pc = self.pc if pc is None else pc
+        running = False
+
+        for page in range(first // PAGE_WORDS, (last - 1) // PAGE_WORDS + 1):
+            starts = self._pages.get(page)
+            if not starts:
+                continue
+
+            for start in list(starts):
+                block = self._blocks.get(start)
+
+                if block is None:
+                    starts.discard(start)
+                elif block.start < last and block.end > first:
+                    running = running or block.start <= pc < block.end
+                    del self._blocks[start]
+                    starts.discard(start)
+
+        return running
+
+    def _fetch(self, pc):
+        found = self.rom.find(4 * pc)
+        if found is None:
+            return None
+
+        offset = 4 * pc - found[0]
+        return int.from_bytes(found[1][offset:offset + 4], 'big')
+
+    def _decode_block(self, pc, size=MAX_BLOCK):
+        # a block of at most size instructions, only blocks of the full size
+        # are cached, the shorter ones end a run at its step limit
+        lines = []
+        next_pc = None
+        halt = False
+        end = pc
+
+        while end - pc < size:
+            word = self._fetch(end)
+
+            if word is None:
+                if end == pc:
+                    raise Exception(f"No code at @{pc:X}")
+                break
+
+            decoded = decode(word, end, self.delay_slots)
+            if decoded is None:
+                if end == pc:
+                    raise Exception(f"Unknown instruction {word:08x} at @{pc:X}")
+                break
+
+            body, next_pc = decoded
+            lines += body
+            end = end + 1
+
+            if next_pc is not None:
+                halt = end == pc + 1 and not lines and next_pc == str(pc)
+
+                if self.delay_slots:
+                    # the target is taken before the slot can change the
+                    # registers it comes from
+                    slot = self._delay_slot(end)
+                    halt = halt and not slot
+                    lines += [f"t = {next_pc}"] + slot
+                    next_pc = "t"
+                    end = end + 1
+                break
+        source = "def block(r):\n" + "".join(f"    {line}\n" for line in lines)
+        source = source + f"    return {next_pc if next_pc is not None else end}\n"
+
+        namespace = dict(self._helpers)
+        exec(source, namespace)
+
+        block = Block(pc, end, namespace["block"], halt)
+        if size < MAX_BLOCK:
+            return block
+
+        self._blocks[pc] = block
+        for page in range(pc // PAGE_WORDS, (end - 1) // PAGE_WORDS + 1):
+            self._pages.setdefault(page, set()).add(pc)
+
+        return block
+
+    def _delay_slot(self, pc):
+        # the lines of the instruction in the delay slot at pc
+        word = self._fetch(pc)
+        decoded = decode(word, pc, True) if word is not None else None
+
+        if decoded is None:
+            raise Exception(f"No instruction in the delay slot at @{pc:X}")
+        if decoded[1] is not None:
+            raise Exception(f"Branch or jump in the delay slot at @{pc:X}")
+
+        self._slots.add(pc)
+        return decoded[0]
+
+    def step(self):
+        # runs a single instruction, False once the program is done
+        return self.run(1) > 0
+
+    def run(self, max_steps=None):
+        # runs until a jump to itself or max_steps instructions, returns the
+        # instructions run
+        regs = self.regs
+        cache = self._blocks
+        pc = self.pc
+        limit = max_steps if max_steps is not None else float("inf")
+        steps = 0
+
+        try:
+            while steps < limit:
+                block = cache.get(pc)
+                if block is None:
+                    block = self._decode_block(pc)
+
+                if block.halt:
+                    self.halted = True
+                    break
+
+                if block.end - block.start > limit - steps:
+                    block = self._decode_block(pc, limit - steps)
+
+                try:
+                    pc = block.run(regs)
+                except _Resume as resume:
+                    steps = steps + resume.pc - block.start
+                    pc = resume.pc
+                else:
+                    steps = steps + block.end - block.start
+        finally:
+            self.pc = pc
+            self.steps = self.steps + steps
+
+        return steps
+
+def simulate(ram: Image, rom: Image, max_steps=None, entry=0, delay_slots=False):
+    # runs the images until the program is done, returns the simulator
+    sim = Simulator(ram, rom, entry, delay_slots=delay_slots)
+    sim.run(max_steps)
+    return sim
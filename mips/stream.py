@@ -0,0 +1,231 @@
+import bisect
+import pickle
+import tempfile
+from .assembler import Context, FirstPass
+from .encoding import encode_row
+from .parsetypes import *
+from .instructions import Instruction
+from .relax import Relaxation
+from .scanner import scan_iter, _Fallback
+
+# Streaming assembly: the first pass reads the source one line at a time
+# and spools compact records of what the second pass has to write. Only
+# instructions that refer to labels are kept as encoding rows, everything
+# else is spooled already encoded, so no parsed object outlives its line.
+# The records that write carry their line, for the errors of the replay.
+
+_plain_rows = ("r", "i", "j")
+
+class SpoolingFirstPass(FirstPass):
+    BATCH_SIZE = 4096
+
+    def __init__(self, ctx: Context, spool, debug=False):
+        super().__init__(ctx)
+        self.spool = spool
+        self.debug = debug
+        self.batch = []
+        self.lineno = 0
+        # the units of the rows records, solved at the end of the pass
+        self.relaxation = Relaxation()
+
+    def _record(self, *record):
+        self.batch.append(record)
+
+        if len(self.batch) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            pickle.dump(self.batch, self.spool, protocol=pickle.HIGHEST_PROTOCOL)
+            self.batch = []
+
+    def _comment(self, line):
+        return str(line) if self.debug else None
+
+    def visit_DataSegment(self, segm: DataSegment):
+        super().visit_DataSegment(segm)
+        self._record("segment", "data")
+
+    def visit_TextSegment(self, segm: TextSegment):
+        self.relaxation.new_run()
+        super().visit_TextSegment(segm)
+        self._record("segment", "text")
+
+    def visit_Decl(self, line: Decl):
+        super().visit_Decl(line)
+
+        if isinstance(line, IncbinDecl):
+            # mapped again when written, only the path is spooled
+            self._record("incbin", line, self._comment(line), self.lineno)
+        else:
+            self._record("decl", line.to_bytes(), len(line), self._comment(line), self.lineno)
+
+    def visit_Label(self, lbl: Label):
+        super().visit_Label(lbl)
+
+        if self.segm == 'text':
+            self.relaxation.label(lbl.name, self.text_addr)
+
+        if self.debug:
+            self._record("label", str(lbl))
+
+    def visit_MemLabel(self, lbl: MemLabel):
+        super().visit_MemLabel(lbl)
+
+        if self.segm == 'text':
+            self.relaxation.new_run()
+
+        self._record("addr", lbl.addr, self._comment(lbl))
+
+    def visit_Instruction(self, instr: Instruction):
+        rows = instr.rows()
+
+        if all(row[0] in _plain_rows for row in rows):
+            self._record("instr", b"".join(encode_row(row) for row in rows), self._comment(instr), self.lineno)
+        else:
+            self.relaxation.add_rows(rows, self.text_addr)
+            self._record("rows", rows, self._comment(instr), self.lineno)
+
+        super().visit_Instruction(instr)
+
+class _Extents:
+    # the cells placed in a memory file, as sorted [start, end) ranges
+    # without their bytes, for the overlap errors of Image.write
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        # range of the last write, the next one usually follows it
+        self._last = -1
+
+    def add(self, start, end):
+        starts, ends = self.starts, self.ends
+
+        i = self._last
+        if not (0 <= i < len(starts) and starts[i] <= start and (i + 1 == len(starts) or starts[i + 1] > start)):
+            i = bisect.bisect_right(starts, start) - 1
+
+        if i >= 0 and ends[i] > start:
+            raise Exception(f"Overlapping placement at @{start:X}")
+
+        if i + 1 < len(starts) and starts[i + 1] < end:
+            raise Exception(f"Overlapping placement at @{starts[i + 1]:X}")
+
+        if i >= 0 and ends[i] == start:
+            ends[i] = end
+        else:
+            i = i + 1
+            starts.insert(i, start)
+            ends.insert(i, end)
+
+        if i + 1 < len(starts) and starts[i + 1] == end:
+            ends[i] = ends[i + 1]
+            del starts[i + 1], ends[i + 1]
+
+        self._last = i
+
+class SpoolReplay:
+    def __init__(self, ctx: Context, relaxation, debug=False):
+        self.ctx = ctx
+        self.relaxation = relaxation
+        self.debug = debug
+        self._extents = {id(ctx.ram): _Extents(), id(ctx.rom): _Extents()}
+
+    def _write(self, file, b, comment, lineno, size=0):
+        # code or data placed over what was written before is an error, as
+        # on the other paths
+        cells = max(size, len(b)) // file.cell_size
+        if cells:
+            try:
+                self._extents[id(file)].add(file.addr, file.addr + cells)
+            except Exception as ex:
+                raise Exception(f"line {lineno}: {ex}") if lineno else ex
+
+        if self.debug:
+            print(b.hex(), comment)
+            file.write_bytes(b, comment=comment)
+        elif len(b):
+            file.write_bytes(b)
+
+        if size > len(b):
+            file.fill(size - len(b))
+
+    def replay(self, spool):
+        ctx = self.ctx
+        segm = None
+        # the first unit of the next rows record
+        unit = 0
+
+        while True:
+            try:
+                batch = pickle.load(spool)
+            except EOFError:
+                break
+
+            for record in batch:
+                kind = record[0]
+
+                if kind == "instr":
+                    self._write(ctx.rom, record[1], record[2], record[3])
+                elif kind == "rows":
+                    rows, unit = self.relaxation.expand(record[1], unit)
+                    b = b"".join(encode_row(ctx.resolve_row(row, i)) for i, row in enumerate(rows))
+                    self._write(ctx.rom, b, record[2], record[3])
+                elif kind == "decl":
+                    self._write(ctx.ram, record[1], record[3], record[4], record[2])
+                elif kind == "incbin":
+                    self._write(ctx.ram, record[1].to_bytes(), record[2], record[3], len(record[1]))
+                elif kind == "addr":
+                    if self.debug:
+                        print(record[2])
+
+                    (ctx.ram if segm == 'data' else ctx.rom).set_addr(record[1])
+                elif kind == "label":
+                    print(record[1])
+                    (ctx.ram if segm == 'data' else ctx.rom).write_comment(record[1])
+                elif kind == "segment":
+                    segm = record[1]
+
+                    if self.debug:
+                        print(f".{segm}")
+
+def first_pass(ctx: Context, lines, spool, debug=False):
+    first_pass = SpoolingFirstPass(ctx, spool, debug)
+
+    try:
+        for lineno, item in scan_iter(lines):
+            first_pass.lineno = lineno
+
+            try:
+                item.accept(first_pass)
+            except Exception as ex:
+                raise Exception(f"line {lineno}: {ex}")
+    except _Fallback as ex:
+        raise Exception(str(ex))
+
+    first_pass.flush()
+
+    # la, branches and jumps grow to the size their labels need
+    first_pass.relaxation.solve(ctx._labels)
+
+    return first_pass.relaxation
+
+def assemble_stream(ctx: Context, lines, debug=False):
+    with tempfile.TemporaryFile() as spool:
+        relaxation = first_pass(ctx, lines, spool, debug)
+
+        if debug:
+            print("First pass complete!")
+            print("=" * 20)
+            print("Labels:")
+            print("-" * 20)
+            for lbl, val in ctx._labels.items():
+                print(f"{val.to_bytes(4, 'big').hex()}: {lbl}")
+
+            print("=" * 20)
+
+        spool.seek(0)
+        SpoolReplay(ctx, relaxation, debug).replay(spool)
+
+        if debug:
+            print("=" * 20)
+            print("Second pass complete!")
@@ -1,28 +1,257 @@
 import argparse
-from mips import Assembler
+import contextlib
 import traceback
+import sys
 import io
+import os
 
 parser = argparse.ArgumentParser(description="Compile mips code")
 
-parser.add_argument('-ram', default='ram.mem', help="output ram file (default: ram.mem)")
-parser.add_argument('-rom', default='rom.mem', help="output rom file (default: rom.mem)")
+parser.add_argument('-ram', default=None, help="output ram file, - for stdout, {name} is the input path without extension (default: ram.mem, {name}.ram.mem for several inputs)")
+parser.add_argument('-rom', default=None, help="output rom file, - for stdout, {name} is the input path without extension (default: rom.mem, {name}.rom.mem for several inputs)")
+parser.add_argument('-rom-out', action='append', default=[], metavar='FILE', help="also write the rom to FILE, in the format of its extension: .mem, .bin, .hex (Intel HEX), .srec/.s19/.s28/.s37, .memb ($readmemb), .coe, .mif. The word formats take options after the name: FILE,width=BITS,lanes=N,depth=WORDS,pad")
+parser.add_argument('-ram-out', action='append', default=[], metavar='FILE', help="also write the ram to FILE, like -rom-out")
+parser.add_argument('-elf', default=None, metavar='FILE', help="also write a MIPS ELF file with the rom, the ram and the labels")
+parser.add_argument('-run', type=int, nargs='?', const=100000000, default=None, metavar='STEPS', help="run the program in the simulator after assembling it, until it jumps to itself or for at most STEPS instructions, and print the registers")
+parser.add_argument('-depfile', default=None, metavar='FILE', help="write a make rule of the outputs on the input to FILE, for make and ninja")
+parser.add_argument('-stamp', default=None, metavar='FILE', help="touch FILE after every successful run, outputs are only rewritten when they change")
 parser.add_argument('-debug', action='store_const', dest='debug', const=True, default=False, help="enable debug prints and comments in compiled files")
-parser.add_argument('input', help="input assembly file")
+parser.add_argument('-batch', action='store_const', dest='batch', const=True, default=False, help="encode the text segment in bulk with numpy (ignored with -debug)")
+parser.add_argument('-schedule', action='store_const', dest='schedule', const=True, default=False, help="reorder instructions within basic blocks to avoid load-use stalls, and print how many were removed")
+parser.add_argument('-delay-slots', action='store_const', dest='delay_slots', const=True, default=False, help="assemble for a cpu with branch delay slots: move an instruction or a nop into the slot after every branch and jump, and print how many were filled")
+parser.add_argument('-stream', action='store_const', dest='stream', const=True, default=False, help="read the input line by line, memory use does not grow with the program size")
+parser.add_argument('-jobs', type=int, default=None, help="worker processes for several inputs or a large program (default: one per cpu)")
+parser.add_argument('-cache', default=None, metavar='DIR', help="reuse the outputs of sources assembled before, kept in DIR")
+parser.add_argument('-cache-stats', action='store_const', dest='cache_stats', const=True, default=False, help="print the hits and misses of -cache")
+parser.add_argument('-serve', action='store_const', dest='serve', const=True, default=False, help="run the assembler daemon on a unix socket, with -jobs worker processes")
+parser.add_argument('-daemon', action='store_const', dest='daemon', const=True, default=False, help="assemble in the daemon if one is running, in this process otherwise")
+parser.add_argument('-socket', default=None, help="socket of the daemon (default: $MIPSASM_SOCKET or one in $XDG_RUNTIME_DIR)")
+parser.add_argument('-disasm', action='store_const', dest='disasm', const=True, default=False, help="disassemble the input rom dump (.mem, or .bin placed at -base) to stdout instead of assembling it")
+parser.add_argument('-symbols', default=None, metavar='FILE', help="label names for -disasm, from a file written by -elf or an nm style map of byte addresses")
+parser.add_argument('-range', action='append', default=[], metavar='FIRST:LAST', help="only disassemble the words at [FIRST, LAST), in word addresses like @ (default: all)")
+parser.add_argument('-base', type=lambda val: int(val, 0), default=0, help="byte address of a .bin input for -disasm (default: 0)")
+parser.add_argument('input', nargs='*', help="input assembly files, - for stdin")
 
 args = parser.parse_args()
 
-print(f"Assembling file {args.input} to '{args.ram}' and '{args.rom}'")
+if args.serve:
+    from mips.daemon import serve, socket_path
+
+    print(f"Serving on {args.socket or socket_path()}")
+    try:
+        serve(args.socket, workers=args.jobs)
+    except KeyboardInterrupt:
+        pass
+    except Exception as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(1)
+
+    sys.exit(0)
+
+if not args.input:
+    parser.error("the following arguments are required: input")
+
+if args.disasm:
+    if len(args.input) != 1 or args.input[0] == '-':
+        parser.error("-disasm takes a single input file")
+
+    try:
+        ranges = [tuple(int(val, 0) for val in r.split(":")) for r in args.range]
+    except ValueError:
+        parser.error("-range takes FIRST:LAST")
+
+    from mips.disasm import read_mem, read_bin, read_symbols, disassemble
+
+    try:
+        if args.input[0].lower().endswith(".bin"):
+            image = read_bin(args.input[0], args.base)
+        else:
+            image = read_mem(args.input[0])
+
+        labels = None
+        if args.symbols:
+            labels = {name: addr // 4 for name, addr in read_symbols(args.symbols).items()}
+
+        sys.stdout.write(disassemble(image, labels, ranges))
+    except Exception as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(1)
+
+    sys.exit(0)
+
+def print_cache_stats(file):
+    from mips.buildcache import BuildCache
+
+    stats = BuildCache(args.cache).stats()
+    print(f"cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries, {stats['size']} bytes", file=file)
+
+outputs = args.rom_out or args.ram_out or args.elf or args.run is not None
+
+if args.rom_out or args.ram_out:
+    from mips.formats import FORMATS, format_of, parse_output
+
+    for spec in args.rom_out + args.ram_out:
+        if format_of(spec) is None:
+            parser.error(f"unknown output format: {spec} (one of {', '.join(FORMATS)})")
+
+        try:
+            parse_output(spec)
+        except Exception as ex:
+            parser.error(str(ex))
+
+if outputs and (len(args.input) > 1 or args.stream):
+    parser.error("-rom-out, -ram-out, -elf and -run take a single input, without -stream")
+
+if (args.schedule or args.delay_slots) and (len(args.input) > 1 or args.stream):
+    parser.error("-schedule and -delay-slots take a single input, without -stream")
+
+if (args.depfile or args.stamp) and len(args.input) > 1:
+    parser.error("-depfile and -stamp take a single input")
+
+if len(args.input) > 1:
+    ram = args.ram or '{name}.ram.mem'
+    rom = args.rom or '{name}.rom.mem'
+
+    if '{name}' not in ram or '{name}' not in rom:
+        parser.error("-ram and -rom must contain {name} with several inputs")
+    if '-' in args.input:
+        parser.error("stdin can't be one of several inputs")
+    if args.stream:
+        parser.error("-stream takes a single input")
+
+    files = []
+    for input in args.input:
+        name = os.path.splitext(input)[0]
+        files.append((input, ram.replace('{name}', name), rom.replace('{name}', name)))
+
+    from mips import assemble_files
+
+    results = assemble_files(files, workers=args.jobs, debug=args.debug, batch=args.batch, cache=args.cache)
+
+    for result in results:
+        if args.debug:
+            print(result.output, end="")
+
+        print(result)
+
+    failed = sum(not result.ok for result in results)
+    print(f"{len(results) - failed} assembled, {failed} failed, {sum(r.seconds for r in results):.3f}s total")
+
+    if args.cache and args.cache_stats:
+        print_cache_stats(sys.stdout)
+
+    sys.exit(1 if failed else 0)
+
+args.input = args.input[0]
+args.ram = args.ram or 'ram.mem'
+args.rom = args.rom or 'rom.mem'
+
+if args.ram == '-' and args.rom == '-':
+    parser.error("only one of -ram and -rom can be written to stdout")
+
+# keep stdout for the image when it is written there
+stdout = sys.stdout
+log = sys.stderr if '-' in (args.ram, args.rom) else sys.stdout
+
+def assemble_in_daemon(source, written):
+    # False when no daemon is running. The daemon writes the other formats
+    from mips.daemon import assemble_remote
+
+    try:
+        response = assemble_remote(source, debug=args.debug, batch=args.batch, address=args.socket, outputs=formats)
+    except OSError:
+        return False
+
+    from mips.output import OutputFile
+
+    print(response["output"], end="", file=log)
+
+    for file, name in ((args.ram, "ram"), (args.rom, "rom")):
+        if name in response:
+            with (contextlib.nullcontext(stdout) if file == '-' else OutputFile(file)) as f:
+                f.write(response[name])
+
+    written += response.get("files", [])
+
+    if not response["ok"]:
+        raise Exception(response["error"])
+
+    return True
+
+print(f"Assembling file {args.input} to '{args.ram}' and '{args.rom}'", file=log)
 try:
-    asm = Assembler(args.ram, args.rom, debug=args.debug)
+    # outputs on stdout can't be read back for the cache, the other formats
+    # are cached and written by the daemon too
+    formats = [("rom", spec) for spec in args.rom_out] + [("ram", spec) for spec in args.ram_out] + ([("elf", args.elf)] if args.elf else [])
+    reuse = not args.stream and not args.schedule and not args.delay_slots and args.run is None
+    cache = args.cache if args.cache and reuse and log is sys.stdout else None
+    hit = False
+    written = [file for file in (args.ram, args.rom) if file != '-']
+
+    with (contextlib.nullcontext(sys.stdin) if args.input == '-' else io.open(args.input, "r")) as f:
+        source = None if args.stream else f.read()
 
-    with io.open(args.input, "r") as f:
-        asm.assemble(f.read())
+        if args.daemon and reuse and assemble_in_daemon(source, written):
+            pass
+        elif cache is not None:
+            from mips.buildcache import BuildCache, assemble_files_cached
 
-    asm.finalize()
-    print("Done!")
+            with contextlib.redirect_stdout(log):
+                hit = assemble_files_cached(BuildCache(cache), source, args.ram, args.rom,
+                    debug=args.debug, batch=args.batch, workers=args.jobs, outputs=formats, files=written)
+        else:
+            from mips import Assembler
+
+            # opened before stdout is redirected, "-" is the real stdout
+            asm = Assembler(args.ram, args.rom, debug=args.debug, batch=args.batch, workers=args.jobs, schedule=args.schedule, delay_slots=args.delay_slots)
+
+            try:
+                with contextlib.redirect_stdout(log):
+                    if args.stream:
+                        asm.assemble_stream(f)
+                    else:
+                        asm.assemble(source)
+            finally:
+                asm.finalize()
+
+            if asm.schedule is not None:
+                print(f"Scheduled: {asm.schedule}", file=log)
+
+            if args.run is not None:
+                from mips.simulator import simulate
+
+                sim = simulate(*asm.images, max_steps=args.run, delay_slots=args.delay_slots)
+                print(f"{'Halted' if sim.halted else 'Stopped'} at @{sim.pc:X} after {sim.steps} instructions", file=log)
+                for reg in range(0, 32, 4):
+                    print("  ".join(f"${r:<2} {sim.regs[r]:08x}" for r in range(reg, reg + 4)), file=log)
+                print(f"$hi {sim.regs[32]:08x}  $lo {sim.regs[33]:08x}", file=log)
+
+            if formats:
+                from mips.formats import write_outputs
+
+                written += write_outputs(*asm.images, formats)
+
+    if args.depfile or args.stamp:
+        from mips.output import write_depfile, touch
+
+        if args.stamp:
+            touch(args.stamp)
+            written.insert(0, args.stamp)
+        if args.depfile:
+            from mips.scanner import incbin_paths
+
+            # the files of .incbin are inputs too
+            inputs = [args.input] if args.input != '-' else []
+            write_depfile(args.depfile, written, inputs + (incbin_paths(source) if source is not None else []))
+
+    print("Done! (cached)" if hit else "Done!", file=log)
+
+    if cache is not None and args.cache_stats:
+        print_cache_stats(log)
 except Exception as ex:
-    print(ex)
+    print(ex, file=log)
 
     if args.debug:
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+
+    sys.exit(1)
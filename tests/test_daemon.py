@@ -0,0 +1,35 @@
+import os
+import socket
+import pytest
+from mips import daemon
+
+def test_socket_path(monkeypatch, tmp_path):
+    monkeypatch.delenv("MIPSASM_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert daemon.socket_path() == str(tmp_path / f"py-mipsasm-{os.getuid()}.sock")
+
+    # not straight in the shared temporary directory
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    monkeypatch.setattr(daemon.tempfile, "gettempdir", lambda: str(tmp_path))
+    assert daemon.socket_path() == str(tmp_path / f"py-mipsasm-{os.getuid()}" / "daemon.sock")
+
+def test_private_dir(tmp_path):
+    directory = tmp_path / "private"
+    daemon._private_dir(str(directory))
+    assert directory.stat().st_mode & 0o777 == 0o700
+
+    # made by someone else or opened to others
+    directory.chmod(0o755)
+    with pytest.raises(PermissionError):
+        daemon._private_dir(str(directory))
+
+    (tmp_path / "link").symlink_to(directory)
+    directory.chmod(0o700)
+    with pytest.raises(PermissionError):
+        daemon._private_dir(str(tmp_path / "link"))
+
+@pytest.mark.skipif(not hasattr(socket, "SO_PEERCRED"), reason="no SO_PEERCRED")
+def test_peer_uid():
+    a, b = socket.socketpair(socket.AF_UNIX)
+    with a, b:
+        assert daemon._peer_uid(a) == os.getuid()
@@ -0,0 +1,81 @@
+import pytest
+from mips.assembler import Assembler, assemble_to_images
+
+MODES = ["table", "batch", "stream"]
+
+def assemble(tmp_path, source, mode):
+    ram, rom = tmp_path / f"{mode}.ram", tmp_path / f"{mode}.rom"
+    asm = Assembler(str(ram), str(rom), batch=mode == "batch")
+
+    try:
+        if mode == "stream":
+            asm.assemble_stream(source.splitlines(keepends=True))
+        else:
+            asm.assemble(source)
+    finally:
+        asm.finalize()
+
+    return ram.read_text(), rom.read_text()
+
+def test_values():
+    ram, rom = assemble_to_images(".data\nw: .word 1, 0x30, 0xFFFFFFFF\nh: .half 2, 0xFFFF\nb: .byte 3, 4, 255\n.text\nnop\n")
+
+    # big endian, packed with no alignment
+    assert ram.labels == {"w": 0, "h": 12, "b": 16}
+    assert bytes(ram.extents[0][1]).hex() == "00000001" "00000030" "ffffffff" "0002ffff" "0304ff"
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("decl, error", [
+    (".byte 256", "Value 256 does not fit in .byte"),
+    (".byte 1, 2, -3", "Value -3 does not fit in .byte"),
+    (".half 0x10000", "Value 65536 does not fit in .half"),
+    (".half -1", "Value -1 does not fit in .half"),
+    (".word 0x100000000", "Value 4294967296 does not fit in .word"),
+    (".space -1", "Negative size: .space -1"),
+    (".space 1, 2", ".space takes a single value"),
+    (".asciiz 1", ".asciiz takes a string"),
+    (".incbin 1", ".incbin takes a file name"),
+    ('.incbin "missing.bin"', "Cannot include missing.bin: No such file or directory"),
+])
+def test_errors(tmp_path, monkeypatch, mode, decl, error):
+    monkeypatch.chdir(tmp_path)
+
+    with pytest.raises(Exception, match=f"^line 3: {error}$"):
+        assemble(tmp_path, f".data\n.byte 0\n{decl}\n.text\nnop\n", mode)
+
+SOURCE = """.data
+s: .asciiz "a\\n\\"b"
+sp: .space 5
+inc: .incbin "blob.bin"
+empty: .incbin "empty.bin"
+after: .byte 9
+@0x40
+end: .half 7
+.text
+    la $t0, s
+    la $t1, sp
+    la $t2, inc
+    la $t3, empty
+    la $t4, after
+    la $t5, end
+"""
+
+def test_label_addresses(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "blob.bin").write_bytes(b"ab\0c")
+    (tmp_path / "empty.bin").write_bytes(b"")
+
+    ram, rom = assemble_to_images(SOURCE)
+
+    # the escapes are one byte each, .space and .incbin take their size
+    assert ram.labels == {"s": 0, "sp": 5, "inc": 10, "empty": 14, "after": 14, "end": 0x40}
+    assert ram.read(0, 15) == b'a\n"b\0' + bytes(5) + b"ab\0c\x09"
+
+@pytest.mark.parametrize("source", [SOURCE, ".data\nw: .word 1, 2\nh: .half 3\n.space 3\nb: .byte 1, 2, 3\n.text\n    la $t0, b\n"])
+def test_modes_agree(tmp_path, monkeypatch, source):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "blob.bin").write_bytes(bytes(range(40)))
+    (tmp_path / "empty.bin").write_bytes(b"")
+
+    outputs = [assemble(tmp_path, source, mode) for mode in MODES]
+    assert outputs[0] == outputs[1] == outputs[2]
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+from os import path
+import pytest
+
+MIPSASM = path.join(path.dirname(path.dirname(path.abspath(__file__))), "mipsasm.py")
+
+SOURCE = """.data
+table: .word 1, 2, 3
+@0x20000
+big: .word 7
+.text
+main:
+    la $s0, table
+    la $s1, big
+    li $t0, 0x12345678
+    lw $t1, 4($s0)
+loop:
+    addiu $t1, $t1, -1
+    blt $t1, 5, done
+    bne $t1, $zero, loop
+done:
+    jal sub
+    j far
+unused:
+    sll $t2, $t1, 3
+sub:
+    not $t3, $t1
+    jr $ra
+@0x10000
+far:
+    beq $zero, $zero, main
+@0x4000000
+region:
+    jr $ra
+"""
+
+def mipsasm(cwd, *args):
+    result = subprocess.run([sys.executable, MIPSASM, *args], cwd=cwd, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_round_trip(tmp_path):
+    pytest.importorskip("numpy")
+    (tmp_path / "prog.s").write_text(SOURCE)
+
+    mipsasm(tmp_path, "prog.s", "-rom-out", "rom.mem", "-elf", "prog.elf")
+    source = mipsasm(tmp_path, "-disasm", "rom.mem", "-symbols", "prog.elf")
+
+    # the labels come back by name, the data ones aren't code
+    for label in ("main", "loop", "done", "unused", "sub", "far", "region"):
+        assert f"\n{label}:\n" in source
+    assert "table:" not in source
+
+    (tmp_path / "back.s").write_text(source)
+    mipsasm(tmp_path, "back.s", "-rom-out", "back.mem")
+
+    assert (tmp_path / "back.mem").read_text() == (tmp_path / "rom.mem").read_text()
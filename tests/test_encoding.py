@@ -0,0 +1,86 @@
+import pytest
+import mips.isa as isa
+from mips.assembler import assemble_to_images
+
+# every row of the ISA table with its word from the green sheet, each
+# assembled at word 1 after the label L
+ROWS = [
+    ("add $t0, $t1, $t2", "012a4020"),
+    ("addi $t0, $t1, -5", "2128fffb"),
+    ("addiu $t0, $t1, 300", "2528012c"),
+    ("addu $t0, $t1, $t2", "012a4021"),
+    ("and $t0, $t1, $t2", "012a4024"),
+    ("andi $t0, $t1, 0xff", "312800ff"),
+    ("beq $t0, $t1, L", "1109ffff"),
+    ("bgez $t0, L", "0501ffff"),
+    ("bltz $t0, L", "0500ffff"),
+    ("bne $t0, $t1, L", "1509ffff"),
+    ("div $t0, $t1", "0109001a"),
+    ("divu $t0, $t1", "0109001b"),
+    ("j L", "08000000"),
+    ("jal L", "0c000000"),
+    ("jalr $t0", "0100f809"),
+    ("jalr $t1, $t0", "01004809"),
+    ("jr $ra", "03e00008"),
+    ("lb $t0, -4($t1)", "8128fffc"),
+    ("lbu $t0, 4($t1)", "91280004"),
+    ("lh $t0, 6($t1)", "85280006"),
+    ("lhu $t0, 8($t1)", "95280008"),
+    ("ll $t0, 12($t1)", "c128000c"),
+    ("lui $t0, 0x1234", "3c081234"),
+    ("lw $t0, 16($t1)", "8d280010"),
+    ("mfhi $t0", "00004010"),
+    ("mflo $t0", "00004012"),
+    ("mult $t0, $t1", "01090018"),
+    ("multu $t0, $t1", "01090019"),
+    ("nor $t0, $t1, $t2", "012a4027"),
+    ("or $t0, $t1, $t2", "012a4025"),
+    ("ori $t0, $t1, 0x7001", "35287001"),
+    ("slt $t0, $t1, $t2", "012a402a"),
+    ("slti $t0, $t1, -1", "2928ffff"),
+    ("sltiu $t0, $t1, 7", "2d280007"),
+    ("sltu $t0, $t1, $t2", "012a402b"),
+    ("sll $t0, $t1, 3", "000940c0"),
+    ("sra $t0, $t1, 31", "000947c3"),
+    ("srl $t0, $t1, 1", "00094042"),
+    ("sb $t0, 1($t1)", "a1280001"),
+    ("sc $t0, 0($t1)", "e1280000"),
+    ("sh $t0, 2($t1)", "a5280002"),
+    ("sw $t0, -8($t1)", "ad28fff8"),
+    ("sub $t0, $t1, $t2", "012a4022"),
+    ("subu $t0, $t1, $t2", "012a4023"),
+    ("nop", "00000000"),
+]
+
+def words(source, batch=False):
+    _, rom = assemble_to_images(".text\nL:\n    nop\n" + source + "\n", batch=batch)
+    return [bytes(data[i:i + 4]).hex() for _, data in rom.views() for i in range(0, len(data), 4)][1:]
+
+def test_every_row():
+    covered = {source.split()[0] for source, _ in ROWS}
+    assert covered == {row[0] for row in isa.ISA}
+
+@pytest.mark.parametrize("source, word", ROWS)
+@pytest.mark.parametrize("batch", [False, True])
+def test_encoding(source, word, batch):
+    assert words("    " + source, batch) == [word]
+
+    # and back
+    assert isa.decode(int(word, 16)).mnemonic == source.split()[0]
+
+@pytest.mark.parametrize("source, expected", [
+    ("not $t0, $t1", ["01204027"]),
+    ("blt $t0, 5, L", ["24010005", "0101082a", "1420fffd"]),
+    ("bge $t0, 5, L", ["24010005", "0101082a", "1020fffd"]),
+    ("bgt $t0, $t1, L", ["0128082a", "1420fffe"]),
+])
+def test_pseudoinstructions(source, expected):
+    assert words("    " + source) == expected
+
+def test_wrong_operands():
+    with pytest.raises(Exception, match=r"line 4: Wrong operands: add reg, reg, imm \(expected add reg, reg, reg\)"):
+        assemble_to_images(".text\nL:\n    nop\n    add $t0, $t1, 5\n")
+
+def test_unknown_instruction():
+    with pytest.raises(Exception, match="Unknown instruction: frob"):
+        assemble_to_images(".text\n    frob $t0\n")
@@ -0,0 +1,224 @@
+import struct
+import pytest
+from mips.assembler import assemble_to_images
+from mips.image import Image
+from mips.formats import parse_output, write_image, write_outputs, write_bin, write_ihex, write_srec, write_elf
+
+def image(addr, data):
+    im = Image()
+    im.write(addr, bytes(data))
+    return im
+
+def test_lanes(tmp_path):
+    # lane 0 holds the lowest address of every word
+    files = write_image(image(0, range(16)), str(tmp_path / "r{lane}.mem,lanes=4"))
+
+    assert files == [str(tmp_path / f"r{lane}.mem") for lane in range(4)]
+    assert (tmp_path / "r0.mem").read_text() == "00\n04\n08\n0c\n"
+    assert (tmp_path / "r3.mem").read_text() == "03\n07\n0b\n0f\n"
+
+    write_image(image(0, range(8)), str(tmp_path / "h{lane}.mem,lanes=2"))
+    assert (tmp_path / "h1.mem").read_text() == "0203\n0607\n"
+
+def test_banks(tmp_path):
+    files = write_image(image(0, range(16)), str(tmp_path / "b{bank}.mem,depth=2"))
+
+    assert files == [str(tmp_path / "b0.mem"), str(tmp_path / "b1.mem")]
+    assert (tmp_path / "b0.mem").read_text() == "00010203\n04050607\n"
+    assert (tmp_path / "b1.mem").read_text() == "08090a0b\n0c0d0e0f\n"
+
+def test_banks_and_lanes(tmp_path):
+    files = write_image(image(8, range(8)), str(tmp_path / "m{bank}_{lane}.memb,width=16,lanes=2,depth=4"))
+
+    # the words 4 to 7, all in bank 1
+    assert files == [str(tmp_path / "m1_0.memb"), str(tmp_path / "m1_1.memb")]
+    assert (tmp_path / "m1_0.memb").read_text() == "00000000\n00000010\n00000100\n00000110\n"
+
+def test_pad(tmp_path):
+    im = image(4, range(1, 5))
+
+    write_image(im, str(tmp_path / "p.mem,depth=4,pad"))
+    assert (tmp_path / "p.mem").read_text() == "00000000\n01020304\n00000000\n00000000\n"
+
+    # without pad, up to the last word placed
+    write_image(im, str(tmp_path / "n.mem,depth=4"))
+    assert (tmp_path / "n.mem").read_text() == "@1\n01020304\n"
+
+    write_image(im, str(tmp_path / "p.coe,depth=3,pad"))
+    assert (tmp_path / "p.coe").read_text() == "memory_initialization_radix=16;\nmemory_initialization_vector=\n00000000,\n01020304,\n00000000;\n"
+
+def test_depth(tmp_path):
+    write_image(image(4, range(1, 5)), str(tmp_path / "d.mif,depth=4"))
+
+    assert (tmp_path / "d.mif").read_text() == ("WIDTH=32;\nDEPTH=4;\n\nADDRESS_RADIX=HEX;\nDATA_RADIX=HEX;\n\n"
+        "CONTENT BEGIN\n\t[0..0] : 0;\n\t1 : 01020304;\n\t[2..3] : 0;\nEND;\n")
+
+@pytest.mark.parametrize("spec, error", [
+    ("r.mem,width=8,lanes=2", "Can't split 8 bit words in 2 lanes"),
+    ("r{lane}.mem,width=24", "Can't split 24 bit words in 1 lanes"),
+    ("r{lane}.mem,width=32,lanes=3", "Can't split 32 bit words in 3 lanes"),
+    ("r.mem,lanes=2", "r.mem must contain {lane} to write 2 lanes"),
+    ("r.mem,depth=0", "Bank depth must be positive: 0"),
+    ("r.mem,size=2", "Unknown output option: size"),
+    ("r.bin,depth=2", "r.bin: options are only for .mem, .memb, .coe and .mif"),
+])
+def test_bad_options(spec, error):
+    # found when the outputs are given, before anything is assembled
+    with pytest.raises(Exception, match=error.replace("{", r"\{").replace("}", r"\}")):
+        parse_output(spec)
+
+def test_bank_template_before_writing(tmp_path):
+    ram, rom = image(0, range(16)), image(0, range(4))
+    outputs = [("rom", str(tmp_path / "rom.hex")), ("ram", str(tmp_path / "ram.mem,depth=2"))]
+
+    with pytest.raises(Exception, match="must contain {bank}, the image doesn't fit in one bank of 2 words"):
+        write_outputs(ram, rom, outputs)
+
+    assert not (tmp_path / "rom.hex").exists()
+
+    # a single bank needs no {bank}
+    assert write_outputs(image(0, range(8)), rom, outputs) == [str(tmp_path / "rom.hex"), str(tmp_path / "ram.mem")]
+
+def regions():
+    # a record across a 64K boundary, odd sizes and addresses, and a
+    # region past 16MB
+    im = Image()
+    im.write(0x10, bytes(range(40)))
+    im.write(0xFFF8, bytes(range(100, 120)))
+    im.write(0x20003, b"\xff")
+    im.write(0x1000000, bytes(range(33)))
+    return im
+
+def same(back, image):
+    assert back.extents == image.extents
+
+    for addr, data in image.extents:
+        assert back.read(addr, len(data)) == image.read(addr, len(data))
+
+def read_ihex(file):
+    image, upper = Image(), 0
+
+    for line in open(file).read().splitlines():
+        record = bytes.fromhex(line[1:])
+        assert line[0] == ":" and sum(record) & 0xFF == 0
+        count, addr, kind = record[0], int.from_bytes(record[1:3], 'big'), record[3]
+        data = record[4:-1]
+        assert len(data) == count
+
+        if kind == 4:
+            upper = int.from_bytes(data, 'big')
+        elif kind == 0:
+            assert (addr & 0xFFFF) + count <= 0x10000
+            image.write((upper << 16) | addr, data)
+        else:
+            assert kind == 1 and line == ":00000001FF"
+
+    return image
+
+def read_srec(file):
+    image, records, lines = Image(), 0, open(file).read().splitlines()
+
+    for line in lines:
+        kind, body = int(line[1]), bytes.fromhex(line[2:])
+        assert line[0] == "S" and (sum(body[:-1]) + body[-1]) & 0xFF == 0xFF and body[0] == len(body) - 1
+
+        if kind in (1, 2, 3):
+            width = kind + 1
+            image.write(int.from_bytes(body[1:1 + width], 'big'), body[1 + width:-1])
+            records = records + 1
+        elif kind in (5, 6):
+            assert int.from_bytes(body[1:-1], 'big') == records
+
+    assert lines[0].startswith("S0") and lines[-1][1] in "789"
+    return image
+
+def test_ihex(tmp_path):
+    image = regions()
+
+    assert write_ihex(image, str(tmp_path / "r.hex")) == [str(tmp_path / "r.hex")]
+    same(read_ihex(tmp_path / "r.hex"), image)
+
+def test_srec(tmp_path):
+    image = regions()
+    write_srec(image, str(tmp_path / "r.srec"))
+
+    # 32 bit addresses for the region past 16MB
+    assert (tmp_path / "r.srec").read_text().splitlines()[1].startswith("S3")
+    same(read_srec(tmp_path / "r.srec"), image)
+
+    small = Image()
+    small.write(0x100, bytes(range(20)))
+    write_srec(small, str(tmp_path / "s.srec"))
+
+    assert [line[:2] for line in (tmp_path / "s.srec").read_text().splitlines()] == ["S0", "S1", "S1", "S5", "S9"]
+    same(read_srec(tmp_path / "s.srec"), small)
+
+def test_bin(tmp_path):
+    image = Image()
+    image.write(0x10, b"abc")
+    image.write(0x20, b"defg")
+
+    write_bin(image, str(tmp_path / "r.bin"))
+    assert (tmp_path / "r.bin").read_bytes() == image.read(0x10, 0x14)
+
+    # a file per region, named by its address
+    files = write_bin(regions(), str(tmp_path / "r{addr}.bin"))
+    back = Image()
+
+    for addr, data in regions().extents:
+        file = tmp_path / f"r{addr:08X}.bin"
+        assert str(file) in files
+        back.write(addr, file.read_bytes())
+
+    assert len(files) == 4
+    same(back, regions())
+
+def read_elf(file):
+    # (ram, rom, {symbol: (value, section address)}) from the program
+    # headers and the symbol table
+    elf = open(file, "rb").read()
+    ident, kind, machine, _, entry, phoff, shoff, _, _, phentsize, phnum, shentsize, shnum, shstrndx = \
+        struct.unpack_from(">16sHHIIIIIHHHHHH", elf)
+    assert ident[:7] == b"\x7fELF\x01\x02\x01" and (kind, machine) == (2, 8)
+
+    ram, rom = Image(), Image()
+    for i in range(phnum):
+        ptype, offset, vaddr, paddr, filesz, memsz, flags, _ = struct.unpack_from(">IIIIIIII", elf, phoff + i * phentsize)
+        assert ptype == 1 and vaddr == paddr and filesz == memsz
+        (rom if flags & 1 else ram).write(vaddr, elf[offset:offset + filesz])
+
+    sections = [struct.unpack_from(">IIIIIIIIII", elf, shoff + i * shentsize) for i in range(shnum)]
+    symtab = next(section for section in sections if section[1] == 2)
+    strtab = sections[symtab[6]]
+
+    symbols = dict()
+    for pos in range(symtab[4] + 16, symtab[4] + symtab[5], 16):
+        name, value, _, _, _, shndx = struct.unpack_from(">IIIBBH", elf, pos)
+        name = elf[strtab[4] + name:elf.index(b"\0", strtab[4] + name)].decode()
+        symbols[name] = (value, sections[shndx][3] if shndx < len(sections) else None)
+
+    return ram, rom, entry, symbols
+
+def test_elf(tmp_path):
+    ram, rom = assemble_to_images(""".data
+a: .word 1, 2
+@0x100
+b: .byte 3
+.text
+    la $s0, a
+    j far
+@0x40
+far:
+    lw $t0, 0($s0)
+end:
+    j end
+""")
+    write_elf(ram, rom, str(tmp_path / "p.elf"))
+    ram1, rom1, entry, symbols = read_elf(tmp_path / "p.elf")
+
+    same(ram1, ram)
+    same(rom1, rom)
+    assert entry == 0
+
+    # text labels in bytes, each in the section of its region
+    assert symbols == {"far": (0x100, 0x100), "end": (0x104, 0x100), "a": (0, 0), "b": (0x100, 0x100)}
@@ -0,0 +1,117 @@
+import pytest
+from mips.assembler import Assembler
+from mips.incremental import IncrementalAssembler
+
+BASE = """.data
+count: .word 3
+msg: .asciiz "hi"
+table: .word 1, 2, 3
+.text
+main:
+    la $s0, table
+    lw $t0, 0($s0)
+    li $t1, 0
+loop:
+    addu $t1, $t1, $t0
+    addiu $t0, $t0, -1
+    bne $t0, $zero, loop
+    la $s1, count
+    sw $t1, 0($s1)
+    jal sub
+    j halt
+sub:
+    la $t3, msg
+    lbu $t2, 0($t3)
+    jr $ra
+@0x40
+halt:
+    j halt
+"""
+
+# edits of BASE, as (old, new) replacements
+EDITS = {
+    "same size": [("li $t1, 0", "li $t1, 5")],
+    "shrink": [("    addiu $t0, $t0, -1\n", "")],
+    "grow": [("    li $t1, 0\n", "    li $t1, 0\n    nop\n    li $t2, 0x12345\n")],
+    "grow data": [("table: .word 1, 2, 3", "table: .word 1, 2, 3, 4, 5")],
+    "shrink data": [('msg: .asciiz "hi"', 'msg: .byte 7')],
+    "rename": [("loop", "again")],
+    "rename one": [("loop:", "again:"), ("bne $t0, $zero, loop", "bne $t0, $zero, again")],
+    "move": [("@0x40", "@0x80")],
+    "new addr": [("sub:\n", "@0x20\nsub:\n")],
+    "far": [("@0x40", "@0x10000")],
+}
+
+ERRORS = {
+    "undefined": ([("j halt\nsub", "j nowhere\nsub")], "Label is not defined: nowhere"),
+    "twice": ([("sub:\n", "sub:\nloop:\n")], "Label is already defined: loop"),
+    "operands": ([("li $t1, 0", "li $t1, $t0")], "Wrong operands"),
+    "overlap": ([("@0x40", "@0x8")], "Overlapping placement at @8"),
+    "range": ([("addiu $t0, $t0, -1", "addiu $t0, $t0, 70000")], "out of range"),
+}
+
+def edit(source, edits):
+    for old, new in edits:
+        assert old in source
+        source = source.replace(old, new)
+
+    return source
+
+def clean(tmp_path, source):
+    ram, rom = tmp_path / "clean.ram", tmp_path / "clean.rom"
+    asm = Assembler(str(ram), str(rom))
+    asm.assemble(source)
+    asm.finalize()
+    return ram.read_text(), rom.read_text()
+
+def outputs(tmp_path):
+    return (tmp_path / "inc.ram").read_text(), (tmp_path / "inc.rom").read_text()
+
+@pytest.fixture
+def inc(tmp_path):
+    inc = IncrementalAssembler(str(tmp_path / "inc.ram"), str(tmp_path / "inc.rom"))
+    inc.assemble(BASE)
+    assert inc.last_mode == "clean"
+    return inc
+
+@pytest.mark.parametrize("name", EDITS)
+def test_edit(tmp_path, inc, name):
+    # an edit and back, each as a clean build would give them
+    source = edit(BASE, EDITS[name])
+
+    inc.assemble(source)
+    assert outputs(tmp_path) == clean(tmp_path, source)
+
+    inc.assemble(BASE)
+    assert outputs(tmp_path) == clean(tmp_path, BASE)
+
+def test_incremental(tmp_path, inc):
+    inc.assemble(edit(BASE, EDITS["same size"]))
+
+    assert inc.last_mode == "incremental"
+    assert inc.last_parsed < 5
+    assert outputs(tmp_path) == clean(tmp_path, edit(BASE, EDITS["same size"]))
+
+def test_edits_in_a_row(tmp_path, inc):
+    source = BASE
+
+    for name in EDITS:
+        source = edit(source, EDITS[name]) if all(old in source for old, _ in EDITS[name]) else source
+        inc.assemble(source)
+        assert outputs(tmp_path) == clean(tmp_path, source), name
+
+@pytest.mark.parametrize("name", ERRORS)
+def test_error(tmp_path, inc, name):
+    # the error of a clean build, then back to work
+    edits, error = ERRORS[name]
+    source = edit(BASE, edits)
+
+    with pytest.raises(Exception, match=error) as clean_error:
+        clean(tmp_path, source)
+    with pytest.raises(Exception) as inc_error:
+        inc.assemble(source)
+
+    assert str(inc_error.value) == str(clean_error.value)
+
+    inc.assemble(BASE)
+    assert outputs(tmp_path) == clean(tmp_path, BASE)
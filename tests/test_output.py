@@ -0,0 +1,77 @@
+import os
+import pytest
+from mips import output
+from mips.output import OutputFile, SIDECAR_SIZE, write_depfile
+
+def write(file, data, binary=False):
+    with OutputFile(str(file), binary=binary) as f:
+        f.write(data)
+
+    return f.changed
+
+def test_mtime_kept(tmp_path):
+    file = tmp_path / "rom.mem"
+    assert write(file, "00000000\n")
+    os.utime(file, ns=(10 ** 9, 10 ** 9))
+
+    assert not write(file, "00000000\n")
+    assert file.stat().st_mtime_ns == 10 ** 9
+
+    assert write(file, "00000001\n")
+    assert file.stat().st_mtime_ns != 10 ** 9
+    assert file.read_text() == "00000001\n"
+
+def test_sidecar(tmp_path, monkeypatch):
+    file, sidecar = tmp_path / "rom.bin", tmp_path / ".rom.bin.sha256"
+    data = bytes(SIDECAR_SIZE)
+    write(file, data, True)
+
+    assert sidecar.read_text().split()[1:] == [str(SIDECAR_SIZE), str(file.stat().st_mtime_ns)]
+
+    # a change is told by the sidecar without reading the old file
+    hashed = []
+    hash_file = output._hash_file
+    monkeypatch.setattr(output, "_hash_file", lambda name: hashed.append(name) or hash_file(name))
+
+    assert write(file, b"\1" + data[1:], True)
+    assert hashed == []
+
+    # the same contents are checked on the file
+    assert not write(file, b"\1" + data[1:], True)
+    assert hashed == [str(file)]
+
+    # small again, no sidecar
+    assert write(file, b"small", True)
+    assert not sidecar.exists()
+
+def test_stale_sidecar(tmp_path):
+    # changed behind the sidecar's back, same size and mtime
+    file = tmp_path / "rom.bin"
+    data = bytes(SIDECAR_SIZE)
+    write(file, data, True)
+    st = file.stat()
+
+    with open(file, "r+b") as f:
+        f.write(b"\1")
+    os.utime(file, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    assert write(file, data, True)
+    assert file.read_bytes() == data
+
+def test_discard(tmp_path):
+    file = tmp_path / "rom.mem"
+    write(file, "old\n")
+
+    with pytest.raises(ValueError):
+        with OutputFile(str(file)) as f:
+            f.write("new\n")
+            raise ValueError()
+
+    assert f.changed is False
+    assert file.read_text() == "old\n"
+    assert os.listdir(tmp_path) == ["rom.mem"]
+
+def test_depfile(tmp_path):
+    write_depfile(str(tmp_path / "out.d"), ["out dir/rom.mem", "a#b.mem"], ["x$y.s", "c\\d.s"])
+
+    assert (tmp_path / "out.d").read_text() == "out\\ dir/rom.mem a\\#b.mem: x$$y.s c\\\\d.s\n"
@@ -0,0 +1,66 @@
+import pytest
+from array import array
+from mips.assembler import Assembler, Context, FirstPass
+from mips.image import Image, ImageWriter
+from mips.incremental import IncrementalAssembler, _walk
+from mips.parallel_parse import parse_program
+from mips.scanner import parse
+
+def assemble(tmp_path, source, mode):
+    asm = Assembler(str(tmp_path / "ram.mem"), str(tmp_path / "rom.mem"), batch=mode == "batch")
+
+    try:
+        if mode == "stream":
+            asm.assemble_stream(source.splitlines(keepends=True))
+        else:
+            asm.assemble(source)
+    finally:
+        asm.finalize()
+
+MODES = ["table", "batch", "stream"]
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("source, error", [
+    (".data\n.word 1\n@0x2\n.word 2\n.text\nnop\n", "line 4: Overlapping placement at @2"),
+    (".data\n@0x8\n.word 1\n@0x4\n.space 5\n.text\nnop\n", "line 5: Overlapping placement at @8"),
+    (".text\nnop\nnop\n@0x1\nnop\n", "line 5: Overlapping placement at @1"),
+])
+def test_overlap(tmp_path, mode, source, error):
+    with pytest.raises(Exception, match=error):
+        assemble(tmp_path, source, mode)
+
+@pytest.mark.parametrize("mode", MODES)
+def test_adjacent(tmp_path, mode):
+    # placed right after or before what was written is no overlap
+    assemble(tmp_path, ".data\n@0x8\n.word 1\n@0x4\n.word 2\n@0xC\n.byte 3\n.text\nnop\n", mode)
+
+TEXT_LABELS = ".data\nD: .word 1, 2, 3\n.text\n    nop\nL:\n    beq $0, $0, L\n    j L\n    la $t0, L\n"
+
+def test_first_pass_labels():
+    # a label in .text has the address of the code, not the data address
+    # at that point (12 here), in each walk over the program
+    ctx = Context(ImageWriter(Image()), ImageWriter(Image(4)))
+    FirstPass(ctx).run(parse_program(TEXT_LABELS, False))
+    assert ctx._labels == {"D": 0, "L": 1}
+
+    ctx = Context(ImageWriter(Image()), ImageWriter(Image(4)))
+    for segm in parse(TEXT_LABELS):
+        segm.accept(FirstPass(ctx))
+    assert ctx._labels == {"D": 0, "L": 1}
+
+    labels = dict()
+    program = parse_program(TEXT_LABELS, False)
+    _walk(program, 0, len(program), ('data', 0, 0), labels, array('q'))
+    assert labels == {"D": 0, "L": 1}
+
+@pytest.mark.parametrize("mode", MODES + ["incremental"])
+def test_text_labels(tmp_path, mode):
+    # branch, jump and la of L, with L at word 1 and not at byte 12
+    source = TEXT_LABELS
+
+    if mode == "incremental":
+        IncrementalAssembler(str(tmp_path / "ram.mem"), str(tmp_path / "rom.mem")).assemble(source)
+    else:
+        assemble(tmp_path, source, mode)
+
+    assert (tmp_path / "rom.mem").read_text().split() == ["00000000", "10000000", "08000001", "34080001"]
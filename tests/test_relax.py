@@ -0,0 +1,153 @@
+import pytest
+from mips.assembler import Assembler, assemble_to_images
+from mips.simulator import Simulator
+
+HALT = "\nhalt:\n    j halt\n"
+
+def words(image):
+    return [bytes(data[i:i + 4]).hex() for _, data in image.views() for i in range(0, len(data), 4)]
+
+def run(ram, rom):
+    sim = Simulator(ram, rom)
+    sim.run(100000)
+    assert sim.halted
+    return sim
+
+def test_li_la_sizes():
+    ram, rom = assemble_to_images(""".data
+small: .word 5
+@0x20000
+big: .word 7
+.text
+    la $s0, small
+    la $s1, big
+    li $s2, -1
+    li $s3, 0x12345
+    lw $s4, 0($s1)
+    li $s5, 0x50000
+""" + HALT)
+
+    # la big and li 0x12345 take two words, li 0x50000 is a lui
+    assert rom.labels["halt"] == 8
+    assert words(rom)[1:8] == ["3c110002", "36310000", "2412ffff", "3c130001", "36732345", "8e340000", "3c150005"]
+
+    regs = run(ram, rom).regs
+    assert regs[16] == 0
+    assert regs[17] == 0x20000
+    assert regs[18] == 0xFFFFFFFF
+    assert regs[19] == 0x12345
+    assert regs[20] == 7
+    assert regs[21] == 0x50000
+
+def test_li():
+    # lui clears the lower half, ori fills it
+    ram, rom = assemble_to_images(".text\n    li $t0, 0x12345678\n    li $t1, 0x8000\n    li $t2, -32768\n    li $t3, 0xFFFF0000\n")
+    assert words(rom) == ["3c081234", "35085678", "34098000", "240a8000", "3c0bffff"]
+
+@pytest.mark.parametrize("branch", ["beq $t0, $t0", "bne $t0, $0", "blt $0, $t0"])
+def test_far_branch(branch):
+    ram, rom = assemble_to_images(f""".text
+    li $t0, 1
+    {branch}, far
+    li $s0, 99
+back:
+    li $s1, 2
+    j halt
+@0x10000
+far:
+    li $s2, 3
+    j back
+""" + HALT)
+
+    # the opposite branch over a j
+    size = 3 if branch.startswith("blt") else 2
+    assert rom.labels["back"] == 2 + size
+
+    regs = run(ram, rom).regs
+    assert (regs[16], regs[17], regs[18]) == (0, 2, 3)
+
+def test_far_branch_not_taken():
+    ram, rom = assemble_to_images(""".text
+    li $t0, 1
+    beq $t0, $0, far
+    li $s0, 1
+    j halt
+@0x10000
+far:
+    li $s0, 2
+""" + HALT)
+
+    assert run(ram, rom).regs[16] == 1
+
+def test_far_jump():
+    ram, rom = assemble_to_images(""".text
+    jal far
+    li $s1, 2
+    j halt
+@0x4000000
+far:
+    li $s0, 1
+    jr $ra
+""" + HALT)
+
+    # jal far is la $at + jalr $at, j halt la $at + jr $at
+    assert rom.labels["halt"] == 0x4000000 + 2
+    assert len(rom.extents[0][1]) == 7 * 4
+
+    regs = run(ram, rom).regs
+    assert (regs[16], regs[17]) == (1, 2)
+
+def cascade():
+    # the branch reaches target until the la before it grows
+    return """.data
+@0x20000
+big: .word 7
+.text
+    beq $0, $0, target
+    la $s0, big
+""" + "    nop\n" * 0x7FFD + """target:
+    li $s1, 1
+""" + HALT
+
+def test_cascade():
+    ram, rom = assemble_to_images(cascade())
+
+    assert rom.labels["target"] == 0x8001
+    assert run(ram, rom).regs[17] == 1
+
+MIXED = """.data
+small: .word 5
+@0x20000
+big: .word 7
+.text
+    la $s0, big
+    bge $s0, $0, far
+    jal region
+    j halt
+@0x10000
+far:
+    li $s1, 0x12345
+    j region
+@0x4000000
+region:
+    jr $ra
+""" + HALT
+
+@pytest.mark.parametrize("source", [cascade(), MIXED])
+def test_paths_agree(tmp_path, source):
+    # the program table, the batch encoder and -stream give the same files
+    outputs = []
+
+    for mode in ("table", "batch", "stream"):
+        ram, rom = tmp_path / f"{mode}.ram", tmp_path / f"{mode}.rom"
+        asm = Assembler(str(ram), str(rom), batch=mode == "batch")
+
+        if mode == "stream":
+            asm.assemble_stream(source.splitlines(keepends=True))
+        else:
+            asm.assemble(source)
+
+        asm.finalize()
+        outputs.append((ram.read_text(), rom.read_text()))
+
+    assert outputs[0] == outputs[1] == outputs[2]
@@ -0,0 +1,160 @@
+import random
+import pytest
+from mips.assembler import Assembler, assemble_to_images
+from mips.simulator import simulate
+
+SOURCE = """.data
+a: .word 3, 4, 5, 6
+.text
+main:
+    la $s0, a
+    lw $t0, 0($s0)
+    addu $t1, $t0, $t0
+    lw $t2, 4($s0)
+    addu $t3, $t2, $t1
+    addiu $s1, $zero, 7
+    addiu $s2, $zero, 8
+    sw $t3, 8($s0)
+    lw $t4, 8($s0)
+    addu $t5, $t4, $s1
+    lw $t6, 12($s0)
+    beq $t6, $zero, main
+    mult $t5, $s2
+    li $a0, 0x12345678
+    mflo $v0
+halt:
+    j halt
+"""
+
+def words(image):
+    return [bytes(data) for _, data in image.views()]
+
+def assemble(tmp_path, source, **kwargs):
+    asm = Assembler(str(tmp_path / "ram.mem"), str(tmp_path / "rom.mem"), **kwargs)
+    asm.assemble(source)
+    asm.finalize()
+    return asm
+
+def test_stalls_removed(tmp_path):
+    schedule = assemble(tmp_path, SOURCE, schedule=True).schedule
+
+    assert schedule.stalls == 4
+    assert schedule.removed == 4
+    assert str(schedule).startswith("4 of 4 load-use stalls removed")
+
+def test_same_results():
+    ram, rom = assemble_to_images(SOURCE)
+    ram1, rom1 = assemble_to_images(SOURCE, schedule=True)
+
+    # reordered, with the labels where they were
+    assert words(rom) != words(rom1)
+    assert rom.labels == rom1.labels
+
+    before, after = simulate(ram, rom), simulate(ram1, rom1)
+    assert list(before.regs) == list(after.regs)
+    assert before.ram.load(8, 4) == after.ram.load(8, 4) == 4 + 3 + 3
+
+def test_nothing_to_do(tmp_path):
+    source = ".text\n    lw $t0, 0($0)\n    nop\n    addu $t1, $t0, $t0\nhalt:\n    j halt\n"
+    asm = assemble(tmp_path, source, schedule=True)
+
+    assert (asm.schedule.stalls, asm.schedule.moved) == (0, 0)
+
+REGS = ["$t0", "$t1", "$t2", "$t3", "$a0", "$v0", "$s1"]
+
+def generate(rnd):
+    # blocks of loads, stores and arithmetic, some ending in a branch
+    # further on
+    lines = [".data", "d: .word " + ", ".join(str(rnd.randint(0, 99)) for _ in range(32)), ".text", "    la $s0, d"]
+    reg = lambda: rnd.choice(REGS)
+    blocks = rnd.randint(1, 6)
+
+    for block in range(blocks):
+        lines.append(f"B{block}:")
+
+        for _ in range(rnd.randint(1, 20)):
+            lines.append("    " + rnd.choice([
+                f"lw {reg()}, {4 * rnd.randint(0, 31)}($s0)",
+                f"lbu {reg()}, {rnd.randint(0, 127)}($s0)",
+                f"sw {reg()}, {4 * rnd.randint(0, 31)}($s0)",
+                f"sb {reg()}, {rnd.randint(0, 127)}($s0)",
+                f"addu {reg()}, {reg()}, {reg()}",
+                f"addiu {reg()}, {reg()}, {rnd.randint(-50, 50)}",
+                f"sll {reg()}, {reg()}, {rnd.randint(0, 5)}",
+                f"mult {reg()}, {reg()}",
+                f"mflo {reg()}",
+                f"li {reg()}, {rnd.randint(-70000, 70000)}",
+                f"sc {reg()}, {4 * rnd.randint(0, 31)}($s0)",
+            ]))
+
+        if rnd.random() < 0.5:
+            target = rnd.randint(block + 1, blocks)
+            lines.append(f"    beq {reg()}, {reg()}, {f'B{target}' if target < blocks else 'halt'}")
+
+    lines += ["halt:", "    j halt"]
+    return "\n".join(lines) + "\n"
+
+@pytest.mark.parametrize("seed", range(50))
+@pytest.mark.parametrize("batch", [False, True])
+def test_random_programs(seed, batch):
+    source = generate(random.Random(seed))
+    ram, rom = assemble_to_images(source)
+    ram1, rom1 = assemble_to_images(source, batch=batch, schedule=True)
+    before, after = simulate(ram, rom, 10000), simulate(ram1, rom1, 10000)
+
+    assert before.halted and after.halted
+    assert list(before.regs) == list(after.regs)
+    assert [before.ram.load(4 * i, 4) for i in range(32)] == [after.ram.load(4 * i, 4) for i in range(32)]
+
+DELAY = """.text
+    li $t0, 3
+    li $s0, 0
+loop:
+    addiu $s1, $s1, 2
+    addiu $t0, $t0, -1
+    bne $t0, $0, loop
+    jal sub
+    j halt
+sub:
+    addu $s0, $s0, $s1
+    jr $ra
+halt:
+    j halt
+"""
+
+def test_delay_slots(tmp_path):
+    asm = assemble(tmp_path, DELAY, delay_slots=True)
+
+    # the addiu $s1 and the addu go into slots, the jal, the j and the
+    # halt loop get nops
+    assert (asm.schedule.filled, asm.schedule.slots) == (2, 5)
+    assert str(asm.schedule) == "2 of 5 delay slots filled"
+
+    ram, rom = asm.images
+    words = [bytes(data[i:i + 4]).hex() for _, data in rom.views() for i in range(0, len(data), 4)]
+    assert words[3:5] == ["1500ffff", "26310002"]
+    assert rom.labels["halt"] == 11
+
+    sim = simulate(ram, rom, delay_slots=True)
+    assert (sim.regs[16], sim.regs[17]) == (6, 6)
+
+@pytest.mark.parametrize("seed", range(30))
+@pytest.mark.parametrize("batch", [False, True])
+def test_delay_slots_random(seed, batch):
+    # the same results as without delay slots, with calls and far branches
+    rnd = random.Random(seed)
+    source = generate(rnd)
+
+    if rnd.random() < 0.5:
+        source = source.replace("halt:\n", "    jal sub\n    blt $t0, $t1, halt\n    j halt\nsub:\n    lw $t3, 0($s0)\n    jr $ra\nhalt:\n")
+    if rnd.random() < 0.5:
+        source = source.replace("halt:\n", "    j halt\n@0x10000\nhalt:\n")
+
+    ram, rom = assemble_to_images(source)
+    ram1, rom1 = assemble_to_images(source, batch=batch, schedule=seed % 2 == 0, delay_slots=True)
+    before, after = simulate(ram, rom, 10000), simulate(ram1, rom1, 10000, delay_slots=True)
+
+    assert before.halted and after.halted
+    # $at and $ra hold other addresses
+    assert before.regs[2:31] == after.regs[2:31]
+    assert [before.ram.load(4 * i, 4) for i in range(32)] == [after.ram.load(4 * i, 4) for i in range(32)]
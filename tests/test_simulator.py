@@ -0,0 +1,223 @@
+import pytest
+from mips.assembler import assemble_to_images
+from mips.image import Image
+from mips.simulator import Simulator, simulate, HI, LO
+
+ROM_BASE = 0x10000000
+
+def run(source, **kwargs):
+    ram, rom = assemble_to_images(".text\n" + source + "\nhalt:\n    j halt\n")
+    sim = Simulator(ram, rom, **kwargs)
+    sim.run(100000)
+    assert sim.halted
+    return sim
+
+def reg(n):
+    # a register as a signed value
+    return n - (1 << 32) if n & 0x80000000 else n
+
+def test_alu():
+    sim = run("""
+    li $t0, 7
+    li $t1, -3
+    addu $s0, $t0, $t1
+    subu $s1, $t1, $t0
+    and $s2, $t0, $t1
+    or $s3, $t0, $t1
+    nor $s4, $t0, $t1
+    slt $s5, $t1, $t0
+    sltu $s6, $t1, $t0
+    sra $s7, $t1, 1
+    srl $t2, $t1, 28
+    sll $t3, $t0, 30
+    li $t4, 0x12345678
+    """)
+    regs = sim.regs
+
+    assert regs[16] == 4
+    assert reg(regs[17]) == -10
+    assert regs[18] == 5
+    assert reg(regs[19]) == -1
+    assert regs[20] == 0
+    assert regs[21] == 1
+    assert regs[22] == 0
+    assert reg(regs[23]) == -2
+    assert regs[10] == 0xF
+    assert regs[11] == 0xC0000000
+    assert regs[12] == 0x12345678
+
+def test_branches():
+    sim = run("""
+    li $t0, 0
+    li $t1, 10
+    li $s0, 0
+loop:
+    addu $s0, $s0, $t0
+    addiu $t0, $t0, 1
+    bne $t0, $t1, loop
+    li $t2, -1
+    bltz $t2, neg
+    li $s1, 1
+neg:
+    bgez $t2, halt
+    li $s2, 2
+    jal sub
+    j halt
+sub:
+    li $s3, 3
+    jr $ra
+    """)
+    regs = sim.regs
+
+    assert regs[16] == 45
+    assert regs[17] == 0
+    assert regs[18] == 2
+    assert regs[19] == 3
+
+def test_hi_lo():
+    sim = run("""
+    li $t0, -6
+    li $t1, 4
+    mult $t0, $t1
+    mflo $s0
+    mfhi $s1
+    multu $t0, $t1
+    mfhi $s2
+    li $t2, -7
+    div $t2, $t1
+    mflo $s3
+    mfhi $s4
+    divu $t2, $t1
+    mflo $s5
+    """)
+    regs = sim.regs
+
+    assert reg(regs[16]) == -24
+    assert reg(regs[17]) == -1
+    assert regs[18] == 3
+    assert reg(regs[19]) == -1
+    assert reg(regs[20]) == -3
+    assert regs[21] == (0xFFFFFFF9 // 4)
+    assert regs[HI] == 0xFFFFFFF9 % 4
+    assert regs[LO] == regs[21]
+
+def test_overflow():
+    ram, rom = assemble_to_images(".text\nli $t0, 0x7FFFFFFF\naddiu $t1, $t0, 1\naddi $t2, $t0, 1\n")
+    sim = Simulator(ram, rom)
+
+    with pytest.raises(Exception, match="overflow"):
+        sim.run(100)
+
+    # addiu wraps, addi stops before writing
+    assert sim.regs[9] == 0x80000000
+    assert sim.regs[10] == 0
+
+def test_memory():
+    sim = run("""
+    li $t0, 0x100
+    li $t1, -2
+    sw $t1, 0($t0)
+    lb $s0, 3($t0)
+    lbu $s1, 3($t0)
+    lh $s2, 2($t0)
+    lhu $s3, 0($t0)
+    """)
+    regs = sim.regs
+
+    assert reg(regs[16]) == -2
+    assert regs[17] == 0xFE
+    assert reg(regs[18]) == -2
+    assert regs[19] == 0xFFFF
+
+def test_store_to_running_block():
+    # the store patches an instruction further on in its own block
+    sim = run(f"""
+    j go
+go:
+    li $s0, 0
+    li $t0, {ROM_BASE}
+    li $t1, 0x26100064
+    la $t2, inc
+    sll $t2, $t2, 2
+    addu $t2, $t2, $t0
+    sw $t1, 0($t2)
+    nop
+inc:
+    addiu $s0, $s0, 1
+    """, rom_base=ROM_BASE)
+
+    assert sim.regs[16] == 100
+
+def test_store_to_other_block():
+    # the patched block was decoded and cached by the first call
+    sim = run(f"""
+    li $s0, 0
+    jal inc
+    li $t0, {ROM_BASE}
+    li $t1, 0x26100064
+    la $t2, inc
+    sll $t2, $t2, 2
+    addu $t2, $t2, $t0
+    sw $t1, 0($t2)
+    jal inc
+    j halt
+inc:
+    addiu $s0, $s0, 1
+    jr $ra
+    """, rom_base=ROM_BASE)
+
+    assert sim.regs[16] == 101
+
+def test_write_rom():
+    ram, rom = assemble_to_images(".text\nli $s0, 1\nhalt:\nj halt\n")
+    sim = simulate(ram, rom)
+    assert sim.regs[16] == 1
+
+    # addiu $s0, $zero, 2 over the li, in the block the run stopped in
+    assert sim.write_rom(0, bytes.fromhex("24100002"))
+    assert not sim.write_rom(8, bytes(4))
+    sim.pc = 0
+    sim.run()
+    assert sim.regs[16] == 2
+
+def test_delay_slots():
+    # the slots are written out, the word after a branch or jump runs
+    # before its target and jal links past it
+    ram, rom = assemble_to_images(""".text
+    li $t0, 2
+loop:
+    addiu $t0, $t0, -1
+    bne $t0, $0, loop
+    addiu $s0, $s0, 1
+    jal sub
+    addiu $s1, $s1, 1
+    j halt
+    nop
+sub:
+    jr $ra
+    addiu $s2, $ra, 0
+halt:
+    j halt
+    nop
+""")
+    sim = simulate(ram, rom, delay_slots=True)
+
+    assert sim.halted
+    assert (sim.regs[16], sim.regs[17]) == (2, 1)
+    assert sim.regs[18] == sim.regs[31] == 6
+
+def test_branch_in_delay_slot():
+    ram, rom = assemble_to_images(".text\nj next\nnext:\nj next\n")
+
+    with pytest.raises(Exception, match="delay slot at @1"):
+        simulate(ram, rom, delay_slots=True)
+
+def test_lui():
+    # hand-encoded, lui clears the lower half
+    rom = Image(4)
+    rom.write(0, bytes.fromhex("3c081234" "35085678" "2409ffff" "3c090001" "08000004"))
+    sim = simulate(Image(), rom)
+
+    assert sim.halted
+    assert sim.regs[8] == 0x12345678
+    assert sim.regs[9] == 0x10000